@@ -0,0 +1,76 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+
+from main import Database
+
+
+def connect_per_query_allowed(db_path, user_id):
+    """Старый вариант: новое соединение на каждый запрос"""
+    with sqlite3.connect(db_path, check_same_thread=False) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id FROM allowed_users WHERE user_id = ?', (user_id,))
+        return cursor.fetchone() is not None
+
+
+def measure(label, func, queries):
+    started = time.perf_counter()
+    for i in range(queries):
+        func(i)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {queries / elapsed:>12,.0f} запросов/с")
+    return elapsed
+
+
+def concurrent_writes(db, threads, writes):
+    errors = []
+
+    def worker(offset):
+        for i in range(writes):
+            try:
+                db.add_allowed_user(offset * writes + i, 'bench', 0)
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(f"{'параллельные записи (' + str(threads) + ' потоков)':<40} {threads * writes / elapsed:>12,.0f} записей/с, ошибок: {len(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запросов в секунду: соединение на запрос против пула WAL")
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--writes', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        db = Database(db_path)
+        for user_id in range(1000):
+            db.add_allowed_user(user_id, 'bench', 0)
+
+        before = measure("is_user_allowed: соединение на запрос",
+                         lambda i: connect_per_query_allowed(db_path, i % 2000), args.queries)
+        after = measure("is_user_allowed: постоянное соединение",
+                        lambda i: db.is_user_allowed(i % 2000), args.queries)
+        print(f"ускорение: x{before / after:.1f}")
+
+        concurrent_writes(db, args.threads, args.writes)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
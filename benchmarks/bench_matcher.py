@@ -0,0 +1,54 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_shared_index import VOCABULARY, make_messages, random_word
+from matcher import KeywordMatcher
+
+
+def naive_matches(keywords, exceptions, text):
+    """Прежняя проверка подстрок: any(k in text)"""
+    text = text.lower()
+    return any(k in text for k in keywords) and not any(e in text for e in exceptions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фильтр одного пользователя против any(k in text)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--exceptions', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--words', type=int, default=40)
+    parser.add_argument('--hit-rate', type=float, default=0.0, help="доля ключевых слов из словаря сообщений")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = make_messages(rng, args.messages, args.words)
+
+    print(f"сообщений: {args.messages}, слов в сообщении: {args.words}")
+    for size in args.sizes:
+        keywords = [rng.choice(VOCABULARY) if rng.random() < args.hit_rate else random_word(rng) for _ in range(size)]
+        exceptions = [random_word(rng) for _ in range(args.exceptions)]
+        matcher = KeywordMatcher(keywords, exceptions)
+
+        started = time.perf_counter()
+        naive = [naive_matches(keywords, exceptions, message) for message in messages]
+        naive_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        compiled = [matcher.matches(message) for message in messages]
+        compiled_time = time.perf_counter() - started
+
+        assert naive == compiled, "результаты фильтра расходятся с any(k in text)"
+        print(
+            f"ключевых слов: {size:>5}  any(k in text): {naive_time / args.messages * 1e6:7.1f} мкс  "
+            f"KeywordMatcher: {compiled_time / args.messages * 1e6:7.1f} мкс"
+        )
+
+
+if __name__ == '__main__':
+    main()
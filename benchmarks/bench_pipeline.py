@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+
+from main import Database, SessionManager
+from notifier import NotificationDispatcher
+
+VOCABULARY = [
+    'москва', 'работа', 'квартира', 'продам', 'куплю', 'аренда', 'вакансия', 'доставка',
+    'ремонт', 'машина', 'телефон', 'ноутбук', 'скидка', 'акция', 'обмен', 'срочно',
+    'питер', 'казань', 'офис', 'удаленка', 'зарплата', 'опыт', 'курьер', 'водитель',
+]
+
+
+class StubPeer:
+    """Отправитель или чат в виде, в котором его отдает Telethon"""
+
+    def __init__(self, peer_id, username=None, first_name=None, title=None):
+        self.id = peer_id
+        self.username = username
+        self.first_name = first_name
+        self.title = title
+
+
+class StubMessage:
+    def __init__(self, message_id, text):
+        self.id = message_id
+        self.text = text
+        self.message = text
+        self.date = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+class StubEvent:
+    """Минимальный events.NewMessage.Event для handle_message"""
+
+    def __init__(self, message_id, chat, sender, text, is_channel=True):
+        self.message = StubMessage(message_id, text)
+        self.chat_id = chat.id
+        self.sender_id = sender.id
+        self.chat = chat
+        self.sender = sender
+        self.is_channel = is_channel
+
+    async def get_sender(self):
+        return self.sender
+
+    async def get_chat(self):
+        return self.chat
+
+
+class StubBot:
+    """Bot API без сети: только счетчик отправленных сообщений"""
+
+    def __init__(self):
+        self.sent = 0
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        self.sent += 1
+
+
+def random_word(rng):
+    return ''.join(rng.choice('абвгдеежзийклмнопрстуфхцчшщыэюя') for _ in range(rng.randint(4, 9)))
+
+
+def make_filters(rng, users, keywords):
+    return {
+        user_id: (
+            [rng.choice(VOCABULARY) if rng.random() < 0.01 else random_word(rng) for _ in range(keywords)],
+            [random_word(rng) for _ in range(max(1, keywords // 10))]
+        )
+        for user_id in range(1, users + 1)
+    }
+
+
+def synthetic_stream(rng, count, words, chats=50, senders=2000):
+    chat_peers = [StubPeer(-1001000000000 - n, title=f"Чат {n}") for n in range(chats)]
+    sender_peers = [StubPeer(n, username=f"user{n}", first_name=f"Имя {n}") for n in range(1, senders + 1)]
+    return [
+        StubEvent(
+            message_id,
+            rng.choice(chat_peers),
+            rng.choice(sender_peers),
+            ' '.join(rng.choice(VOCABULARY) if rng.random() < 0.1 else random_word(rng) for _ in range(words))
+        )
+        for message_id in range(1, count + 1)
+    ]
+
+
+def replay_stream(path):
+    """Записанный поток: JSON на строку {"chat_id", "sender_id", "text", "is_channel"}"""
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for message_id, line in enumerate(f, 1):
+            record = json.loads(line)
+            events.append(StubEvent(
+                record.get('id', message_id),
+                StubPeer(record['chat_id'], title=record.get('chat_title')),
+                StubPeer(record['sender_id'], username=record.get('sender_username')),
+                record['text'],
+                record.get('is_channel', True)
+            ))
+    return events
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def run_pipeline(manager, events, user_ids):
+    """Каждое сообщение проходит через handle_message каждой сессии, как в общем чате"""
+    latencies = []
+    started = time.perf_counter()
+    for event in events:
+        for user_id in user_ids:
+            call_started = time.perf_counter()
+            await manager.handle_message(user_id, event)
+            latencies.append(time.perf_counter() - call_started)
+    return time.perf_counter() - started, latencies
+
+
+async def measure_allocations(manager, events, user_ids):
+    """Пик выделенной памяти на одно сообщение (все сессии) и блоки, оставшиеся после прогона"""
+    tracemalloc.start()
+    peaks = []
+    try:
+        baseline_blocks = sys.getallocatedblocks()
+        for event in events:
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            for user_id in user_ids:
+                await manager.handle_message(user_id, event)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        retained = sys.getallocatedblocks() - baseline_blocks
+    finally:
+        tracemalloc.stop()
+    return sum(peaks) / max(len(peaks), 1), retained / max(len(events), 1)
+
+
+def bench(args, keywords, users, words, db):
+    rng = random.Random(args.seed)
+    bot = StubBot()
+    notifier = NotificationDispatcher(bot, max_queue=10 ** 7, global_rate=10 ** 9, chat_interval=0)
+    manager = SessionManager(0, '', db, bot, notifier=notifier)
+    try:
+        filters = make_filters(rng, users, keywords)
+        build_started = time.perf_counter()
+        manager.filters.load(filters)
+        build_time = time.perf_counter() - build_started
+
+        events = replay_stream(args.replay) if args.replay else synthetic_stream(rng, args.messages, words)
+        user_ids = list(filters)
+
+        # Лог каждого совпадения не должен попадать в замер, даже если логирование настроено
+        logging.disable(logging.INFO)
+        elapsed, latencies = asyncio.run(run_pipeline(manager, events, user_ids))
+        latencies.sort()
+        deliveries = len(events) * len(user_ids)
+
+        allocations = ''
+        if args.allocations:
+            sample = events[:args.allocation_sample]
+            # Кеши уже прогреты первым прогоном, дубли подавляются - это стационарный режим
+            peak, retained = asyncio.run(measure_allocations(manager, sample, user_ids))
+            allocations = f" {peak / 1024:>9.1f} КБ {retained:>8.1f}"
+
+        print(
+            f"{keywords:>8} {users:>6} {words:>6} {build_time * 1000:>9.1f} "
+            f"{len(events) / elapsed:>10,.0f} {deliveries / elapsed:>11,.0f} "
+            f"{percentile(latencies, 0.5) * 1e6:>8.1f} {percentile(latencies, 0.99) * 1e6:>8.1f}"
+            f"{allocations}"
+        )
+    finally:
+        logging.disable(logging.NOTSET)
+        manager.shutdown(timeout=5)
+
+
+def parse_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность handle_message без Telegram")
+    parser.add_argument('--keywords', type=parse_list, default=[10, 100, 1000, 10000],
+                        help="ключевых слов на пользователя, через запятую")
+    parser.add_argument('--users', type=parse_list, default=[20], help="число сессий, через запятую")
+    parser.add_argument('--words', type=parse_list, default=[40], help="слов в сообщении, через запятую")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--replay', help="записанный поток сообщений (JSON Lines) вместо синтетического")
+    parser.add_argument('--allocations', action='store_true', help="измерить память на сообщение (медленно)")
+    parser.add_argument('--allocation-sample', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    header = (
+        f"{'ключей':>8} {'сессий':>6} {'слов':>6} {'сборка,мс':>9} {'сообщ/с':>10} {'доставок/с':>11} "
+        f"{'p50,мкс':>8} {'p99,мкс':>8}"
+    )
+    if args.allocations:
+        header += f" {'пик/сообщ':>12} {'блоков':>8}"
+    print(header)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        for keywords in args.keywords:
+            for users in args.users:
+                for words in args.words:
+                    bench(args, keywords, users, words, db)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lean_session import create_client
+
+
+def rss_bytes():
+    """RSS процесса (Linux), 0 если /proc недоступен"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def make_users(rng, count):
+    from telethon.tl.types import User
+
+    return [
+        User(
+            id=rng.randint(10 ** 6, 10 ** 10),
+            access_hash=rng.getrandbits(63),
+            first_name=f"Имя {n}",
+            username=f"user{rng.getrandbits(32)}",
+        )
+        for n in range(count)
+    ]
+
+
+def simulate_traffic(client, users):
+    """То, что накапливает простаивающая сессия в больших чатах: отправители из обновлений
+
+    Повторяет обработку в telethon.client.updates: сущности из обновлений идут в кеш
+    клиента, при превышении entity_cache_limit сбрасываются в сессию и кеш очищается.
+    """
+    cache = client._mb_entity_cache
+    unsaved = []
+    for start in range(0, len(users), 100):
+        batch = users[start:start + 100]
+        cache.extend(batch, [])
+        unsaved.extend(batch)
+        if len(cache) >= client._entity_cache_limit:
+            client.session.process_entities(unsaved)
+            unsaved = []
+            cache.retain(lambda peer_id: peer_id == cache.self_id)
+
+
+def measure(sessions, low_memory, entity_limit, entities_per_session, seed):
+    rng = random.Random(seed)
+    traffic = [make_users(rng, entities_per_session) for _ in range(sessions)] if entities_per_session else []
+
+    gc.collect()
+    rss_before = rss_bytes()
+    tracemalloc.start()
+    clients = []
+    for n in range(sessions):
+        client = create_client('', 1, 'benchmark', low_memory=low_memory, entity_limit=entity_limit)
+        if traffic:
+            simulate_traffic(client, traffic[n])
+        clients.append(client)
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = rss_bytes()
+
+    stored = sum(len(client.session._entities) for client in clients) / sessions
+    del clients
+    gc.collect()
+    return traced / sessions, (rss_after - rss_before) / sessions, stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память на одну простаивающую сессию TelegramClient")
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--entities', type=int, default=20000,
+                        help="сколько разных отправителей увидела каждая сессия")
+    parser.add_argument('--entity-limit', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"сессий: {args.sessions}, отправителей на сессию: {args.entities}")
+    print(f"{'режим':<14} {'Python, КБ/сессия':>18} {'RSS, КБ/сессия':>15} {'сущностей в сессии':>19}")
+    for label, low_memory in (('обычный', False), ('экономный', True)):
+        traced, rss, stored = measure(args.sessions, low_memory, args.entity_limit, args.entities, args.seed)
+        print(f"{label:<14} {traced / 1024:>18.1f} {rss / 1024:>15.1f} {stored:>19.0f}")
+    print("Клиенты не подключаются к Telegram: буферы соединения MTProtoSender в замер не входят")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matcher import KeywordMatcher, SharedFilterIndex
+
+VOCABULARY = [
+    'москва', 'работа', 'квартира', 'продам', 'куплю', 'аренда', 'вакансия', 'доставка',
+    'ремонт', 'машина', 'телефон', 'ноутбук', 'скидка', 'акция', 'обмен', 'срочно',
+    'питер', 'казань', 'офис', 'удаленка', 'зарплата', 'опыт', 'курьер', 'водитель',
+]
+
+
+def random_word(rng):
+    return ''.join(rng.choice('абвгдеежзийклмнопрстуфхцчшщыэюя') for _ in range(rng.randint(4, 9)))
+
+
+def make_filters(rng, users, keywords, exceptions):
+    filters = {}
+    for user_id in range(users):
+        kw = [rng.choice(VOCABULARY) if rng.random() < 0.3 else random_word(rng) for _ in range(keywords)]
+        ex = [random_word(rng) for _ in range(exceptions)]
+        filters[user_id] = (kw, ex)
+    return filters
+
+
+def make_messages(rng, count, words):
+    return [
+        ' '.join(rng.choice(VOCABULARY) if rng.random() < 0.2 else random_word(rng) for _ in range(words))
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="N независимых сканирований против одного общего")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--keywords', type=int, default=100)
+    parser.add_argument('--exceptions', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--words', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    filters = make_filters(rng, args.users, args.keywords, args.exceptions)
+    messages = make_messages(rng, args.messages, args.words)
+
+    matchers = {user_id: KeywordMatcher(kw, ex) for user_id, (kw, ex) in filters.items()}
+    started = time.perf_counter()
+    index = SharedFilterIndex(filters)
+    build_time = time.perf_counter() - started
+
+    # Каждая сессия получает одно и то же сообщение общего чата
+    started = time.perf_counter()
+    independent = []
+    for message in messages:
+        independent.append(frozenset(u for u, m in matchers.items() if m.matches(message)))
+    independent_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    shared = []
+    for message_id, message in enumerate(messages):
+        users = None
+        for user_id in filters:
+            users = index.match(-1001, message_id, message)
+        shared.append(users)
+    shared_time = time.perf_counter() - started
+
+    assert independent == shared, "результаты общего индекса расходятся с независимыми фильтрами"
+
+    deliveries = args.messages * args.users
+    print(f"пользователей: {args.users}, ключевых слов: {args.keywords}, сообщений: {args.messages}")
+    print(f"сборка общего индекса: {build_time * 1000:.1f} мс, узлов: {index.automaton.size}")
+    print(f"N независимых сканирований: {independent_time:.3f} c ({deliveries / independent_time:,.0f} доставок/с)")
+    print(f"один общий скан:            {shared_time:.3f} c ({deliveries / shared_time:,.0f} доставок/с)")
+    print(f"ускорение: x{independent_time / shared_time:.1f}, попаданий в кеш: {index.cache_hits}")
+
+
+if __name__ == '__main__':
+    main()
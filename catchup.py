@@ -0,0 +1,113 @@
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сообщений в одном ответе getChannelDifference (максимум для пользовательских аккаунтов)
+CHANNEL_DIFFERENCE_LIMIT = 100
+
+
+def capture_update_state(client):
+    """Состояние обновлений клиента для сохранения в базу (None если его еще нет)
+
+    StringSession не сохраняет pts/qts/date между запусками, но Telethon раз в минуту и при
+    отключении выгружает их в session. Для каналов вместе с pts сохраняется access_hash:
+    без него getChannelDifference после перезапуска не выполнить.
+    """
+    states = dict(client.session.get_update_states())
+    account = states.pop(0, None)
+    if account is None or not account.pts:
+        return None
+
+    channels = {}
+    for channel_id, state in states.items():
+        try:
+            entity = client.session.get_input_entity(channel_id)
+        except ValueError:
+            continue
+        access_hash = getattr(entity, 'access_hash', None)
+        if access_hash is not None:
+            channels[channel_id] = (state.pts, access_hash)
+
+    return {
+        'pts': account.pts,
+        'qts': account.qts,
+        'date': int(account.date.timestamp()),
+        'seq': account.seq,
+        'channels': channels,
+    }
+
+
+async def fetch_missed(client, state, limit=2000):
+    """Сообщения, пришедшие пока клиент был отключен: getDifference по аккаунту и по каналам
+
+    Возвращает не больше limit пар (update, entities) в порядке получения. При слишком большом
+    разрыве (DifferenceTooLong) догрузка соответствующего источника обрывается.
+    """
+    from telethon import errors, utils
+    from telethon.tl import functions, types
+
+    found = []
+
+    def collect(messages, users, chats, update_type):
+        entities = {utils.get_peer_id(entity): entity for entity in users + chats}
+        for message in messages:
+            if isinstance(message, types.Message):
+                found.append((update_type(message, 0, 0), entities))
+
+    # Личные сообщения и обычные группы
+    pts, qts = state['pts'], state['qts']
+    date = datetime.datetime.fromtimestamp(state['date'], tz=datetime.timezone.utc)
+    while len(found) < limit:
+        diff = await client(functions.updates.GetDifferenceRequest(pts=pts, date=date, qts=qts))
+        if isinstance(diff, (types.updates.DifferenceEmpty, types.updates.DifferenceTooLong)):
+            break
+        collect(diff.new_messages, diff.users, diff.chats, types.UpdateNewMessage)
+        if isinstance(diff, types.updates.Difference):
+            break
+        pts, qts, date = diff.intermediate_state.pts, diff.intermediate_state.qts, diff.intermediate_state.date
+
+    # Каналы и супергруппы - у каждого свой pts
+    for channel_id, (channel_pts, access_hash) in state['channels'].items():
+        channel = types.InputChannel(channel_id, access_hash)
+        while len(found) < limit:
+            try:
+                diff = await client(functions.updates.GetChannelDifferenceRequest(
+                    channel=channel,
+                    filter=types.ChannelMessagesFilterEmpty(),
+                    pts=channel_pts,
+                    limit=min(CHANNEL_DIFFERENCE_LIMIT, limit - len(found))
+                ))
+            except errors.RPCError as e:
+                # Вышли из канала, канал закрыт или access_hash устарел
+                logger.warning(f"⚠️ Догрузка канала {channel_id} пропущена: {e}")
+                break
+            if isinstance(diff, types.updates.ChannelDifferenceEmpty):
+                break
+            if isinstance(diff, types.updates.ChannelDifferenceTooLong):
+                # Сервер отдает только последние сообщения канала
+                collect(diff.messages, diff.users, diff.chats, types.UpdateNewChannelMessage)
+                break
+            collect(diff.new_messages, diff.users, diff.chats, types.UpdateNewChannelMessage)
+            channel_pts = diff.pts
+            if diff.final:
+                break
+
+    return found[:limit]
+
+
+def build_events(client, missed, builder):
+    """События NewMessage из догруженных сообщений с той же фильтрацией, что у живого обработчика"""
+    from telethon import events
+
+    built = []
+    for update, entities in missed:
+        event = events.NewMessage.build(update)
+        if event is None:
+            continue
+        event.original_update = update
+        event._entities = entities
+        event._set_client(client)
+        if builder.filter(event):
+            built.append(event)
+    return built
@@ -12,12 +12,20 @@ API_HASH = os.getenv('API_HASH', 'b18441a1ff607e10a989891a5462e627')
 ADMINS_STR = os.getenv('ADMINS', '')
 ADMINS = [int(x.strip()) for x in ADMINS_STR.split(',') if x.strip()] if ADMINS_STR else []
 
+# Массовый запуск сессий
+SESSION_START_CONCURRENCY = int(os.getenv('SESSION_START_CONCURRENCY', '10'))
+SESSION_START_DC_INTERVAL = float(os.getenv('SESSION_START_DC_INTERVAL', '0.5'))
+
 # Настройки базы данных
 DB_PATH = os.getenv('DB_PATH', 'users_data.db')
 
-# Настройки вебхука (для Realway)
+# Настройки вебхука (для Realway): WEBHOOK_MODE = polling, webhook или local
+WEBHOOK_MODE = os.getenv('WEBHOOK_MODE', 'polling')
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '')
 PORT = int(os.getenv('PORT', 8443))
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '8'))
 
 # Проверка обязательных переменных
 if not BOT_TOKEN:
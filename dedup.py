@@ -0,0 +1,57 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+
+def content_hash(text):
+    """Хеш текста без учета регистра и лишних пробелов"""
+    normalized = ' '.join(text.lower().split())
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+
+
+class DedupStore:
+    """Окно дедупликации уведомлений с вытеснением по TTL и ограничением памяти
+
+    Ключи: (user_id, chat_id, message_id) - то же сообщение повторно или после правки,
+    и (user_id, хеш текста) - тот же текст, пересланный в несколько чатов.
+    """
+
+    def __init__(self, ttl=600, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._seen = OrderedDict()
+        self.suppressed = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def _evict(self, now):
+        seen = self._seen
+        # Ключи добавляются по времени, поэтому просроченные всегда в начале
+        while seen:
+            key, expires_at = next(iter(seen.items()))
+            if expires_at > now and len(seen) <= self.max_entries:
+                break
+            seen.popitem(last=False)
+
+    def _check(self, key, now):
+        expires_at = self._seen.get(key)
+        return expires_at is not None and expires_at > now
+
+    def first_seen(self, user_id, chat_id, message_id, text):
+        """True если уведомление нужно отправить, False если это повтор в окне TTL"""
+        now = time.monotonic()
+        message_key = (user_id, chat_id, message_id)
+        text_key = (user_id, content_hash(text))
+        duplicate = self._check(message_key, now) or self._check(text_key, now)
+
+        expires_at = now + self.ttl
+        for key in (message_key, text_key):
+            self._seen.pop(key, None)
+            self._seen[key] = expires_at
+        self._evict(now)
+
+        if duplicate:
+            self.suppressed += 1
+            return False
+        return True
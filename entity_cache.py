@@ -0,0 +1,90 @@
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEntity:
+    """Только поля, которые нужны для уведомления"""
+
+    __slots__ = ('id', 'username', 'first_name', 'title')
+
+    def __init__(self, entity):
+        self.id = getattr(entity, 'id', None)
+        self.username = getattr(entity, 'username', None)
+        self.first_name = getattr(entity, 'first_name', None)
+        self.title = getattr(entity, 'title', None)
+
+
+class EntityCache:
+    """Общий для всех сессий LRU/TTL кеш отправителей и чатов по peer ID"""
+
+    def __init__(self, max_size=50000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, peer_id):
+        item = self._items.get(peer_id)
+        if item is None:
+            return None
+        expires_at, entity = item
+        if expires_at < time.monotonic():
+            self._items.pop(peer_id, None)
+            return None
+        self._items.move_to_end(peer_id)
+        return entity
+
+    def put(self, peer_id, entity):
+        if entity is None or peer_id is None:
+            return None
+        cached = CachedEntity(entity)
+        self._items[peer_id] = (time.monotonic() + self.ttl, cached)
+        self._items.move_to_end(peer_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return cached
+
+    async def _resolve(self, peer_id, loaded, fetch):
+        cached = self.get(peer_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        # Сущность из самого обновления не требует сетевого запроса
+        entity = loaded if loaded is not None else await fetch()
+        return self.put(peer_id, entity)
+
+    async def get_sender(self, event):
+        """Отправитель сообщения: кеш, затем данные обновления, затем сеть"""
+        return await self._resolve(event.sender_id, event.sender, event.get_sender)
+
+    async def get_chat(self, event):
+        """Чат сообщения: кеш, затем данные обновления, затем сеть"""
+        return await self._resolve(event.chat_id, event.chat, event.get_chat)
+
+    async def warm(self, client, limit=200):
+        """Прогрев кеша из диалогов при старте сессии"""
+        count = 0
+        try:
+            async for dialog in client.iter_dialogs(limit=limit):
+                self.put(dialog.id, dialog.entity)
+                count += 1
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось прогреть кеш сущностей: {e}")
+        return count
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Сколько символов сообщения сохраняется для просмотра в /history
+PREVIEW_LENGTH = 200
+
+
+class MatchHistoryWriter:
+    """Буфер журнала совпадений со сбросом в базу пачками
+
+    record() только добавляет строку в память и вызывается прямо из обработчика сообщений.
+    Фоновый поток пишет накопленное одной транзакцией раз в flush_interval секунд
+    или сразу при наборе batch_size строк. Сработавшие шаблоны передает обработчик: это те,
+    что вызвали уведомление, даже если фильтр успел смениться до записи.
+    """
+
+    def __init__(self, database, batch_size=500, flush_interval=1.0, max_buffer=100000):
+        self.db = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        # Метрики
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="match-history", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Остановка со сбросом остатка буфера"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._flush()
+
+    def record(self, user_id, chat_id, sender_id, message_id, text, keywords=()):
+        """Неблокирующая запись совпадения и сработавших шаблонов (False если буфер переполнен)"""
+        row = (user_id, chat_id, sender_id, message_id, text, keywords, time.time())
+        with self._cond:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return False
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def pending(self):
+        return len(self._buffer)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and len(self._buffer) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if not self._running:
+                    return
+            self._flush()
+
+    def _prepare(self, row):
+        user_id, chat_id, sender_id, message_id, text, keywords, matched_at = row
+        return user_id, chat_id, sender_id, message_id, ', '.join(sorted(keywords)), text[:PREVIEW_LENGTH], matched_at
+
+    def _flush(self):
+        with self._cond:
+            if not self._buffer:
+                return
+            rows = [self._buffer.popleft() for _ in range(min(len(self._buffer), self.batch_size * 4))]
+        try:
+            self.db.add_matches([self._prepare(row) for row in rows])
+            self.written += len(rows)
+            self.batches += 1
+        except Exception as e:
+            # База занята или недоступна: возвращаем строки и пробуем в следующий раз
+            logger.error(f"❌ Ошибка записи журнала совпадений: {e}")
+            with self._cond:
+                self._buffer.extendleft(reversed(rows))
+                overflow = len(self._buffer) - self.max_buffer
+                for _ in range(max(0, overflow)):
+                    self._buffer.pop()
+                    self.dropped += 1
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_SAMPLE = 'sample'
+POLICY_DEGRADE = 'degrade'
+
+POLICIES = (POLICY_DROP_OLDEST, POLICY_SAMPLE, POLICY_DEGRADE)
+
+
+class InboundQueue:
+    """Ограниченная очередь входящих сообщений одной сессии с фиксированным числом обработчиков
+
+    Обработчик Telethon только кладет событие в очередь и сразу возвращается. При переполнении:
+    drop_oldest - вытесняется самое старое событие;
+    sample - в очередь попадает только каждое sample_every-е новое событие (вместо самого старого);
+    degrade - как drop_oldest, а пока очередь заполнена больше чем наполовину, сообщения
+    обрабатываются без запросов сущностей (только совпадение и ID в уведомлении).
+    Живет в общем loop, все методы вызываются из его потока.
+    """
+
+    def __init__(self, process, maxsize=1000, consumers=2, policy=POLICY_DROP_OLDEST, sample_every=10):
+        if policy not in POLICIES:
+            raise ValueError(f"Неизвестная политика перегрузки: {policy}")
+        self.process = process
+        self.maxsize = maxsize
+        self.consumers = consumers
+        self.policy = policy
+        self.sample_every = max(1, sample_every)
+
+        self._queue = asyncio.Queue(maxsize)
+        self._tasks = []
+        self._overflow = 0
+
+        # Метрики
+        self.received = 0
+        self.dropped = 0
+        self.degraded = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+
+    def start(self):
+        self._tasks = [asyncio.ensure_future(self._consume()) for _ in range(self.consumers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # События остановленного клиента после перезапуска уже не обработать
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
+
+    def put(self, event):
+        """Постановка без ожидания; при переполнении срабатывает политика"""
+        self.received += 1
+        item = (time.monotonic(), event)
+        if not self._queue.full():
+            self._overflow = 0
+            self._queue.put_nowait(item)
+            return
+
+        self._overflow += 1
+        if self.policy == POLICY_SAMPLE and self._overflow % self.sample_every:
+            self.dropped += 1
+            return
+        self._queue.get_nowait()
+        self._queue.task_done()
+        self.dropped += 1
+        self._queue.put_nowait(item)
+
+    async def _consume(self):
+        while True:
+            enqueued_at, event = await self._queue.get()
+            try:
+                lag = time.monotonic() - enqueued_at
+                self.lag_last = lag
+                self.lag_max = max(self.lag_max, lag)
+                degraded = self.policy == POLICY_DEGRADE and self._queue.qsize() * 2 >= self.maxsize
+                if degraded:
+                    self.degraded += 1
+                await self.process(event, degraded)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки входящего сообщения: {e}")
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        return {
+            'depth': self._queue.qsize(),
+            'received': self.received,
+            'dropped': self.dropped,
+            'degraded': self.degraded,
+            'lag_last': self.lag_last,
+            'lag_max': self.lag_max,
+        }
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+
+class BoundedEntities:
+    """Замена множества _entities у MemorySession: LRU по ID не больше limit строк
+
+    MemorySession хранит каждую встреченную сущность навсегда и ищет по ним перебором,
+    поэтому у долго живущей сессии в большом чате растут и память, и время поиска.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._rows = OrderedDict()
+
+    def __ior__(self, rows):
+        for row in rows:
+            self._rows[row[0]] = row
+            self._rows.move_to_end(row[0])
+        while len(self._rows) > self.limit:
+            self._rows.popitem(last=False)
+        return self
+
+    def __iter__(self):
+        return iter(list(self._rows.values()))
+
+    def __len__(self):
+        return len(self._rows)
+
+
+def bounded_string_session(session_string, entity_limit):
+    """StringSession с ограниченным хранилищем сущностей"""
+    from telethon.sessions import StringSession
+
+    session = StringSession(session_string)
+    if entity_limit:
+        session._entities = BoundedEntities(entity_limit)
+    return session
+
+
+def create_client(session_string, api_id, api_hash, low_memory=False, entity_limit=1000, **kwargs):
+    """TelegramClient для сессии мониторинга
+
+    В режиме low_memory клиент только принимает обновления: кеш сущностей Telethon и
+    сущности в сессии ограничены, встроенный catch_up Telethon выключен: догрузку пропущенного
+    выполняет catchup.py.
+    """
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
+
+    if not low_memory:
+        return TelegramClient(StringSession(session_string), api_id, api_hash, **kwargs)
+
+    options = dict(
+        receive_updates=True,
+        catch_up=False,
+        sequential_updates=False,
+        entity_cache_limit=entity_limit,
+    )
+    options.update(kwargs)
+    return TelegramClient(bounded_string_session(session_string, entity_limit), api_id, api_hash, **options)
@@ -0,0 +1,239 @@
+import concurrent.futures
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LeasedClients:
+    """Представление active_clients для всех узлов: свои сессии плюс чужие аренды"""
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def __contains__(self, user_id):
+        if user_id in self._owner.manager.active_clients:
+            return True
+        return self._owner.db.get_lease_holder(user_id) is not None
+
+    def __len__(self):
+        return self._owner.db.count_live_leases()
+
+    def get(self, user_id, default=None):
+        return self._owner.manager.active_clients.get(user_id, default)
+
+
+class LeasedSessionManager:
+    """Владение сессиями через аренды в общей базе
+
+    Узел запускает только сессии, аренду которых держит, продлевает аренды каждые
+    renew_interval секунд и отдает их при остановке. Если узел пропал, его аренды
+    истекают через ttl секунд и разбираются остальными узлами. Каждый узел держит
+    не больше ceil(сессий / узлов), поэтому нагрузка выравнивается при добавлении узлов.
+
+    Команды для чужих сессий (новые фильтры, перезапуск) передаются владельцу через
+    счетчики ревизий в таблице аренд. Перезапуск всех сессий (повторный start_all_sessions)
+    тоже идет через ревизии, поэтому перезапускаются сессии всех узлов, включая этот.
+    """
+
+    def __init__(self, manager, database, node_id, ttl=30, renew_interval=10, capacity=0):
+        if renew_interval * 2 >= ttl:
+            raise ValueError("renew_interval должен быть меньше половины ttl")
+        self.manager = manager
+        self.db = database
+        self.node_id = node_id
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.capacity = capacity
+
+        # user_id -> (filters_rev, session_rev) своих аренд
+        self.leases = {}
+        self.active_clients = LeasedClients(self)
+        self._last_renewed = 0.0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __getattr__(self, name):
+        # Остальной интерфейс (stats, get_prefilter, startup_progress...) у локального менеджера
+        return getattr(self.manager, name)
+
+    def _share(self):
+        """Сколько сессий может держать узел"""
+        nodes = self.db.register_node(self.node_id, self.ttl)
+        share = math.ceil(self.db.count_active_users() / max(nodes, 1))
+        if self.capacity:
+            share = min(share, self.capacity)
+        return max(share, 1)
+
+    def _renew(self):
+        """Продление и захват аренд; возвращает (полученные, потерянные, измененные, прежние ревизии)"""
+        with self._lock:
+            share = self._share()
+            claimed = self.db.claim_leases(self.node_id, self.ttl, limit=share)
+            self._last_renewed = time.monotonic()
+            gained = [user_id for user_id in claimed if user_id not in self.leases]
+            lost = [user_id for user_id in self.leases if user_id not in claimed]
+
+            # Лишние аренды отдаем постепенно, чтобы новый узел забирал сессии без всплеска
+            excess = len(claimed) - share
+            if excess > 0:
+                keep = set(gained)
+                release = [user_id for user_id in claimed if user_id not in keep][:max(1, excess // 2)]
+                for user_id in release:
+                    self._stop_local(user_id)
+                self.db.release_leases(self.node_id, release)
+                for user_id in release:
+                    claimed.pop(user_id)
+
+            changed = [
+                user_id for user_id, revisions in claimed.items()
+                if user_id in self.leases and revisions != self.leases[user_id]
+            ]
+            previous = self.leases
+            self.leases = claimed
+            return gained, lost, changed, previous
+
+    def _sync(self):
+        gained, lost, changed, previous = self._renew()
+
+        for user_id in lost:
+            logger.warning(f"🔑 Аренда сессии {user_id} потеряна, останавливаем")
+            self._stop_local(user_id)
+
+        for user_id in changed:
+            old_filters, old_session = previous[user_id]
+            new_filters, new_session = self.leases[user_id]
+            if new_session != old_session:
+                self.manager.restart_session(user_id)
+            if new_filters != old_filters:
+                self._reload_filters(user_id)
+
+        if gained:
+            gained_set = set(gained)
+            users = [user for user in self.db.get_all_active_users() if user[0] in gained_set]
+            logger.info(f"🔑 Узел {self.node_id}: получено {len(users)} аренд, запускаем")
+            self.manager.start_sessions(users)
+
+    def _reload_filters(self, user_id):
+        keywords, exceptions = self.db.get_user_settings(user_id)
+        self.manager.update_filters(user_id, keywords, exceptions)
+        self.manager.update_prefilter(user_id)
+
+    def _stop_local(self, user_id, timeout=None):
+        """Остановка с ожиданием: аренду можно отдавать только после отключения клиента"""
+        future = self.manager.stop_session(user_id)
+        if future is not None:
+            try:
+                future.result(timeout or self.renew_interval)
+            except Exception as e:
+                logger.error(f"❌ Ошибка остановки сессии {user_id}: {e}")
+        self.manager.forget_user(user_id)
+
+    def _loop(self):
+        while not self._stop.wait(self.renew_interval):
+            try:
+                self._sync()
+            except Exception as e:
+                logger.error(f"❌ Узел {self.node_id}: ошибка продления аренд: {e}")
+                # Без продления аренды скоро заберут другие узлы: останавливаемся раньше них
+                if time.monotonic() - self._last_renewed > self.ttl - self.renew_interval:
+                    with self._lock:
+                        for user_id in list(self.leases):
+                            self._stop_local(user_id)
+                        self.leases = {}
+
+    def start_all_sessions(self):
+        """Запуск только тех сессий, аренду которых получил этот узел
+
+        Повторный вызов (перезапуск из админки) поднимает ревизию всех аренд: каждый узел
+        перезапускает свои сессии при продлении, этот - сразу.
+        """
+        try:
+            if self._thread is not None:
+                self.db.bump_lease_revision(session=True)
+            self._sync()
+        except Exception as e:
+            logger.error(f"❌ Узел {self.node_id}: ошибка получения аренд: {e}")
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="session-leases", daemon=True)
+            self._thread.start()
+
+    def _hold(self, user_id):
+        """Аренда сессии у этого узла (захватывается, если свободна)"""
+        with self._lock:
+            if user_id in self.leases:
+                return True
+            revisions = self.db.try_claim_lease(self.node_id, user_id, self.ttl)
+            if revisions is not None:
+                self.leases[user_id] = tuple(revisions)
+                return True
+        return False
+
+    def start_session(self, user_id, session_string):
+        if self._hold(user_id):
+            return self.manager.start_session(user_id, session_string)
+        # Сессию держит другой узел - он перезапустит ее с новой строкой
+        self.db.bump_lease_revision(user_id, session=True)
+
+    def add_session(self, user_id, username, session_string):
+        if self._hold(user_id):
+            return self.manager.add_session(user_id, username, session_string)
+        # Сессию держит другой узел: здесь только проверка, перезапуск с новой строкой делает владелец
+        checked = self.manager.add_session(user_id, username, session_string, promote=False)
+        result = concurrent.futures.Future()
+        # Колбэк выполняется в потоке loop сессий: запись в базу уходит в отдельный поток
+        checked.add_done_callback(
+            lambda done: threading.Thread(
+                target=self._signal_owner, args=(user_id, done, result), name="lease-signal", daemon=True
+            ).start()
+        )
+        return result
+
+    def _signal_owner(self, user_id, checked, result):
+        """Ревизия сессии поднимается только после успешной проверки; result завершается после записи"""
+        try:
+            account = checked.result()
+            self.db.bump_lease_revision(user_id, session=True)
+        except Exception as e:
+            result.set_exception(e)
+        else:
+            result.set_result(account)
+
+    def restart_session(self, user_id):
+        if self._hold(user_id):
+            return self.manager.restart_session(user_id)
+        self.db.bump_lease_revision(user_id, session=True)
+
+    def stop_session(self, user_id):
+        with self._lock:
+            self.leases.pop(user_id, None)
+        self._stop_local(user_id)
+        self.db.release_leases(self.node_id, [user_id])
+
+    def update_filters(self, user_id, keywords, exceptions):
+        if user_id in self.leases:
+            self.manager.update_filters(user_id, keywords, exceptions)
+        else:
+            self.db.bump_lease_revision(user_id)
+
+    def update_prefilter(self, user_id):
+        if user_id in self.leases:
+            self.manager.update_prefilter(user_id)
+        else:
+            self.db.bump_lease_revision(user_id)
+
+    def shutdown(self, timeout=30):
+        """Остановка сессий и возврат аренд, чтобы другие узлы забрали их сразу"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.manager.shutdown(timeout)
+        try:
+            self.db.release_leases(self.node_id)
+            self.db.unregister_node(self.node_id)
+        except Exception as e:
+            logger.error(f"❌ Узел {self.node_id}: ошибка возврата аренд: {e}")
+        logger.info(f"🔑 Узел {self.node_id}: аренды возвращены")
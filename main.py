@@ -1,26 +1,66 @@
+from __future__ import annotations
+
+import time
+
+# Отсчет профиля запуска ведется от начала импорта main
+STARTED_AT = time.perf_counter()
+
 import logging
 import asyncio
+import importlib
 import sys
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import (
-    Updater, CommandHandler, MessageHandler, CallbackQueryHandler, 
-    CallbackContext, Filters
-)
 import json
+import signal
+import socket
 import sqlite3
+import threading
+from contextlib import contextmanager
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('bot.log', encoding='utf-8')
-    ]
+from session_runtime import SessionRuntime
+from startup_profile import StartupProfile
+from session_startup import StartupProgress, start_sessions_bulk
+from notifier import NotificationDispatcher
+from entity_cache import EntityCache
+from dedup import DedupStore
+from inbound import InboundQueue
+from history import MatchHistoryWriter
+from catchup import capture_update_state, fetch_missed, build_events
+from supervisor import ReconnectLimiter, SessionRevokedError, backoff_delay, is_revoked
+from lean_session import create_client
+from metrics import (
+    REGISTRY, MESSAGES_RECEIVED, MESSAGES_MATCHED, MATCH_SECONDS, HANDLE_SECONDS, DB_QUERY_SECONDS,
+    CATCH_UP_MESSAGES, SESSION_RECONNECTS, MetricsServer, watch_loop_lag
+)
+from prefilter import PreFilter, CHAT_RULE_KINDS, KIND_INCLUDE_CHAT, KIND_EXCLUDE_CHAT, KIND_MUTE_CHAT
+from matcher import (
+    FilterRegistry, KIND_KEYWORD, KIND_EXCEPTION, normalize_patterns, parse_pattern, format_pattern,
+    split_patterns, validate_patterns
 )
+
 logger = logging.getLogger(__name__)
 
+def setup_logging():
+    """Настройка логирования; вызывает точка входа процесса (бот, узел, шард), а не импорт main"""
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.FileHandler('bot.log', encoding='utf-8')
+        ]
+    )
+
+def load_telegram():
+    """Импорт python-telegram-bot для бота; шарды и узлы без бота импортируют только telegram.Bot"""
+    global Update, InlineKeyboardButton, InlineKeyboardMarkup
+    global Updater, CommandHandler, MessageHandler, CallbackQueryHandler, CallbackContext, Filters
+    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram.ext import (
+        Updater, CommandHandler, MessageHandler, CallbackQueryHandler, 
+        CallbackContext, Filters
+    )
+
 # Конфигурация для Realway
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 API_ID = int(os.getenv('API_ID', '2040'))
@@ -28,21 +68,164 @@ API_HASH = os.getenv('API_HASH', 'b18441a1ff607e10a989891a5462e627')
 ADMINS_STR = os.getenv('ADMINS', '')
 ADMINS = [int(x.strip()) for x in ADMINS_STR.split(',') if x.strip()] if ADMINS_STR else []
 
+# Массовый запуск сессий: сколько подключений одновременно и пауза между подключениями к одному DC
+SESSION_START_CONCURRENCY = int(os.getenv('SESSION_START_CONCURRENCY', '10'))
+SESSION_START_DC_INTERVAL = float(os.getenv('SESSION_START_DC_INTERVAL', '0.5'))
+
+# Количество процессов-шардов для сессий (0 или 1 - все сессии в процессе бота)
+SESSION_SHARDS = int(os.getenv('SESSION_SHARDS', '0'))
+
+# Несколько узлов с общей базой: сессии делятся через аренды (SESSION_LEASES=1).
+# RUN_BOT=0 - узел только держит сессии, бот с командами работает на другом узле
+SESSION_LEASES = os.getenv('SESSION_LEASES', '0') == '1'
+NODE_ID = os.getenv('NODE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_TTL = float(os.getenv('LEASE_TTL', '30'))
+LEASE_RENEW_INTERVAL = float(os.getenv('LEASE_RENEW_INTERVAL', '10'))
+NODE_MAX_SESSIONS = int(os.getenv('NODE_MAX_SESSIONS', '0'))
+RUN_BOT = os.getenv('RUN_BOT', '1') == '1'
+
+# Исходящие уведомления: размер очереди, потоки, лимиты Bot API и порог склейки в сводку (0 - без сводок)
+NOTIFY_QUEUE_SIZE = int(os.getenv('NOTIFY_QUEUE_SIZE', '10000'))
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', '2'))
+NOTIFY_GLOBAL_RATE = float(os.getenv('NOTIFY_GLOBAL_RATE', '30'))
+NOTIFY_CHAT_INTERVAL = float(os.getenv('NOTIFY_CHAT_INTERVAL', '1'))
+NOTIFY_DIGEST_THRESHOLD = int(os.getenv('NOTIFY_DIGEST_THRESHOLD', '3'))
+
+# Кеш отправителей и чатов для уведомлений: размер, время жизни (секунды) и сколько диалогов прогревать
+ENTITY_CACHE_SIZE = int(os.getenv('ENTITY_CACHE_SIZE', '50000'))
+ENTITY_CACHE_TTL = float(os.getenv('ENTITY_CACHE_TTL', '3600'))
+ENTITY_WARM_DIALOGS = int(os.getenv('ENTITY_WARM_DIALOGS', '200'))
+
+# Предфильтр: обрабатывать ли исходящие сообщения и минимальная длина текста
+MONITOR_OUTGOING = os.getenv('MONITOR_OUTGOING', '0') == '1'
+# Проверять ли отредактированные сообщения (правка уже отправленного сообщения гасится дедупликацией)
+MONITOR_EDITS = os.getenv('MONITOR_EDITS', '1') == '1'
+MIN_TEXT_LENGTH = int(os.getenv('MIN_TEXT_LENGTH', '1'))
+
+# Дедупликация уведомлений: окно (секунды) и максимум ключей в памяти
+DEDUP_TTL = float(os.getenv('DEDUP_TTL', '600'))
+DEDUP_MAX_ENTRIES = int(os.getenv('DEDUP_MAX_ENTRIES', '100000'))
+
+# Прием обновлений бота: polling, webhook (встроенный сервер PTB + setWebhook) или local
+# (свой HTTP приемник за обратным прокси, webhook ставится отдельно). BOT_WORKERS - потоки обработчиков
+WEBHOOK_MODE = os.getenv('WEBHOOK_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '')
+PORT = int(os.getenv('PORT', 8443))
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '8'))
+
+# Профиль запуска: время импортов и инициализации по фазам в лог
+STARTUP_PROFILE = os.getenv('STARTUP_PROFILE', '0') == '1'
+PROFILE = StartupProfile(STARTUP_PROFILE, started_at=STARTED_AT)
+
+# Входящие сообщения сессии: размер очереди, число обработчиков и политика перегрузки
+# (drop_oldest, sample - каждое INBOUND_SAMPLE_EVERY-е, degrade - без запросов сущностей)
+INBOUND_QUEUE_SIZE = int(os.getenv('INBOUND_QUEUE_SIZE', '1000'))
+INBOUND_CONSUMERS = int(os.getenv('INBOUND_CONSUMERS', '2'))
+INBOUND_POLICY = os.getenv('INBOUND_POLICY', 'drop_oldest')
+INBOUND_SAMPLE_EVERY = int(os.getenv('INBOUND_SAMPLE_EVERY', '10'))
+
+# Метрики Prometheus на локальном порту (0 - выключены); шард N слушает METRICS_PORT + 1 + N
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# Экономный режим сессий: клиент только принимает обновления, сущности в памяти ограничены
+SESSION_LOW_MEMORY = os.getenv('SESSION_LOW_MEMORY', '1') == '1'
+SESSION_ENTITY_LIMIT = int(os.getenv('SESSION_ENTITY_LIMIT', '1000'))
+
+# Журнал совпадений: запись пачками (размер, интервал сброса в секундах) и строк на странице /history
+HISTORY_ENABLED = os.getenv('HISTORY_ENABLED', '1') == '1'
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '500'))
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '1'))
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '10'))
+
+# Догрузка пропущенного после перезапуска: состояние обновлений сохраняется раз в
+# UPDATE_STATE_SAVE_INTERVAL секунд и при остановке; догружается не больше CATCH_UP_MAX_MESSAGES
+# сообщений и только если состоянию не больше CATCH_UP_MAX_AGE секунд
+CATCH_UP_ENABLED = os.getenv('CATCH_UP_ENABLED', '1') == '1'
+CATCH_UP_MAX_AGE = int(os.getenv('CATCH_UP_MAX_AGE', '3600'))
+CATCH_UP_MAX_MESSAGES = int(os.getenv('CATCH_UP_MAX_MESSAGES', '2000'))
+CATCH_UP_BATCH_SIZE = int(os.getenv('CATCH_UP_BATCH_SIZE', '50'))
+UPDATE_STATE_SAVE_INTERVAL = int(os.getenv('UPDATE_STATE_SAVE_INTERVAL', '60'))
+
+# Надзор за сессиями: проверка соединения раз в SESSION_HEALTH_INTERVAL секунд, переподключение
+# с экспоненциальной задержкой (RECONNECT_BASE_DELAY..RECONNECT_MAX_DELAY секунд, со случайным
+# разбросом) и общим лимитом RECONNECT_RATE переподключений в секунду на процесс
+SESSION_HEALTH_INTERVAL = float(os.getenv('SESSION_HEALTH_INTERVAL', '30'))
+RECONNECT_BASE_DELAY = float(os.getenv('RECONNECT_BASE_DELAY', '2'))
+RECONNECT_MAX_DELAY = float(os.getenv('RECONNECT_MAX_DELAY', '300'))
+RECONNECT_RATE = float(os.getenv('RECONNECT_RATE', '5'))
+RECONNECT_BURST = int(os.getenv('RECONNECT_BURST', '10'))
+
+# SQLite: сколько ждать блокировку (секунды) и сколько подготовленных запросов держать на соединение
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '5'))
+DB_CACHED_STATEMENTS = int(os.getenv('DB_CACHED_STATEMENTS', '256'))
+
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен в переменных окружения Realway")
 
-logger.info(f"Конфигурация загружена успешно. Админы: {ADMINS}")
-
 class Database:
-    def __init__(self, db_path="users_data.db"):
+    def __init__(self, db_path="users_data.db", busy_timeout=DB_BUSY_TIMEOUT):
         self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.Lock()
         self.init_db()
     
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=DB_CACHED_STATEMENTS
+        )
+        # WAL: читатели не блокируют писателя и друг друга
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout * 1000)}')
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+    
+    @contextmanager
     def get_connection(self):
-        return sqlite3.connect(self.db_path, check_same_thread=False)
+        """Постоянное соединение текущего потока для чтения (подготовленные запросы кешируются)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        with DB_QUERY_SECONDS.labels('read').time(), conn:
+            yield conn
+    
+    @contextmanager
+    def writer(self):
+        """Единственный сериализованный писатель: транзакция коммитится при выходе"""
+        # Время записи включает ожидание блокировки - так видна конкуренция писателей
+        with DB_QUERY_SECONDS.labels('write').time(), self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+                # Блокировку на запись берем сразу: базу могут делить несколько узлов
+                self._writer.isolation_level = 'IMMEDIATE'
+            with self._writer as conn:
+                yield conn
+    
+    def close(self):
+        """Закрытие всех соединений"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._writer = None
+        self._local = threading.local()
     
     def init_db(self):
-        with self.get_connection() as conn:
+        with self.writer() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -64,19 +247,127 @@ class Database:
                 )
             ''')
             
+            # Фильтры хранятся построчно, а не JSON в users.keywords/users.exceptions
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS filters (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    pattern TEXT NOT NULL,
+                    flags INTEGER DEFAULT 0,
+                    UNIQUE (user_id, kind, pattern, flags)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_filters_pattern ON filters (pattern, kind)')
+            self._migrate(cursor)
+            
+            # Аренда сессий узлами: одна строка сессии работает только на одном узле
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS session_leases (
+                    user_id INTEGER PRIMARY KEY,
+                    node_id TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    filters_rev INTEGER DEFAULT 0,
+                    session_rev INTEGER DEFAULT 0
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_session_leases_node ON session_leases (node_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_session_leases_expires ON session_leases (expires_at)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS lease_nodes (
+                    node_id TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            
+            # Журнал совпадений только дополняется; id растет со временем и служит ключом страниц
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS match_history (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER,
+                    sender_id INTEGER,
+                    message_id INTEGER,
+                    keywords TEXT,
+                    preview TEXT,
+                    matched_at REAL NOT NULL
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_match_history_user ON match_history (user_id, id)')
+            
+            # Состояние обновлений Telethon (pts/qts/date/seq, pts каналов) для догрузки после перезапуска
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS update_state (
+                    user_id INTEGER PRIMARY KEY,
+                    pts INTEGER NOT NULL,
+                    qts INTEGER NOT NULL,
+                    date INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    channels TEXT NOT NULL,
+                    saved_at REAL NOT NULL
+                )
+            ''')
+            
             for admin_id in ADMINS:
                 cursor.execute('''
                     INSERT OR IGNORE INTO allowed_users (user_id, username, added_by) 
                     VALUES (?, ?, ?)
                 ''', (admin_id, f"admin_{admin_id}", 0))
             
-            conn.commit()
+            cursor.execute('SELECT COUNT(*) FROM allowed_users')
+            logger.info(f"Пользователей в белом списке: {cursor.fetchone()[0]}")
+    
+    def _migrate(self, cursor):
+        """Миграции схемы по PRAGMA user_version"""
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT user_id, username FROM allowed_users')
-            users = cursor.fetchall()
-            logger.info(f"Пользователи в белом списке: {users}")
+        if version < 1:
+            # Переносим JSON из users.keywords/users.exceptions в таблицу filters
+            cursor.execute('SELECT user_id, keywords, exceptions FROM users')
+            rows = []
+            for user_id, keywords_json, exceptions_json in cursor.fetchall():
+                for kind, patterns_json in ((KIND_KEYWORD, keywords_json), (KIND_EXCEPTION, exceptions_json)):
+                    for pattern in json.loads(patterns_json or '[]'):
+                        rows.append((user_id, kind, pattern))
+            self._insert_filters(cursor, rows)
+            cursor.execute('PRAGMA user_version = 1')
+            logger.info(f"🔀 Миграция фильтров: перенесено {len(rows)} записей")
+        
+        if version < 2:
+            # Режим входит в ключ: дом, "дом", дом* и ~дом - разные фильтры.
+            # SQLite не меняет UNIQUE у существующей таблицы, поэтому она пересоздается
+            cursor.execute('''
+                CREATE TABLE filters_v2 (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    pattern TEXT NOT NULL,
+                    flags INTEGER DEFAULT 0,
+                    UNIQUE (user_id, kind, pattern, flags)
+                )
+            ''')
+            cursor.execute('''
+                INSERT OR IGNORE INTO filters_v2 (id, user_id, kind, pattern, flags) 
+                SELECT id, user_id, kind, pattern, flags FROM filters
+            ''')
+            cursor.execute('DROP TABLE filters')
+            cursor.execute('ALTER TABLE filters_v2 RENAME TO filters')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_filters_pattern ON filters (pattern, kind)')
+            cursor.execute('PRAGMA user_version = 2')
+            logger.info("🔀 Миграция фильтров: режим шаблона добавлен в уникальный ключ")
+    
+    @staticmethod
+    def _insert_filters(cursor, rows):
+        """Шаблон хранится без разметки режима, режим - в flags"""
+        records = []
+        for user_id, kind, pattern in rows:
+            mode, body = parse_pattern(pattern)
+            if body:
+                records.append((user_id, kind, body, mode))
+        cursor.executemany('''
+            INSERT OR IGNORE INTO filters (user_id, kind, pattern, flags) 
+            VALUES (?, ?, ?, ?)
+        ''', records)
     
     def is_user_allowed(self, user_id):
         with self.get_connection() as conn:
@@ -86,21 +377,22 @@ class Database:
             return result is not None
     
     def add_allowed_user(self, user_id, username, admin_id):
-        with self.get_connection() as conn:
+        with self.writer() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT OR REPLACE INTO allowed_users (user_id, username, added_by) 
                 VALUES (?, ?, ?)
             ''', (user_id, username, admin_id))
-            conn.commit()
         logger.info(f"✅ Пользователь {user_id} добавлен")
     
     def remove_allowed_user(self, user_id):
-        with self.get_connection() as conn:
+        with self.writer() as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM allowed_users WHERE user_id = ?', (user_id,))
             cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
-            conn.commit()
+            cursor.execute('DELETE FROM filters WHERE user_id = ?', (user_id,))
+            cursor.execute('DELETE FROM match_history WHERE user_id = ?', (user_id,))
+            cursor.execute('DELETE FROM update_state WHERE user_id = ?', (user_id,))
         logger.info(f"❌ Пользователь {user_id} удален")
     
     def get_allowed_users(self):
@@ -110,13 +402,14 @@ class Database:
             return cursor.fetchall()
     
     def save_session(self, user_id, username, session_string):
-        with self.get_connection() as conn:
+        with self.writer() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT OR REPLACE INTO users (user_id, username, session_string) 
                 VALUES (?, ?, ?)
             ''', (user_id, username, session_string))
-            conn.commit()
+            # Состояние обновлений относится к прежней сессии
+            cursor.execute('DELETE FROM update_state WHERE user_id = ?', (user_id,))
         logger.info(f"💾 Сессия сохранена для {user_id}")
     
     def get_user_session(self, user_id):
@@ -127,130 +420,913 @@ class Database:
             return result[0] if result else None
     
     def save_keywords(self, user_id, keywords, exceptions):
-        with self.get_connection() as conn:
+        with self.writer() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE users SET keywords = ?, exceptions = ? 
-                WHERE user_id = ?
-            ''', (json.dumps(keywords), json.dumps(exceptions), user_id))
-            conn.commit()
+            cursor.execute(
+                'DELETE FROM filters WHERE user_id = ? AND kind IN (?, ?)',
+                (user_id, KIND_KEYWORD, KIND_EXCEPTION)
+            )
+            self._insert_filters(cursor, [
+                (user_id, kind, pattern)
+                for kind, patterns in ((KIND_KEYWORD, keywords), (KIND_EXCEPTION, exceptions))
+                for pattern in patterns
+            ])
         logger.info(f"⚙️ Фильтры обновлены для {user_id}")
     
     def get_user_settings(self, user_id):
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT keywords, exceptions FROM users WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            if result:
-                return json.loads(result[0]), json.loads(result[1])
-            return [], []
+            cursor.execute('''
+                SELECT kind, pattern, flags FROM filters 
+                WHERE user_id = ? AND kind IN (?, ?) ORDER BY id
+            ''', (user_id, KIND_KEYWORD, KIND_EXCEPTION))
+            keywords, exceptions = [], []
+            for kind, pattern, flags in cursor.fetchall():
+                (keywords if kind == KIND_KEYWORD else exceptions).append(format_pattern(flags, pattern))
+            return keywords, exceptions
+    
+    def load_all_filters(self, active_only=False):
+        """Фильтры всех пользователей одним проходом по индексу: {user_id: (keywords, exceptions)}"""
+        query = 'SELECT f.user_id, f.kind, f.pattern, f.flags FROM filters f'
+        if active_only:
+            query += ''' JOIN users u ON u.user_id = f.user_id 
+                AND u.session_string IS NOT NULL AND u.is_active = 1'''
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                query + ' WHERE f.kind IN (?, ?) ORDER BY f.user_id, f.id',
+                (KIND_KEYWORD, KIND_EXCEPTION)
+            )
+            filters = {}
+            for user_id, kind, pattern, flags in cursor:
+                keywords, exceptions = filters.setdefault(user_id, ([], []))
+                (keywords if kind == KIND_KEYWORD else exceptions).append(format_pattern(flags, pattern))
+            return filters
+    
+    def get_users_by_pattern(self, pattern, kind=KIND_KEYWORD):
+        """Какие пользователи следят за шаблоном (в синтаксисе ввода, с учетом режима)"""
+        mode, body = parse_pattern(pattern)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT user_id FROM filters WHERE pattern = ? AND kind = ? AND flags = ?',
+                (body, kind, mode)
+            )
+            return [row[0] for row in cursor.fetchall()]
+    
+    def get_chat_rules(self, user_id):
+        """Правила чатов пользователя: {kind: set(chat_id)}"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f'SELECT kind, pattern FROM filters WHERE user_id = ? AND kind IN ({", ".join("?" * len(CHAT_RULE_KINDS))})',
+                (user_id, *CHAT_RULE_KINDS)
+            )
+            rules = {}
+            for kind, chat_id in cursor.fetchall():
+                rules.setdefault(kind, set()).add(int(chat_id))
+            return rules
+    
+    def set_chat_rule(self, user_id, kind, chat_id, enabled=True):
+        """Добавление или удаление правила чата (include/exclude/mute)"""
+        with self.writer() as conn:
+            cursor = conn.cursor()
+            if enabled:
+                self._insert_filters(cursor, [(user_id, kind, str(chat_id))])
+            else:
+                cursor.execute(
+                    'DELETE FROM filters WHERE user_id = ? AND kind = ? AND pattern = ?',
+                    (user_id, kind, str(chat_id))
+                )
+        logger.info(f"⚙️ Правило {kind} {'добавлено' if enabled else 'удалено'} для {user_id}: {chat_id}")
     
     def get_all_active_users(self):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT user_id, session_string, keywords, exceptions 
+                SELECT user_id, session_string 
                 FROM users 
                 WHERE session_string IS NOT NULL AND is_active = 1
             ''')
             return cursor.fetchall()
 
+    def add_matches(self, rows):
+        """Пачка записей журнала одной транзакцией"""
+        with self.writer() as conn:
+            conn.executemany('''
+                INSERT INTO match_history 
+                (user_id, chat_id, sender_id, message_id, keywords, preview, matched_at) 
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+    
+    def get_match_history(self, user_id, before_id=None, limit=10):
+        """Страница журнала от новых к старым: keyset по id вместо OFFSET"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, chat_id, sender_id, message_id, keywords, preview, matched_at 
+                FROM match_history 
+                WHERE user_id = ? AND id < ? 
+                ORDER BY id DESC LIMIT ?
+            ''', (user_id, before_id or (1 << 63) - 1, limit))
+            return cursor.fetchall()
+    
+    def save_update_states(self, states):
+        """Состояния обновлений {user_id: state} одной транзакцией"""
+        now = time.time()
+        rows = [
+            (
+                user_id, state['pts'], state['qts'], state['date'], state['seq'],
+                json.dumps({str(channel_id): list(value) for channel_id, value in state['channels'].items()}),
+                now
+            )
+            for user_id, state in states.items()
+        ]
+        with self.writer() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO update_state (user_id, pts, qts, date, seq, channels, saved_at) 
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+    
+    def get_update_state(self, user_id):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT pts, qts, date, seq, channels, saved_at FROM update_state WHERE user_id = ?',
+                (user_id,)
+            )
+            row = cursor.fetchone()
+        if not row:
+            return None
+        pts, qts, date, seq, channels, saved_at = row
+        return {
+            'pts': pts,
+            'qts': qts,
+            'date': date,
+            'seq': seq,
+            'channels': {int(channel_id): tuple(value) for channel_id, value in json.loads(channels).items()},
+            'saved_at': saved_at,
+        }
+    
+    def count_active_users(self):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM users WHERE session_string IS NOT NULL AND is_active = 1')
+            return cursor.fetchone()[0]
+
+    def register_node(self, node_id, ttl):
+        """Пульс узла; возвращает число живых узлов"""
+        now = time.time()
+        with self.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO lease_nodes (node_id, expires_at) VALUES (?, ?) 
+                ON CONFLICT(node_id) DO UPDATE SET expires_at = excluded.expires_at
+            ''', (node_id, now + ttl))
+            cursor.execute('DELETE FROM lease_nodes WHERE expires_at < ?', (now,))
+            return cursor.execute('SELECT COUNT(*) FROM lease_nodes').fetchone()[0]
+    
+    def unregister_node(self, node_id):
+        with self.writer() as conn:
+            conn.execute('DELETE FROM lease_nodes WHERE node_id = ?', (node_id,))
+    
+    def claim_leases(self, node_id, ttl, limit=None):
+        """Продление своих аренд и захват свободных/просроченных до limit штук
+
+        Возвращает {user_id: (filters_rev, session_rev)} для всех аренд узла.
+        """
+        now = time.time()
+        expires_at = now + ttl
+        with self.writer() as conn:
+            cursor = conn.cursor()
+            # Аренды удаленных и неактивных пользователей больше не нужны
+            cursor.execute('''
+                DELETE FROM session_leases WHERE user_id NOT IN (
+                    SELECT user_id FROM users WHERE session_string IS NOT NULL AND is_active = 1
+                )
+            ''')
+            cursor.execute('UPDATE session_leases SET expires_at = ? WHERE node_id = ?', (expires_at, node_id))
+            
+            owned = cursor.execute('SELECT COUNT(*) FROM session_leases WHERE node_id = ?', (node_id,)).fetchone()[0]
+            # В SQLite LIMIT -1 означает без ограничения
+            free = max(limit - owned, 0) if limit else -1
+            if free:
+                cursor.execute('''
+                    UPDATE session_leases SET node_id = ?, expires_at = ? 
+                    WHERE user_id IN (SELECT user_id FROM session_leases WHERE expires_at < ? LIMIT ?)
+                ''', (node_id, expires_at, now, free))
+                if free > 0:
+                    free -= cursor.rowcount
+            if free:
+                cursor.execute('''
+                    INSERT INTO session_leases (user_id, node_id, expires_at) 
+                    SELECT user_id, ?, ? FROM users 
+                    WHERE session_string IS NOT NULL AND is_active = 1 
+                    AND user_id NOT IN (SELECT user_id FROM session_leases) 
+                    LIMIT ?
+                ''', (node_id, expires_at, free))
+            
+            cursor.execute(
+                'SELECT user_id, filters_rev, session_rev FROM session_leases WHERE node_id = ?',
+                (node_id,)
+            )
+            return {user_id: (filters_rev, session_rev) for user_id, filters_rev, session_rev in cursor.fetchall()}
+    
+    def try_claim_lease(self, node_id, user_id, ttl):
+        """Захват аренды одной сессии, если она свободна, просрочена или уже наша
+
+        Возвращает (filters_rev, session_rev) захваченной аренды или None.
+        """
+        now = time.time()
+        with self.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO session_leases (user_id, node_id, expires_at) VALUES (?, ?, ?) 
+                ON CONFLICT(user_id) DO UPDATE SET node_id = excluded.node_id, expires_at = excluded.expires_at 
+                WHERE session_leases.expires_at < ? OR session_leases.node_id = excluded.node_id
+            ''', (user_id, node_id, now + ttl, now))
+            if not cursor.rowcount:
+                return None
+            cursor.execute(
+                'SELECT filters_rev, session_rev FROM session_leases WHERE user_id = ?', (user_id,)
+            )
+            return cursor.fetchone()
+    
+    def release_leases(self, node_id, user_ids=None):
+        """Отказ от аренд узла (всех или указанных)"""
+        with self.writer() as conn:
+            cursor = conn.cursor()
+            if user_ids is None:
+                cursor.execute('DELETE FROM session_leases WHERE node_id = ?', (node_id,))
+            else:
+                cursor.executemany(
+                    'DELETE FROM session_leases WHERE node_id = ? AND user_id = ?',
+                    [(node_id, user_id) for user_id in user_ids]
+                )
+    
+    def bump_lease_revision(self, user_id=None, session=False):
+        """Сигнал узлу-владельцу: перечитать фильтры или перезапустить сессию (без user_id - все аренды)"""
+        column = 'session_rev' if session else 'filters_rev'
+        with self.writer() as conn:
+            if user_id is None:
+                conn.execute(f'UPDATE session_leases SET {column} = {column} + 1')
+            else:
+                conn.execute(f'UPDATE session_leases SET {column} = {column} + 1 WHERE user_id = ?', (user_id,))
+    
+    def get_lease_holder(self, user_id):
+        """Узел с действующей арендой сессии или None"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT node_id FROM session_leases WHERE user_id = ? AND expires_at >= ?',
+                (user_id, time.time())
+            )
+            result = cursor.fetchone()
+            return result[0] if result else None
+    
+    def count_live_leases(self):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM session_leases WHERE expires_at >= ?', (time.time(),))
+            return cursor.fetchone()[0]
+
+class CachedDatabase(Database):
+    """Белый список и настройки пользователей в памяти с записью через базу"""
+    
+    def __init__(self, *args, **kwargs):
+        self._allowed = set()
+        self._settings = {}
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        super().__init__(*args, **kwargs)
+        self.warm_cache()
+    
+    def warm_cache(self):
+        """Загрузка белого списка и всех настроек одним проходом"""
+        allowed = {user_id for user_id, _, _ in super().get_allowed_users()}
+        settings = super().load_all_filters()
+        with self._cache_lock:
+            self._allowed = allowed
+            self._settings = settings
+        logger.info(f"🗂️ Кеш загружен: {len(allowed)} в белом списке, {len(settings)} настроек")
+    
+    def _count(self, hit):
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+    
+    def is_user_allowed(self, user_id):
+        # Белый список в памяти полный, база не нужна
+        self._count(True)
+        return user_id in self._allowed
+    
+    def get_user_settings(self, user_id):
+        cached = self._settings.get(user_id)
+        self._count(cached is not None)
+        if cached is None:
+            cached = super().get_user_settings(user_id)
+            with self._cache_lock:
+                self._settings[user_id] = cached
+        keywords, exceptions = cached
+        return list(keywords), list(exceptions)
+    
+    def add_allowed_user(self, user_id, username, admin_id):
+        super().add_allowed_user(user_id, username, admin_id)
+        with self._cache_lock:
+            self._allowed.add(user_id)
+    
+    def remove_allowed_user(self, user_id):
+        super().remove_allowed_user(user_id)
+        with self._cache_lock:
+            self._allowed.discard(user_id)
+            self._settings.pop(user_id, None)
+    
+    def save_session(self, user_id, username, session_string):
+        super().save_session(user_id, username, session_string)
+        # Строка пользователя перезаписана, настройки перечитаем из базы
+        with self._cache_lock:
+            self._settings.pop(user_id, None)
+    
+    def save_keywords(self, user_id, keywords, exceptions):
+        super().save_keywords(user_id, keywords, exceptions)
+        with self._cache_lock:
+            self._settings[user_id] = (normalize_patterns(keywords), normalize_patterns(exceptions))
+    
+    def cache_stats(self):
+        total = self.cache_hits + self.cache_misses
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_rate': self.cache_hits / total if total else 0.0,
+            'allowed': len(self._allowed),
+            'settings': len(self._settings),
+        }
+
 class SessionManager:
-    def __init__(self, api_id, api_hash, database, bot):
+    def __init__(self, api_id, api_hash, database, bot, runtime=None, notifier=None):
         self.api_id = api_id
         self.api_hash = api_hash
         self.db = database
         self.bot = bot
+        
+        # Уведомления уходят через отдельную очередь, чтобы HTTPS запрос не блокировал loop
+        self.notifier = notifier or NotificationDispatcher(
+            bot,
+            max_queue=NOTIFY_QUEUE_SIZE,
+            workers=NOTIFY_WORKERS,
+            global_rate=NOTIFY_GLOBAL_RATE,
+            chat_interval=NOTIFY_CHAT_INTERVAL,
+            digest_threshold=NOTIFY_DIGEST_THRESHOLD
+        )
+        self.notifier.start()
+        
+        # Общий кеш отправителей и чатов для всех сессий
+        self.entities = EntityCache(max_size=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL)
+        self.dedup = DedupStore(ttl=DEDUP_TTL, max_entries=DEDUP_MAX_ENTRIES)
         self.active_clients = {}
+        self._session_locks = {}
+        self.startup_progress = None
+        
+        # Вызывается (user_id, running) при запуске и остановке сессии
+        self.on_state = None
+        
+        # Фильтры читаются обработчиками на каждом сообщении и меняются без переподключения
+        self.filters = FilterRegistry(loader=self.db.get_user_settings)
+        self.prefilters = {}
+        self._handlers = {}
+        
+        # Ограниченные очереди входящих сообщений по сессиям
+        self.inbound = {}
+        
+        # Задачи надзора за соединением и сессии в процессе переподключения {user_id: попытка}
+        self._supervisors = {}
+        self.reconnecting = {}
+        self.reconnect_limiter = ReconnectLimiter(RECONNECT_RATE, RECONNECT_BURST)
+        
+        # Журнал совпадений пишется пачками из отдельного потока
+        self.history = None
+        if HISTORY_ENABLED:
+            self.history = MatchHistoryWriter(
+                self.db,
+                batch_size=HISTORY_BATCH_SIZE,
+                flush_interval=HISTORY_FLUSH_INTERVAL
+            )
+            self.history.start()
+        
+        # Один общий loop для всех клиентов Telethon
+        self.runtime = runtime or SessionRuntime()
+        self.runtime.start()
+        self.runtime.submit(watch_loop_lag())
+        if CATCH_UP_ENABLED:
+            self.runtime.submit(self._save_update_states_loop())
+        self._register_metrics()
         
     def start_all_sessions(self):
-        """Запуск всех сессий"""
+        """Параллельный запуск всех сессий, прогресс доступен в self.startup_progress"""
         try:
             users = self.db.get_all_active_users()
             logger.info(f"🔄 Найдено {len(users)} пользователей для запуска")
-            
-            for user_id, session_string, keywords_json, exceptions_json in users:
-                self.start_session(user_id, session_string)
+            return self.start_sessions(users)
                 
         except Exception as e:
             logger.error(f"❌ Ошибка запуска сессий: {e}")
     
+    def start_sessions(self, users):
+        """Параллельный запуск списка сессий [(user_id, session_string)]"""
+        # Все фильтры компилируем по одной выборке из таблицы filters
+        user_ids = {user_id for user_id, _ in users}
+        filters = self.db.load_all_filters(active_only=True)
+        self.filters.load({user_id: f for user_id, f in filters.items() if user_id in user_ids})
+        
+        progress = StartupProgress(len(users))
+        self.startup_progress = progress
+        return self.runtime.submit(start_sessions_bulk(
+            users,
+            self._start_session,
+            concurrency=SESSION_START_CONCURRENCY,
+            dc_interval=SESSION_START_DC_INTERVAL,
+            progress=progress
+        ))
+    
     def start_session(self, user_id, session_string):
-        """Запуск одной сессии"""
+        """Запуск одной сессии (команда в общий loop, не блокирует поток бота)"""
+        return self.runtime.submit(self._start_session(user_id, session_string))
+    
+    def add_session(self, user_id, username, session_string, promote=True):
+        """Проверка и сохранение новой сессии в общем loop, проверенный клиент сразу становится рабочим
+
+        Возвращает future с данными аккаунта {'id', 'first_name', 'username'}.
+        """
+        return self.runtime.submit(self._add_session(user_id, username, session_string, promote))
+    
+    def stop_session(self, user_id):
+        """Остановка сессии (команда в общий loop)"""
+        return self.runtime.submit(self._stop_session(user_id))
+    
+    def restart_session(self, user_id):
+        """Перезапуск сессии"""
+        session_string = self.db.get_user_session(user_id)
+        if session_string:
+            return self.start_session(user_id, session_string)
+    
+    def update_filters(self, user_id, keywords, exceptions):
+        """Горячая замена фильтра пользователя без перезапуска сессии"""
+        self.filters.set(user_id, keywords, exceptions)
+    
+    def forget_user(self, user_id):
+        """Удаление фильтров пользователя из памяти (очередь входящих удаляет остановка сессии)"""
+        self.filters.remove(user_id)
+        self.prefilters.pop(user_id, None)
+    
+    def stats(self):
+        """Сводка для админ панели"""
+        inbound_users = self.inbound_stats()
+        inbound = {'depth': 0, 'received': 0, 'dropped': 0, 'degraded': 0, 'lag_last': 0.0, 'lag_max': 0.0}
+        for user_stats in inbound_users.values():
+            for key, value in user_stats.items():
+                inbound[key] = max(inbound[key], value) if key.startswith('lag') else inbound[key] + value
+        return {
+            'active_sessions': len(self.active_clients),
+            'notifier': self.notifier.stats(),
+            'dedup_suppressed': self.dedup.suppressed,
+            'entities': self.entities.stats(),
+            'inbound': inbound,
+            'inbound_users': inbound_users,
+            'reconnecting': dict(self.reconnecting),
+        }
+    
+    def inbound_stats(self):
+        """Очереди входящих по пользователям: глубина, отброшено, задержка"""
+        return {user_id: queue.stats() for user_id, queue in list(self.inbound.items())}
+    
+    def _register_metrics(self):
+        """Метрики, которые считываются из состояния менеджера в момент запроса"""
+        REGISTRY.gauge(
+            'monitor_active_sessions', 'Запущенные сессии',
+            collect=lambda: len(self.active_clients)
+        )
+        REGISTRY.gauge(
+            'monitor_session_connected', 'Подключение сессии к Telegram (1 - подключена)', ('user_id',),
+            collect=lambda: {
+                user_id: int(client.is_connected()) for user_id, client in list(self.active_clients.items())
+            }
+        )
+        REGISTRY.gauge(
+            'monitor_sessions_reconnecting', 'Сессии в процессе переподключения',
+            collect=lambda: len(self.reconnecting)
+        )
+        REGISTRY.gauge(
+            'monitor_notify_queue_depth', 'Уведомления в очереди',
+            collect=self.notifier.queue_depth
+        )
+        inbound = self.inbound_stats
+        REGISTRY.counter(
+            'monitor_inbound_received', 'Входящие сообщения по сессиям', ('user_id',),
+            collect=lambda: {user_id: stats['received'] for user_id, stats in inbound().items()}
+        )
+        REGISTRY.counter(
+            'monitor_inbound_dropped', 'Отброшенные при перегрузке сообщения', ('user_id',),
+            collect=lambda: {user_id: stats['dropped'] for user_id, stats in inbound().items()}
+        )
+        REGISTRY.gauge(
+            'monitor_inbound_depth', 'Глубина очереди входящих', ('user_id',),
+            collect=lambda: {user_id: stats['depth'] for user_id, stats in inbound().items()}
+        )
+        REGISTRY.gauge(
+            'monitor_inbound_lag_seconds', 'Задержка последнего входящего перед обработкой', ('user_id',),
+            collect=lambda: {user_id: stats['lag_last'] for user_id, stats in inbound().items()}
+        )
+    
+    def _get_inbound(self, user_id):
+        queue = self.inbound.get(user_id)
+        if queue is None:
+            queue = self.inbound[user_id] = InboundQueue(
+                lambda event, degraded: self.handle_message(user_id, event, degraded),
+                maxsize=INBOUND_QUEUE_SIZE,
+                consumers=INBOUND_CONSUMERS,
+                policy=INBOUND_POLICY,
+                sample_every=INBOUND_SAMPLE_EVERY
+            )
+        return queue
+    
+    def _set_state(self, user_id, running):
+        if self.on_state is not None:
+            try:
+                self.on_state(user_id, running)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработчика состояния сессии {user_id}: {e}")
+    
+    def get_prefilter(self, user_id):
+        """Предфильтр пользователя (списки чатов, направление, длина текста)"""
+        prefilter = self.prefilters.get(user_id)
+        if prefilter is None:
+            prefilter = self.prefilters[user_id] = self._build_prefilter(user_id)
+        return prefilter
+    
+    def update_prefilter(self, user_id):
+        """Перечитать правила чатов; обработчик перерегистрируется только при смене списков"""
+        old = self.prefilters.get(user_id)
+        new = self.prefilters[user_id] = self._build_prefilter(user_id)
+        client = self.active_clients.get(user_id)
+        if client is not None and not new.same_registration(old):
+            self.runtime.call_soon(self._register_handler, user_id, client)
+    
+    def _build_prefilter(self, user_id):
+        return PreFilter.from_rules(
+            self.db.get_chat_rules(user_id),
+            incoming_only=not MONITOR_OUTGOING,
+            min_text_length=MIN_TEXT_LENGTH
+        )
+    
+    def _register_handler(self, user_id, client):
+        """Регистрация обработчика: отсев по чатам и направлению делает сам Telethon"""
+        from telethon import events
+        
+        previous = self._handlers.pop(user_id, None)
+        if previous is not None:
+            client.remove_event_handler(previous)
+        
+        prefilter = self.get_prefilter(user_id)
+        
+        inbound = self._get_inbound(user_id)
+        
+        # Обработчик Telethon только ставит событие в очередь сессии
+        async def handler(event):
+            inbound.put(event)
+        
+        # Правки идут тем же путем: предфильтр, очередь, дедупликация по (чат, сообщение)
+        builders = (events.NewMessage, events.MessageEdited) if MONITOR_EDITS else (events.NewMessage,)
+        for builder in builders:
+            client.add_event_handler(handler, builder(
+                func=lambda event: self.prefilters.get(user_id, prefilter)(event),
+                **prefilter.event_kwargs()
+            ))
+        self._handlers[user_id] = handler
+    
+    def shutdown(self, timeout=30):
+        """Остановка всех сессий и общего loop"""
         try:
-            # Останавливаем существующую сессию если есть
-            if user_id in self.active_clients:
-                self.stop_session(user_id)
-            
-            from telethon import TelegramClient
-            from telethon.sessions import StringSession
-            from telethon import events
-            
-            # Создаем отдельный loop для этой сессии
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            # Создаем асинхронную функцию для запуска
-            async def start_client():
-                client = TelegramClient(
-                    StringSession(session_string),
-                    self.api_id,
-                    self.api_hash
-                )
-                await client.start()
-                
-                # Получаем настройки пользователя
-                keywords, exceptions = self.db.get_user_settings(user_id)
+            self.runtime.call(self._stop_all_sessions(), timeout)
+        except Exception as e:
+            logger.error(f"❌ Ошибка остановки сессий: {e}")
+        self.runtime.stop()
+        self.notifier.stop()
+        if self.history is not None:
+            self.history.stop()
+    
+    def _get_session_lock(self, user_id):
+        lock = self._session_locks.get(user_id)
+        if lock is None:
+            lock = self._session_locks[user_id] = asyncio.Lock()
+        return lock
+    
+    async def _connect(self, session_string):
+        """Подключение клиента с проверкой авторизации"""
+        client = create_client(
+            session_string,
+            self.api_id,
+            self.api_hash,
+            low_memory=SESSION_LOW_MEMORY,
+            entity_limit=SESSION_ENTITY_LIMIT
+        )
+        # client.start() запросил бы телефон через input() и заблокировал общий loop
+        await client.connect()
+        if not await client.is_user_authorized():
+            await client.disconnect()
+            raise SessionRevokedError("Сессия не авторизована")
+        return client
+    
+    async def _load_filters(self, user_id):
+        """Фильтр и правила чатов из базы до активации: чтение SQLite не должно держать общий loop"""
+        loop = asyncio.get_running_loop()
+        # Компилируем фильтр заранее, обработчик берет актуальный из реестра
+        await loop.run_in_executor(None, self.filters.get, user_id)
+        if user_id not in self.prefilters:
+            prefilter = await loop.run_in_executor(None, self._build_prefilter, user_id)
+            # Пока шло чтение, update_prefilter мог положить более свежий
+            self.prefilters.setdefault(user_id, prefilter)
+    
+    def _activate(self, user_id, client):
+        """Подключенный клиент становится рабочим (под блокировкой сессии, фильтры уже загружены)"""
+        # Настраиваем обработчик
+        self._register_handler(user_id, client)
+        
+        self.active_clients[user_id] = client
+        self._get_inbound(user_id).start()
+        self._supervisors[user_id] = asyncio.ensure_future(self._supervise(user_id, client))
+        logger.info(f"✅ Сессия для {user_id} запущена")
+        self._set_state(user_id, True)
+        
+        # Прогреваем кеш сущностей в фоне, не задерживая запуск
+        if ENTITY_WARM_DIALOGS:
+            asyncio.ensure_future(self.entities.warm(client, limit=ENTITY_WARM_DIALOGS))
+    
+    async def _start_session(self, user_id, session_string):
+        """Запуск одной сессии внутри общего loop"""
+        async with self._get_session_lock(user_id):
+            try:
+                # Останавливаем существующую сессию если есть
+                if user_id in self.active_clients:
+                    await self._disconnect(user_id)
                 
-                # Настраиваем обработчик
-                @client.on(events.NewMessage)
-                async def handler(event):
-                    await self.handle_message(user_id, event, keywords, exceptions)
+                client = await self._connect(session_string)
+                await self._load_filters(user_id)
+                self._activate(user_id, client)
+                if CATCH_UP_ENABLED:
+                    asyncio.ensure_future(self._catch_up(user_id, client))
+                return True
                 
-                return client
-            
-            # Запускаем клиента
-            client = loop.run_until_complete(start_client())
+            except Exception as e:
+                # FloodWait отдаем наверх, чтобы массовый запуск притормозил этот DC
+                if type(e).__name__ == 'FloodWaitError':
+                    self._set_state(user_id, False)
+                    raise
+                logger.error(f"❌ Ошибка запуска сессии для {user_id}: {e}")
+                self._set_state(user_id, False)
+                return False
+    
+    async def _add_session(self, user_id, username, session_string, promote):
+        """Проверка новой сессии тем же подключением, которое потом будет мониторить"""
+        client = await self._connect(session_string)
+        try:
+            me = await client.get_me()
+            # Запись в SQLite не должна держать общий loop
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.db.save_session, user_id, username, session_string
+            )
+        except BaseException:
+            await client.disconnect()
+            raise
+        
+        if promote:
+            async with self._get_session_lock(user_id):
+                if user_id in self.active_clients:
+                    await self._disconnect(user_id, save_state=False)
+                try:
+                    await self._load_filters(user_id)
+                    self._activate(user_id, client)
+                except BaseException:
+                    # Проверенное подключение не должно остаться висеть без сессии
+                    await client.disconnect()
+                    raise
+        else:
+            await client.disconnect()
+        return {'id': me.id, 'first_name': me.first_name, 'username': me.username}
+    
+    async def _stop_session(self, user_id):
+        """Остановка сессии внутри общего loop"""
+        async with self._get_session_lock(user_id):
+            await self._disconnect(user_id)
+        self._set_state(user_id, False)
+    
+    async def _disconnect(self, user_id, save_state=True):
+        client = self.active_clients.pop(user_id, None)
+        self._handlers.pop(user_id, None)
+        self.reconnecting.pop(user_id, None)
+        supervisor = self._supervisors.pop(user_id, None)
+        if supervisor is not None and supervisor is not asyncio.current_task():
+            supervisor.cancel()
+        # Очередь удаляется вместе с обработчиками: новый запуск создаст свою
+        inbound = self.inbound.pop(user_id, None)
+        if inbound is not None:
+            await inbound.stop()
+        if client is None:
+            return
+        try:
+            await client.disconnect()
+            logger.info(f"🛑 Сессия {user_id} остановлена")
+        except Exception as e:
+            logger.error(f"❌ Ошибка остановки сессии {user_id}: {e}")
+        if CATCH_UP_ENABLED and save_state:
+            # При отключении Telethon выгружает в session самое свежее состояние
+            await self._save_update_states({user_id: client})
+    
+    async def _supervise(self, user_id, client):
+        """Надзор за клиентом: обрыв виден по client.disconnected, зависание - по is_connected()
+
+        Короткие обрывы Telethon переживает сам; сюда попадаем, когда он исчерпал свои попытки.
+        """
+        while self.active_clients.get(user_id) is client:
+            try:
+                await asyncio.wait_for(client.disconnected, SESSION_HEALTH_INTERVAL)
+            except asyncio.TimeoutError:
+                if client.is_connected():
+                    continue
+            except Exception as e:
+                logger.warning(f"⚠️ Сессия {user_id} потеряла соединение: {e}")
+            if self.active_clients.get(user_id) is not client:
+                return
+            await self._reconnect(user_id, client)
+    
+    async def _reconnect(self, user_id, client):
+        """Переподключение того же клиента: обработчик, очередь и состояние обновлений сохраняются"""
+        attempt = 0
+        while self.active_clients.get(user_id) is client:
+            self.reconnecting[user_id] = attempt + 1
+            await asyncio.sleep(backoff_delay(attempt, RECONNECT_BASE_DELAY, RECONNECT_MAX_DELAY))
+            await self.reconnect_limiter.acquire()
+            if self.active_clients.get(user_id) is not client:
+                return
+            try:
+                if not client.is_connected():
+                    await client.connect()
+                # Запрос с авторизацией: отозванный ключ проявится здесь, а не на следующем сообщении
+                await client.get_me()
+            except Exception as e:
+                if is_revoked(e):
+                    SESSION_RECONNECTS.labels('revoked').inc()
+                    await self._revoke(user_id, client, e)
+                    return
+                SESSION_RECONNECTS.labels('failed').inc()
+                logger.warning(f"⚠️ Сессия {user_id}: попытка переподключения {attempt + 1} не удалась: {e}")
+                if type(e).__name__ == 'FloodWaitError':
+                    await asyncio.sleep(getattr(e, 'seconds', 0))
+                attempt += 1
+                continue
             
-            self.active_clients[user_id] = {
-                'client': client,
-                'loop': loop
-            }
+            self.reconnecting.pop(user_id, None)
+            SESSION_RECONNECTS.labels('ok').inc()
+            logger.info(f"🔌 Сессия {user_id} переподключена (попытка {attempt + 1})")
+            if CATCH_UP_ENABLED:
+                # Разрыв за время обрыва закрывает сам Telethon по сохраненному в клиенте pts
+                await client.catch_up()
+            return
+    
+    async def _revoke(self, user_id, client, error):
+        """Ключ сессии больше не действует: сессия снимается, пользователь получает уведомление"""
+        logger.error(f"🔑 Сессия {user_id} отозвана: {error}")
+        # Вызывается из самого надзора - его задачу не отменяем
+        self._supervisors.pop(user_id, None)
+        async with self._get_session_lock(user_id):
+            if self.active_clients.get(user_id) is not client:
+                return
+            await self._disconnect(user_id, save_state=False)
+        self._set_state(user_id, False)
+        self.notifier.submit(
+            user_id,
+            "🔑 Сессия Telegram отозвана или истекла, мониторинг остановлен.\n"
+            "Загрузите новую сессию через /start"
+        )
+    
+    async def _save_update_states(self, clients):
+        states = {}
+        for user_id, client in clients.items():
+            try:
+                state = capture_update_state(client)
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения состояния обновлений {user_id}: {e}")
+                continue
+            if state is not None:
+                states[user_id] = state
+        if not states:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.db.save_update_states, states)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения состояния обновлений: {e}")
+    
+    async def _save_update_states_loop(self):
+        """Периодическое сохранение состояний всех сессий - на случай падения процесса"""
+        while True:
+            await asyncio.sleep(UPDATE_STATE_SAVE_INTERVAL)
+            await self._save_update_states(dict(self.active_clients))
+    
+    async def _catch_up(self, user_id, client):
+        """Догрузка сообщений, пропущенных пока сессия была отключена
+
+        Живые обновления в это время уже идут через очередь сессии, пересечение
+        отсекает DedupStore. Догруженное проходит тот же предфильтр и обрабатывается пачками.
+        """
+        from telethon import events
+        
+        try:
+            state = await asyncio.get_running_loop().run_in_executor(None, self.db.get_update_state, user_id)
+            if state is None:
+                return
+            age = time.time() - state['saved_at']
+            if age > CATCH_UP_MAX_AGE:
+                logger.info(f"⏭ Сессия {user_id}: состояние устарело ({age:.0f} с), догрузка пропущена")
+                return
             
-            logger.info(f"✅ Сессия для {user_id} запущена")
+            missed = await fetch_missed(client, state, limit=CATCH_UP_MAX_MESSAGES)
+            handler = self._handlers.get(user_id)
+            # Тот же обработчик зарегистрирован и на правки; догружаются только новые сообщения
+            builder = next((
+                b for callback, b in client.list_event_handlers()
+                if callback is handler and type(b) is events.NewMessage
+            ), None)
+            if builder is None or self.active_clients.get(user_id) is not client:
+                return
+            await builder.resolve(client)
+            pending = build_events(client, missed, builder)
             
+            for start in range(0, len(pending), CATCH_UP_BATCH_SIZE):
+                if self.active_clients.get(user_id) is not client:
+                    return
+                batch = pending[start:start + CATCH_UP_BATCH_SIZE]
+                await asyncio.gather(*(self.handle_message(user_id, event) for event in batch))
+            CATCH_UP_MESSAGES.inc(len(pending))
+            logger.info(f"📥 Сессия {user_id}: догружено {len(missed)} сообщений, обработано {len(pending)}")
         except Exception as e:
-            logger.error(f"❌ Ошибка запуска сессии для {user_id}: {e}")
+            logger.error(f"❌ Ошибка догрузки пропущенных сообщений {user_id}: {e}")
+    
+    async def _stop_all_sessions(self):
+        await asyncio.gather(
+            *(self._stop_session(user_id) for user_id in list(self.active_clients)),
+            return_exceptions=True
+        )
     
-    async def handle_message(self, user_id, event, keywords, exceptions):
-        """Обработка сообщений"""
+    async def handle_message(self, user_id, event, degraded=False):
+        """Обработка сообщений (degraded - при перегрузке без запросов отправителя и чата)"""
         try:
             message = event.message
             if not message.text:
                 return
             
-            text_lower = message.text.lower()
-            keywords_lower = [k.lower() for k in keywords]
-            exceptions_lower = [e.lower() for e in exceptions]
+            MESSAGES_RECEIVED.inc()
+            started = time.perf_counter()
+            
+            # Сообщение общего канала сканируется один раз для всех сессий
+            message_id = message.id if event.is_channel else None
+            # Фильтр на момент проверки: по нему же журнал определит сработавшие шаблоны
+            matcher = self.filters.get(user_id)
+            with MATCH_SECONDS.time():
+                matched = self.filters.match(user_id, message.text, event.chat_id, message_id)
+            if not matched:
+                return
+            MESSAGES_MATCHED.inc()
             
-            # Проверяем ключевые слова
-            keyword_found = any(keyword in text_lower for keyword in keywords_lower)
-            if not keyword_found:
+            # Тот же текст или то же сообщение уже отправлялись пользователю
+            if not self.dedup.first_seen(user_id, event.chat_id, message.id, message.text):
                 return
             
-            # Проверяем исключения
-            exception_found = any(exception in text_lower for exception in exceptions_lower)
-            if exception_found:
+            if self.history is not None:
+                # Полный проход только для отправляемых уведомлений
+                keywords = matcher.scan(message.text).keywords
+                self.history.record(user_id, event.chat_id, event.sender_id, message.id, message.text, keywords)
+            
+            if degraded:
+                full_message = (
+                    f"🔔 **Найдено совпадение!**\n\n"
+                    f"🆔 **От ID:** `{event.sender_id}`\n"
+                    f"📋 **Чат:** `{event.chat_id}`\n"
+                    f"📅 **Время:** {message.date.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+                    f"💬 **Сообщение:**\n{message.text}"
+                )
+                self.notifier.submit(user_id, full_message, parse_mode='Markdown')
+                HANDLE_SECONDS.observe(time.perf_counter() - started)
                 return
             
-            # Получаем информацию об отправителе
-            sender = await event.get_sender()
+            # Получаем информацию об отправителе (из кеша, без сетевого запроса в обычном случае)
+            sender = await self.entities.get_sender(event)
             sender_username = f"@{sender.username}" if sender and sender.username else "Нет username"
             sender_name = getattr(sender, 'first_name', '') or getattr(sender, 'title', '') or "Неизвестно"
             sender_id = sender.id if sender else "Неизвестно"
             
             # Получаем информацию о чате
-            chat = await event.get_chat()
+            chat = await self.entities.get_chat(event)
             chat_title = getattr(chat, 'title', '') or getattr(chat, 'username', '') or "Личные сообщения"
             
             # Формируем полное сообщение для пересылки
@@ -258,93 +1334,157 @@ class SessionManager:
                 f"🔔 **Найдено совпадение!**\n\n"
                 f"👤 **От:** {sender_username} ({sender_name})\n"
                 f"🆔 **ID:** `{sender_id}`\n"
-                f"📋 **Чат:** {chat_title}\n"
+                f"📋 **Чат:** {chat_title} (`{event.chat_id}`)\n"
                 f"📅 **Время:** {message.date.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
                 f"💬 **Сообщение:**\n{message.text}"
             )
             
-            # Отправляем сообщение через бота
-            try:
-                self.bot.send_message(user_id, full_message, parse_mode='Markdown')
-                logger.info(f"📨 Сообщение переслано пользователю {user_id}")
-            except Exception as e:
-                logger.error(f"❌ Ошибка отправки сообщения: {e}")
+            # Ставим уведомление в очередь, отправка идет в отдельных потоках
+            if self.notifier.submit(user_id, full_message, parse_mode='Markdown'):
+                logger.info(f"📨 Сообщение для {user_id} поставлено в очередь")
+            else:
+                logger.warning(f"⚠️ Очередь уведомлений переполнена, сообщение для {user_id} отброшено")
+            HANDLE_SECONDS.observe(time.perf_counter() - started)
                 
         except Exception as e:
             logger.error(f"❌ Ошибка обработки сообщения: {e}")
-    
-    def stop_session(self, user_id):
-        """Остановка сессии"""
-        if user_id in self.active_clients:
-            try:
-                client_data = self.active_clients[user_id]
-                client = client_data['client']
-                loop = client_data['loop']
-                
-                # Останавливаем клиента
-                async def disconnect():
-                    await client.disconnect()
-                
-                loop.run_until_complete(disconnect())
-                
-                # Закрываем loop
-                if not loop.is_closed():
-                    loop.close()
-                
-                del self.active_clients[user_id]
-                logger.info(f"🛑 Сессия {user_id} остановлена")
-                
-            except Exception as e:
-                logger.error(f"❌ Ошибка остановки сессии {user_id}: {e}")
-                # Принудительно удаляем даже при ошибке
-                if user_id in self.active_clients:
-                    del self.active_clients[user_id]
-    
-    def restart_session(self, user_id):
-        """Перезапуск сессии"""
-        session_string = self.db.get_user_session(user_id)
-        if session_string:
-            self.start_session(user_id, session_string)
+
+# Списки чатов: заголовок, команды добавления и удаления, ответы на них
+CHAT_RULE_TEXTS = {
+    KIND_MUTE_CHAT: (
+        "🔇 **Заглушенные чаты:**", "mute", "unmute",
+        "🔇 Чат {chat_id} заглушен", "🔊 Чат {chat_id} снова отслеживается"
+    ),
+    KIND_INCLUDE_CHAT: (
+        "👁 **Отслеживаются только чаты:**", "watch", "unwatch",
+        "👁 Чат {chat_id} добавлен в отслеживаемые, остальные чаты не проверяются",
+        "👁 Чат {chat_id} убран из отслеживаемых (пустой список - все чаты)"
+    ),
+    KIND_EXCLUDE_CHAT: (
+        "🙈 **Игнорируемые чаты:**", "ignore", "unignore",
+        "🙈 Чат {chat_id} игнорируется", "🔊 Чат {chat_id} больше не игнорируется"
+    ),
+}
 
 class MonitorBot:
     def __init__(self):
-        self.db = Database()
+        with PROFILE.phase('база данных'):
+            self.db = CachedDatabase()
         self.updater = None
         self.session_manager = None
     
     def start(self):
-        """Запуск бота"""
+        """Запуск бота: прием обновлений начинается сразу, сессии поднимаются в фоне"""
         try:
             logger.info("🚀 Запуск бота...")
             
+            start_metrics()
+            
+            with PROFILE.phase('импорт python-telegram-bot'):
+                load_telegram()
+            
             # Создаем Updater
-            self.updater = Updater(BOT_TOKEN, use_context=True)
-            self.session_manager = SessionManager(API_ID, API_HASH, self.db, self.updater.bot)
+            with PROFILE.phase('Updater и менеджер сессий'):
+                self.updater = Updater(BOT_TOKEN, use_context=True, workers=BOT_WORKERS)
+                if SESSION_SHARDS > 1:
+                    from sharding import ShardedSessionManager
+                    self.session_manager = ShardedSessionManager(self.db, SESSION_SHARDS)
+                else:
+                    self.session_manager = SessionManager(API_ID, API_HASH, self.db, self.updater.bot)
+                if SESSION_LEASES:
+                    self.session_manager = with_leases(self.session_manager, self.db)
             
             # Настраиваем обработчики
             self.setup_handlers()
             
-            # Запускаем существующие сессии
-            self.session_manager.start_all_sessions()
+            # Запускаем бота; существующие сессии - как только начат прием обновлений
+            self.serve(on_ready=self.start_background)
             
-            # Запускаем бота
-            logger.info("🤖 Бот запущен")
-            self.updater.start_polling()
-            self.updater.idle()
+            # Останавливаем сессии после остановки бота
+            self.session_manager.shutdown()
                 
         except Exception as e:
             logger.error(f"💥 Критическая ошибка при запуске: {e}")
             raise
     
+    def start_background(self):
+        """Тяжелая часть запуска в отдельном потоке, пока бот уже отвечает"""
+        PROFILE.mark('бот принимает обновления')
+        threading.Thread(target=self._start_sessions, name="startup", daemon=True).start()
+    
+    def _start_sessions(self):
+        try:
+            # Telethon грузится здесь, а не на первом подключении или первой загруженной сессии
+            with PROFILE.phase('импорт Telethon'):
+                importlib.import_module('telethon')
+            with PROFILE.phase('запуск сессий'):
+                started = self.session_manager.start_all_sessions()
+                if started is not None:
+                    started.result()
+        except Exception as e:
+            logger.error(f"❌ Ошибка фонового запуска: {e}")
+        PROFILE.report()
+    
+    def serve(self, on_ready=None):
+        """Прием обновлений в выбранном режиме до сигнала остановки
+
+        on_ready вызывается, как только прием обновлений начат.
+        """
+        on_ready = on_ready or (lambda: None)
+        path = WEBHOOK_PATH or BOT_TOKEN
+        
+        if WEBHOOK_MODE == 'webhook':
+            if not WEBHOOK_URL:
+                raise ValueError("WEBHOOK_URL не установлен для WEBHOOK_MODE=webhook")
+            self.updater.start_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=PORT,
+                url_path=path,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{path}",
+                drop_pending_updates=False
+            )
+            logger.info(f"🤖 Бот запущен (webhook, порт {PORT})")
+            on_ready()
+            self.updater.idle()
+        
+        elif WEBHOOK_MODE == 'local':
+            from webhook import LocalWebhookServer
+            
+            server = LocalWebhookServer(self.updater.dispatcher, host=WEBHOOK_LISTEN, port=PORT, path=path)
+            server.start()
+            if WEBHOOK_URL:
+                self.updater.bot.set_webhook(f"{WEBHOOK_URL.rstrip('/')}/{path}")
+            logger.info(f"🤖 Бот запущен (локальный вебхук, порт {PORT})")
+            on_ready()
+            
+            stop = threading.Event()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda *args: stop.set())
+            stop.wait()
+            server.stop()
+        
+        else:
+            self.updater.start_polling()
+            logger.info("🤖 Бот запущен (polling)")
+            on_ready()
+            self.updater.idle()
+    
     def setup_handlers(self):
-        """Настройка обработчиков команд"""
+        """Настройка обработчиков команд (run_async - обработка в пуле потоков Dispatcher)"""
         dp = self.updater.dispatcher
         
-        dp.add_handler(CommandHandler("start", self.start_command))
-        dp.add_handler(CommandHandler("admin", self.admin_command))
-        dp.add_handler(CommandHandler("debug", self.debug_command))
-        dp.add_handler(MessageHandler(Filters.text & ~Filters.command, self.handle_message))
-        dp.add_handler(CallbackQueryHandler(self.handle_callback))
+        dp.add_handler(CommandHandler("start", self.start_command, run_async=True))
+        dp.add_handler(CommandHandler("admin", self.admin_command, run_async=True))
+        dp.add_handler(CommandHandler("debug", self.debug_command, run_async=True))
+        dp.add_handler(CommandHandler("mute", self.mute_command, run_async=True))
+        dp.add_handler(CommandHandler("unmute", self.unmute_command, run_async=True))
+        dp.add_handler(CommandHandler("watch", self.watch_command, run_async=True))
+        dp.add_handler(CommandHandler("unwatch", self.unwatch_command, run_async=True))
+        dp.add_handler(CommandHandler("ignore", self.ignore_command, run_async=True))
+        dp.add_handler(CommandHandler("unignore", self.unignore_command, run_async=True))
+        dp.add_handler(CommandHandler("history", self.history_command, run_async=True))
+        dp.add_handler(MessageHandler(Filters.text & ~Filters.command, self.handle_message, run_async=True))
+        dp.add_handler(CallbackQueryHandler(self.handle_callback, run_async=True))
         dp.add_error_handler(self.error_handler)
     
     def debug_command(self, update: Update, context: CallbackContext):
@@ -360,7 +1500,7 @@ class MonitorBot:
             status = "❌ НЕ АДМИН"
         
         is_allowed = self.db.is_user_allowed(user_id)
-        monitor_status = "🟢 Запущен" if user_id in self.session_manager.active_clients else "🔴 Остановлен"
+        monitor_status = self.monitor_status(user_id) or "🔴 Остановлен"
         
         debug_info = (
             f"🔧 **Отладка:**\n\n"
@@ -374,6 +1514,102 @@ class MonitorBot:
         )
         update.message.reply_text(debug_info, parse_mode='Markdown')
     
+    def monitor_status(self, user_id):
+        """Состояние мониторинга пользователя (None если сессия не запущена)"""
+        if user_id not in self.session_manager.active_clients:
+            return None
+        attempt = self.session_manager.stats()['reconnecting'].get(user_id)
+        if attempt:
+            return f"🟡 Переподключение (попытка {attempt})"
+        return "🟢 Запущен"
+    
+    def mute_command(self, update: Update, context: CallbackContext):
+        """Отключение уведомлений из чата: /mute <chat_id>"""
+        self.change_chat_rule(update, context, KIND_MUTE_CHAT, True)
+    
+    def unmute_command(self, update: Update, context: CallbackContext):
+        """Включение уведомлений из чата: /unmute <chat_id>"""
+        self.change_chat_rule(update, context, KIND_MUTE_CHAT, False)
+    
+    def watch_command(self, update: Update, context: CallbackContext):
+        """Отслеживать только выбранные чаты: /watch <chat_id>"""
+        self.change_chat_rule(update, context, KIND_INCLUDE_CHAT, True)
+    
+    def unwatch_command(self, update: Update, context: CallbackContext):
+        """Убрать чат из списка отслеживаемых: /unwatch <chat_id>"""
+        self.change_chat_rule(update, context, KIND_INCLUDE_CHAT, False)
+    
+    def ignore_command(self, update: Update, context: CallbackContext):
+        """Не получать обновления чата: /ignore <chat_id>"""
+        self.change_chat_rule(update, context, KIND_EXCLUDE_CHAT, True)
+    
+    def unignore_command(self, update: Update, context: CallbackContext):
+        """Снова получать обновления чата: /unignore <chat_id>"""
+        self.change_chat_rule(update, context, KIND_EXCLUDE_CHAT, False)
+    
+    def change_chat_rule(self, update, context, kind, enabled):
+        """Изменение списка чатов (заглушенные, только выбранные, игнорируемые)"""
+        user_id = update.effective_user.id
+        if not self.db.is_user_allowed(user_id):
+            return
+        
+        title, add_command, remove_command, added, removed = CHAT_RULE_TEXTS[kind]
+        if not context.args:
+            rule_chats = self.db.get_chat_rules(user_id).get(kind, set())
+            chats = ', '.join(f"`{chat_id}`" for chat_id in sorted(rule_chats)) or 'нет'
+            update.message.reply_text(
+                f"{title} {chats}\n\n"
+                f"Использование: /{add_command} <chat\\_id> или /{remove_command} <chat\\_id>\n"
+                f"ID чата указан в каждом уведомлении.",
+                parse_mode='Markdown'
+            )
+            return
+        
+        try:
+            chat_id = int(context.args[0])
+        except ValueError:
+            update.message.reply_text("❌ Неверный формат chat_id!")
+            return
+        
+        self.db.set_chat_rule(user_id, kind, chat_id, enabled)
+        self.session_manager.update_prefilter(user_id)
+        
+        update.message.reply_text((added if enabled else removed).format(chat_id=chat_id))
+    
+    def history_command(self, update: Update, context: CallbackContext):
+        """Последние совпадения пользователя"""
+        user_id = update.effective_user.id
+        if not self.db.is_user_allowed(user_id):
+            return
+        text, reply_markup = self.history_page(user_id)
+        update.message.reply_text(text, reply_markup=reply_markup)
+    
+    def history_page(self, user_id, before_id=None):
+        """Страница журнала и кнопки листания (без Markdown: в тексте сообщения что угодно)"""
+        rows = self.db.get_match_history(user_id, before_id, HISTORY_PAGE_SIZE + 1)
+        has_more = len(rows) > HISTORY_PAGE_SIZE
+        rows = rows[:HISTORY_PAGE_SIZE]
+        
+        if not rows:
+            text = "📜 Совпадений пока нет" if before_id is None else "📜 Более ранних совпадений нет"
+        else:
+            lines = ["📜 История совпадений\n"]
+            for _, chat_id, sender_id, message_id, keywords, preview, matched_at in rows:
+                when = time.strftime('%Y-%m-%d %H:%M', time.localtime(matched_at))
+                lines.append(
+                    f"🕒 {when} | чат {chat_id} | от {sender_id} | #{message_id}\n"
+                    f"🔍 {keywords or '-'}\n"
+                    f"💬 {preview}\n"
+                )
+            text = '\n'.join(lines)
+        
+        buttons = []
+        if has_more:
+            buttons.append(InlineKeyboardButton("⬅️ Раньше", callback_data=f"history:{rows[-1][0]}"))
+        if before_id is not None:
+            buttons.append(InlineKeyboardButton("🔄 Последние", callback_data="history:0"))
+        return text, InlineKeyboardMarkup([buttons]) if buttons else None
+    
     def start_command(self, update: Update, context: CallbackContext):
         """Обработчик команды /start"""
         user_id = update.effective_user.id
@@ -381,7 +1617,7 @@ class MonitorBot:
         
         logger.info(f"📩 /start от {user_id}")
         
-        if user_id in ADMINS:
+        if user_id in ADMINS and not self.db.is_user_allowed(user_id):
             self.db.add_allowed_user(user_id, username, user_id)
         
         if not self.db.is_user_allowed(user_id):
@@ -406,7 +1642,7 @@ class MonitorBot:
         
         logger.info(f"📩 /start от {user_id} (callback)")
         
-        if user_id in ADMINS:
+        if user_id in ADMINS and not self.db.is_user_allowed(user_id):
             self.db.add_allowed_user(user_id, username, user_id)
         
         if not self.db.is_user_allowed(user_id):
@@ -517,6 +1753,10 @@ class MonitorBot:
             self.admin_callback_command(query, context)
         elif data == "admin_add_user":
             self.admin_add_user_dialog(query, context)
+        elif data.startswith("history:"):
+            before_id = int(data.split(":")[1]) or None
+            text, reply_markup = self.history_page(user_id, before_id)
+            query.edit_message_text(text, reply_markup=reply_markup)
         elif data.startswith("admin_remove_user:"):
             target_user_id = int(data.split(":")[1])
             self.admin_remove_user(query, target_user_id)
@@ -530,61 +1770,40 @@ class MonitorBot:
         )
     
     def save_session(self, update, session_string):
-        """Сохранение сессии"""
+        """Сохранение сессии: проверка идет в общем loop, ответ обновляется по готовности"""
         user_id = update.effective_user.id
         username = update.effective_user.username or "Unknown"
         
+        message = update.message.reply_text("⏳ Проверяем сессию…")
         try:
-            from telethon import TelegramClient
-            from telethon.sessions import StringSession
-            
-            # Создаем отдельный loop для проверки сессии
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            # Асинхронная функция для проверки сессии
-            async def test_session():
-                client = TelegramClient(
-                    StringSession(session_string),
-                    API_ID,
-                    API_HASH
-                )
-                await client.start()
-                me = await client.get_me()
-                await client.disconnect()
-                return me
-            
-            # Проверяем сессию
-            me = loop.run_until_complete(test_session())
-            loop.close()
-            
-            # Сохраняем в базу
-            self.db.save_session(user_id, username, session_string)
-            
-            # Запускаем мониторинг в фоновом режиме
-            import threading
-            def start_monitoring():
-                try:
-                    self.session_manager.start_session(user_id, session_string)
-                except Exception as e:
-                    logger.error(f"Ошибка запуска мониторинга: {e}")
-            
-            thread = threading.Thread(target=start_monitoring, daemon=True)
-            thread.start()
-            
-            update.message.reply_text(
-                f"✅ **Сессия сохранена!**\n\n"
-                f"👤 Аккаунт: {me.first_name or ''}\n"
-                f"📱 Username: @{me.username or 'нет'}\n"
-                f"🆔 ID: `{me.id}`\n\n"
-                f"Мониторинг запускается...\n"
-                f"Теперь настройте фильтры.",
-                parse_mode='Markdown'
-            )
-            
+            future = self.session_manager.add_session(user_id, username, session_string)
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения сессии: {e}")
-            update.message.reply_text(f"❌ **Ошибка:**\n`{str(e)}`", parse_mode='Markdown')
+            message.edit_text(f"❌ **Ошибка:**\n`{str(e)}`", parse_mode='Markdown')
+            return
+        # Колбэк приходит из потока loop, а запрос к Bot API уходит в пул Dispatcher
+        future.add_done_callback(
+            lambda done: self.updater.dispatcher.run_async(self.report_session, message, done)
+        )
+    
+    def report_session(self, message, future):
+        """Результат проверки сессии в исходное сообщение"""
+        try:
+            me = future.result()
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения сессии: {e}")
+            message.edit_text(f"❌ **Ошибка:**\n`{str(e)}`", parse_mode='Markdown')
+            return
+        
+        message.edit_text(
+            f"✅ **Сессия сохранена!**\n\n"
+            f"👤 Аккаунт: {me['first_name'] or ''}\n"
+            f"📱 Username: @{me['username'] or 'нет'}\n"
+            f"🆔 ID: `{me['id']}`\n\n"
+            f"Мониторинг запущен.\n"
+            f"Теперь настройте фильтры.",
+            parse_mode='Markdown'
+        )
     
     def show_settings(self, query):
         """Показать настройки"""
@@ -598,10 +1817,11 @@ class MonitorBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
+        # Шаблоны в `коде`: символы * и _ из режимов не должны ломать Markdown
         text = (
             "⚙️ **Настройки фильтров**\n\n"
-            f"🔍 **Ключевые слова:** {', '.join(keywords) if keywords else 'не заданы'}\n"
-            f"🚫 **Исключения:** {', '.join(exceptions) if exceptions else 'не заданы'}\n\n"
+            f"🔍 **Ключевые слова:** {', '.join(f'`{k}`' for k in keywords) if keywords else 'не заданы'}\n"
+            f"🚫 **Исключения:** {', '.join(f'`{e}`' for e in exceptions) if exceptions else 'не заданы'}\n\n"
             "Выберите что изменить:"
         )
         
@@ -611,20 +1831,31 @@ class MonitorBot:
         """Установка ключевых слов"""
         context.user_data['state'] = 'waiting_keywords'
         query.edit_message_text(
-            "🔍 **Настройка ключевых слов**\n\nОтправьте список слов через запятую:\nПример: Москва, работа, дом\n\nСообщения проверяются без учета регистра.",
+            "🔍 **Настройка ключевых слов**\n\nОтправьте список слов через запятую:\nПример: `~Москва, работ*, \"дом\"`\n\n"
+            "• `слово` - слово или его часть\n"
+            "• `\"слово\"` - только целое слово\n"
+            "• `слово*` - слова, начинающиеся так\n"
+            "• `~слово` - все формы слова (Москва, Москве, Москвы)\n"
+            "• `/выражение/` - регулярное выражение\n\n"
+            "Сообщения проверяются без учета регистра.",
             parse_mode='Markdown'
         )
     
     def save_keywords(self, update, text):
         """Сохранение ключевых слов"""
         user_id = update.effective_user.id
-        keywords = [kw.strip() for kw in text.split(',') if kw.strip()]
+        keywords = split_patterns(text)
+        try:
+            validate_patterns(keywords)
+        except ValueError as e:
+            update.message.reply_text(f"❌ Ключевые слова не сохранены: {e}")
+            return
         
         _, exceptions = self.db.get_user_settings(user_id)
         self.db.save_keywords(user_id, keywords, exceptions)
         
-        # Перезапускаем сессию с новыми настройками
-        self.session_manager.restart_session(user_id)
+        # Подменяем фильтр в работающей сессии без переподключения
+        self.session_manager.update_filters(user_id, keywords, exceptions)
         
         update.message.reply_text(f"✅ **Ключевые слова сохранены!**\n\nСписок: {', '.join(keywords)}\n\nВсего: {len(keywords)}")
     
@@ -632,20 +1863,26 @@ class MonitorBot:
         """Установка исключений"""
         context.user_data['state'] = 'waiting_exceptions'
         query.edit_message_text(
-            "🚫 **Настройка исключений**\n\nОтправьте список слов-исключений через запятую:\nПример: Москве, работе, дома\n\nЕсли в сообщении есть слово из исключений - оно будет проигнорировано.",
+            "🚫 **Настройка исключений**\n\nОтправьте список слов-исключений через запятую:\nПример: Москве, работе, дома\n\nЕсли в сообщении есть слово из исключений - оно будет проигнорировано.\n"
+            "Поддерживаются те же режимы, что и для ключевых слов: `\"слово\"`, `слово*`, `~слово`, `/выражение/`.",
             parse_mode='Markdown'
         )
     
     def save_exceptions(self, update, text):
         """Сохранение исключений"""
         user_id = update.effective_user.id
-        exceptions = [ex.strip() for ex in text.split(',') if ex.strip()]
+        exceptions = split_patterns(text)
+        try:
+            validate_patterns(exceptions)
+        except ValueError as e:
+            update.message.reply_text(f"❌ Исключения не сохранены: {e}")
+            return
         
         keywords, _ = self.db.get_user_settings(user_id)
         self.db.save_keywords(user_id, keywords, exceptions)
         
-        # Перезапускаем сессию с новыми настройками
-        self.session_manager.restart_session(user_id)
+        # Подменяем фильтр в работающей сессии без переподключения
+        self.session_manager.update_filters(user_id, keywords, exceptions)
         
         update.message.reply_text(f"✅ **Исключения сохранены!**\n\nСписок: {', '.join(exceptions) if exceptions else 'нет'}\n\nВсего: {len(exceptions)}")
     
@@ -656,7 +1893,7 @@ class MonitorBot:
         keywords, exceptions = self.db.get_user_settings(user_id)
         
         status = "🟢 Активен" if session_string else "🔴 Неактивен"
-        monitoring = "🟢 Запущен" if user_id in self.session_manager.active_clients else "🔴 Не запущен"
+        monitoring = self.monitor_status(user_id) or "🔴 Не запущен"
         
         text = (
             "📊 **Статус мониторинга**\n\n"
@@ -717,19 +1954,46 @@ class MonitorBot:
         """Удаление пользователя"""
         self.db.remove_allowed_user(target_user_id)
         self.session_manager.stop_session(target_user_id)
+        self.session_manager.forget_user(target_user_id)
         query.edit_message_text(f"✅ Пользователь {target_user_id} удален!")
     
     def admin_stats(self, query):
         """Статистика системы"""
         users = self.db.get_allowed_users()
-        active_sessions = len(self.session_manager.active_clients)
+        stats = self.session_manager.stats()
+        progress = self.session_manager.startup_progress
         
         text = (
             "📊 **Статистика системы**\n\n"
             f"👥 Пользователей: {len(users)}\n"
-            f"🔄 Активных сессий: {active_sessions}\n"
+            f"🔄 Активных сессий: {stats['active_sessions']}\n"
             f"👑 Админов: {len(ADMINS)}"
         )
+        notify = stats['notifier']
+        text += (
+            f"\n📬 Очередь уведомлений: {notify['queue_depth']}, "
+            f"задержка {notify['latency_avg']:.1f} c (макс {notify['latency_max']:.1f} c), "
+            f"отброшено {notify['dropped']}, дублей подавлено {stats['dedup_suppressed']}"
+        )
+        inbound = stats['inbound']
+        text += (
+            f"\n📥 Входящие: в очереди {inbound['depth']}, отброшено {inbound['dropped']}, "
+            f"упрощено {inbound['degraded']}, макс. задержка {inbound['lag_max']:.1f} c"
+        )
+        lagging = sorted(
+            stats['inbound_users'].items(), key=lambda item: (item[1]['dropped'], item[1]['lag_max']), reverse=True
+        )[:3]
+        for lag_user_id, user_stats in lagging:
+            if user_stats['dropped']:
+                text += f"\n   `{lag_user_id}`: отброшено {user_stats['dropped']}, задержка {user_stats['lag_max']:.1f} c"
+        if stats['reconnecting']:
+            text += f"\n🔌 Переподключаются: {len(stats['reconnecting'])}"
+        if 'shards' in stats:
+            text += f"\n🧩 Шардов: {stats['shards']}"
+        cache = self.db.cache_stats()
+        text += f"\n🗂️ Кеш БД: {cache['hits']} попаданий / {cache['misses']} промахов ({cache['hit_rate']:.0%})"
+        if progress:
+            text += f"\n🚀 Запуск сессий: {progress.summary()}"
         
         keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -738,14 +2002,72 @@ class MonitorBot:
     def admin_restart(self, query):
         """Перезапуск всех сессий"""
         self.session_manager.start_all_sessions()
-        query.edit_message_text("✅ Все сессии перезапущены!")
+        progress = self.session_manager.startup_progress
+        
+        text = "🔄 Перезапуск сессий начат!"
+        if progress:
+            text += f"\n\n{progress.summary()}\nПрогресс смотрите в статистике."
+        
+        keyboard = [[InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")]]
+        query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
     
     def error_handler(self, update: Update, context: CallbackContext):
         """Обработчик ошибок"""
         logger.error(f"❌ Ошибка: {context.error}", exc_info=context.error)
 
+def start_metrics(offset=0):
+    """Эндпоинт /metrics, если задан METRICS_PORT"""
+    if not METRICS_PORT:
+        return None
+    server = MetricsServer(REGISTRY, host=METRICS_HOST, port=METRICS_PORT + offset)
+    try:
+        server.start()
+    except OSError as e:
+        logger.error(f"❌ Не удалось запустить метрики на порту {METRICS_PORT + offset}: {e}")
+        return None
+    return server
+
+def with_leases(manager, database):
+    """Обертка менеджера сессий арендами в общей базе"""
+    from leases import LeasedSessionManager
+    
+    logger.info(f"🔑 Узел {NODE_ID}: сессии распределяются через аренды (TTL {LEASE_TTL:g} c)")
+    return LeasedSessionManager(
+        manager,
+        database,
+        NODE_ID,
+        ttl=LEASE_TTL,
+        renew_interval=LEASE_RENEW_INTERVAL,
+        capacity=NODE_MAX_SESSIONS
+    )
+
+def run_session_node():
+    """Узел без бота: держит свою долю сессий и отправляет уведомления"""
+    from telegram import Bot
+    
+    start_metrics()
+    with PROFILE.phase('база данных'):
+        db = Database()
+    manager = with_leases(SessionManager(API_ID, API_HASH, db, Bot(BOT_TOKEN)), db)
+    with PROFILE.phase('запуск аренд'):
+        manager.start_all_sessions()
+    PROFILE.report()
+    
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *args: stop.set())
+    stop.wait()
+    
+    manager.shutdown()
+
 def main():
     """Основная функция"""
+    setup_logging()
+    PROFILE.record('импорт main', time.perf_counter() - STARTED_AT)
+    logger.info(f"Конфигурация загружена успешно. Админы: {ADMINS}")
+    if not RUN_BOT:
+        run_session_node()
+        return
     bot = MonitorBot()
     bot.start()
 
@@ -0,0 +1,564 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+KIND_KEYWORD = 'keyword'
+KIND_EXCEPTION = 'exception'
+
+# Режимы шаблона (хранятся в filters.flags). Синтаксис при вводе:
+# слово - подстрока, "слово" - целое слово, слово* - начало слова,
+# ~слово - все формы слова (основа + начало слова), /выражение/ - регулярное выражение
+MODE_SUBSTRING = 0
+MODE_WORD = 1
+MODE_PREFIX = 2
+MODE_STEM = 3
+MODE_REGEX = 4
+
+# Ограничения регулярных выражений
+REGEX_MAX_LENGTH = 200
+REGEX_MAX_PATTERNS = 50
+REGEX_COMPILE_BUDGET = 0.05
+REGEX_MAX_TEXT = 4096
+
+# До стольких разных шаблонов автомат ищет их через str.find: поиск идет в C и на коротких
+# списках обгоняет обход автомата по символам в Python
+AUTOMATON_FIND_MAX = 200
+
+# Вложенные квантификаторы вида (a+)+ дают экспоненциальный перебор
+_NESTED_QUANTIFIER = re.compile(r'\((?:[^()\\]|\\.)*[+*}](?:[^()\\]|\\.)*\)(?:[+*]|\{\d*,)')
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+# (?P<имя> вне экранирования: перед скобкой четное число обратных слэшей
+_NAMED_GROUP = re.compile(r'(?<!\\)((?:\\\\)*)\(\?P<\w+>')
+
+# Окончания для выделения основы русских слов, от длинных к коротким
+_RU_ENDINGS = tuple(sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'иях', 'ией',
+    'ях', 'ах', 'ов', 'ев', 'ей', 'ой', 'ом', 'ем', 'ам', 'ям', 'ую', 'юю', 'ая', 'яя',
+    'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ью', 'ия', 'а', 'я', 'ы', 'и', 'е', 'у', 'ю', 'о', 'ь', 'й',
+), key=len, reverse=True))
+MIN_STEM_LENGTH = 3
+
+
+def parse_pattern(raw):
+    """Строка из ввода пользователя -> (режим, шаблон)"""
+    raw = raw.strip()
+    if len(raw) > 2 and raw.startswith('/') and raw.endswith('/'):
+        return MODE_REGEX, raw[1:-1]
+    raw = raw.lower()
+    if len(raw) > 2 and raw[0] == raw[-1] == '"':
+        return MODE_WORD, raw[1:-1].strip()
+    if len(raw) > 1 and raw.startswith('~'):
+        return MODE_STEM, raw[1:].strip()
+    if len(raw) > 1 and raw.endswith('*'):
+        return MODE_PREFIX, raw[:-1].strip()
+    return MODE_SUBSTRING, raw
+
+
+def format_pattern(mode, pattern):
+    """(режим, шаблон) -> строка в синтаксисе ввода"""
+    if mode == MODE_REGEX:
+        return f'/{pattern}/'
+    if mode == MODE_WORD:
+        return f'"{pattern}"'
+    if mode == MODE_STEM:
+        return f'~{pattern}'
+    if mode == MODE_PREFIX:
+        return f'{pattern}*'
+    return pattern
+
+
+def split_patterns(text):
+    """Разбор списка через запятую; запятые внутри /регулярного выражения/ не разделяют"""
+    result = []
+    current = []
+    in_regex = False
+    for ch in text:
+        if ch == '/' and (in_regex or not ''.join(current).strip()):
+            in_regex = not in_regex
+        if ch == ',' and not in_regex:
+            result.append(''.join(current))
+            current = []
+            continue
+        current.append(ch)
+    result.append(''.join(current))
+    return [item.strip() for item in result if item.strip()]
+
+
+def stem(word):
+    """Основа русского слова отбрасыванием окончания (Москва, Москве, Москвы -> москв)"""
+    if not any('а' <= ch <= 'я' or ch == 'ё' for ch in word):
+        return word
+    for ending in _RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def literal_for(mode, pattern):
+    """Строка, которую ищет автомат для не-regex режима"""
+    return stem(pattern) if mode == MODE_STEM else pattern
+
+
+def normalize_patterns(patterns):
+    """Нижний регистр (кроме regex), без пустых строк и дублей (порядок сохраняется)"""
+    result = []
+    seen = set()
+    for pattern in patterns or []:
+        mode, body = parse_pattern(pattern)
+        if not body:
+            continue
+        pattern = format_pattern(mode, body)
+        if pattern not in seen:
+            seen.add(pattern)
+            result.append(pattern)
+    return result
+
+
+def compile_regex(pattern):
+    """Проверка и компиляция пользовательского выражения; ValueError с понятным текстом"""
+    if len(pattern) > REGEX_MAX_LENGTH:
+        raise ValueError(f"выражение длиннее {REGEX_MAX_LENGTH} символов: /{pattern[:20]}…/")
+    if _NESTED_QUANTIFIER.search(pattern):
+        raise ValueError(f"вложенные повторы вида (a+)+ запрещены: /{pattern}/")
+    if _BACKREFERENCE.search(pattern):
+        raise ValueError(f"обратные ссылки запрещены: /{pattern}/")
+    started = time.perf_counter()
+    try:
+        compiled = re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"ошибка в выражении /{pattern}/: {e}") from None
+    if time.perf_counter() - started > REGEX_COMPILE_BUDGET:
+        raise ValueError(f"выражение слишком сложное: /{pattern}/")
+    return compiled
+
+
+def validate_patterns(patterns):
+    """Проверка ввода пользователя до сохранения (ValueError при ошибке)"""
+    regexes = [body for mode, body in map(parse_pattern, patterns) if mode == MODE_REGEX]
+    if len(regexes) > REGEX_MAX_PATTERNS:
+        raise ValueError(f"не больше {REGEX_MAX_PATTERNS} регулярных выражений")
+    for pattern in regexes:
+        compile_regex(pattern)
+    if regexes:
+        try:
+            _regex_union(regexes)
+        except re.error as e:
+            raise ValueError(f"выражения нельзя объединить (например, флаги (?i) не в начале): {e}") from None
+
+
+def _unnamed_groups(pattern):
+    """Именованные группы -> обычные: в объединении имена из разных шаблонов могут совпасть"""
+    return _NAMED_GROUP.sub(r'\1(', pattern)
+
+
+def _regex_union(patterns):
+    """Объединение шаблонов; группа _rN указывает на N-й шаблон (re.error если не собирается)"""
+    return re.compile(
+        '|'.join(f'(?P<_r{n}>{_unnamed_groups(pattern)})' for n, pattern in enumerate(patterns)),
+        re.IGNORECASE
+    )
+
+
+def compile_regex_set(patterns):
+    """Одно выражение-объединение и список вошедших в него шаблонов
+
+    Шаблоны, которые не компилируются сами или ломают объединение, пропускаются с предупреждением.
+    """
+    kept = []
+    for pattern in patterns[:REGEX_MAX_PATTERNS]:
+        try:
+            compile_regex(pattern)
+        except ValueError as e:
+            logger.warning(f"⚠️ Шаблон пропущен: {e}")
+            continue
+        kept.append(pattern)
+    if not kept:
+        return None, ()
+    try:
+        return _regex_union(kept), tuple(kept)
+    except re.error:
+        pass
+
+    # Объединение не собралось: добавляем шаблоны по одному и отбрасываем мешающие
+    usable = []
+    for pattern in kept:
+        try:
+            _regex_union(usable + [pattern])
+        except re.error as e:
+            logger.warning(f"⚠️ Шаблон /{pattern}/ пропущен: не сочетается с остальными ({e})")
+            continue
+        usable.append(pattern)
+    if not usable:
+        return None, ()
+    return _regex_union(usable), tuple(usable)
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+
+def boundary_ok(text, end, length, mode):
+    """Проверка границ слова для совпадения, закончившегося на позиции end"""
+    if mode == MODE_SUBSTRING:
+        return True
+    start = end - length + 1
+    if start > 0 and _is_word_char(text[start - 1]):
+        return False
+    if mode == MODE_WORD and end + 1 < len(text) and _is_word_char(text[end + 1]):
+        return False
+    return True
+
+
+class Automaton:
+    """Автомат Ахо-Корасик: поиск всех шаблонов за один проход по тексту
+
+    Каждый шаблон помечается произвольным тегом, при совпадении возвращаются теги.
+    Короткие списки (до AUTOMATON_FIND_MAX шаблонов) ищутся через str.find по каждому шаблону.
+    """
+
+    __slots__ = ('goto', 'fail', 'out', 'size', 'literals')
+
+    def __init__(self, tagged_patterns):
+        tagged_patterns = list(tagged_patterns)
+        literals = {}
+        for pattern, tag in tagged_patterns:
+            literals.setdefault(pattern, []).append(tag)
+        self.literals = None
+        if len(literals) <= AUTOMATON_FIND_MAX:
+            self.literals = tuple(
+                (pattern, len(pattern) - 1, tuple(tags)) for pattern, tags in literals.items() if pattern
+            )
+
+        goto = [{}]
+        out = [[]]
+        for pattern, tag in tagged_patterns:
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(tag)
+
+        # Суффиксные ссылки обходом в ширину
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt].extend(out[fail[nxt]])
+
+        self.goto = goto
+        self.fail = fail
+        self.out = [tuple(tags) for tags in out]
+        self.size = len(goto)
+
+    def iter_hits(self, text):
+        """(позиция, теги) для каждой позиции текста, где закончился хотя бы один шаблон
+
+        Порядок позиций и число пар на позицию не гарантируются: на коротком списке шаблоны
+        проверяются по очереди в порядке добавления, и каждый дает свои пары.
+        """
+        if self.literals is not None:
+            return self._find_hits(text)
+        return self._walk_hits(text)
+
+    def _find_hits(self, text):
+        find = text.find
+        for pattern, tail, tags in self.literals:
+            if pattern not in text:
+                continue
+            start = find(pattern)
+            while start >= 0:
+                yield start + tail, tags
+                start = find(pattern, start + 1)
+
+    def _walk_hits(self, text):
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        root = goto[0]
+        state = 0
+        for position, ch in enumerate(text):
+            if state == 0:
+                state = root.get(ch, 0)
+            else:
+                nxt = goto[state].get(ch)
+                while nxt is None and state:
+                    state = fail[state]
+                    nxt = goto[state].get(ch)
+                state = nxt or 0
+            if out[state]:
+                yield position, out[state]
+
+
+class MatchResult:
+    __slots__ = ('keywords', 'exceptions')
+
+    def __init__(self, keywords=None, exceptions=None):
+        self.keywords = keywords or set()
+        self.exceptions = exceptions or set()
+
+    @property
+    def matched(self):
+        """Есть ключевое слово и нет исключений"""
+        return bool(self.keywords) and not self.exceptions
+
+
+class KeywordMatcher:
+    """Скомпилированный фильтр пользователя
+
+    Подстроки, целые слова, начала слов и формы слов ищутся одним автоматом (границы слова
+    проверяются только на найденных совпадениях), регулярные выражения - одним объединением.
+    """
+
+    def __init__(self, keywords, exceptions):
+        self.keywords = normalize_patterns(keywords)
+        self.exceptions = normalize_patterns(exceptions)
+
+        literal = []
+        regexes = {KIND_KEYWORD: [], KIND_EXCEPTION: []}
+        # Исключения добавляются первыми: на коротком списке matches() останавливается на первом
+        # ключевом слове без тегов исключений, когда все шаблоны с исключениями уже проверены
+        for kind, patterns in ((KIND_EXCEPTION, self.exceptions), (KIND_KEYWORD, self.keywords)):
+            for raw in patterns:
+                mode, pattern = parse_pattern(raw)
+                if mode == MODE_REGEX:
+                    regexes[kind].append(pattern)
+                else:
+                    text = literal_for(mode, pattern)
+                    literal.append((text, (kind, raw, mode, len(text))))
+        self.automaton = Automaton(literal)
+        self.keyword_regex, self.keyword_regex_patterns = compile_regex_set(regexes[KIND_KEYWORD])
+        self.exception_regex, self.exception_regex_patterns = compile_regex_set(regexes[KIND_EXCEPTION])
+
+    @property
+    def has_regex(self):
+        return self.keyword_regex is not None or self.exception_regex is not None
+
+    def scan(self, text):
+        """Все найденные ключевые слова и исключения за один проход"""
+        result = MatchResult()
+        if not self.keywords:
+            return result
+        text = text.lower()
+        for end, tags in self.automaton.iter_hits(text):
+            for kind, pattern, mode, length in tags:
+                if not boundary_ok(text, end, length, mode):
+                    continue
+                if kind == KIND_KEYWORD:
+                    result.keywords.add(pattern)
+                else:
+                    result.exceptions.add(pattern)
+        for regex, patterns, found in (
+            (self.keyword_regex, self.keyword_regex_patterns, result.keywords),
+            (self.exception_regex, self.exception_regex_patterns, result.exceptions),
+        ):
+            if regex is not None:
+                for match in regex.finditer(text[:REGEX_MAX_TEXT]):
+                    found.add(format_pattern(MODE_REGEX, patterns[int(match.lastgroup[2:])]))
+        return result
+
+    def matches(self, text):
+        """Быстрая проверка: останавливается на первом исключении"""
+        if not self.keywords:
+            return False
+        text = text.lower()
+        keyword_found = False
+        ordered = self.automaton.literals is not None
+        for end, tags in self.automaton.iter_hits(text):
+            exception_tagged = False
+            for kind, _, mode, length in tags:
+                if kind == KIND_EXCEPTION:
+                    exception_tagged = True
+                if mode and not boundary_ok(text, end, length, mode):
+                    continue
+                if kind == KIND_EXCEPTION:
+                    return False
+                keyword_found = True
+            # Шаблон без исключений идет после всех шаблонов с исключениями: проверять больше нечего.
+            # Общий с исключением шаблон (дом и "дом") дочитывается до конца
+            if keyword_found and ordered and not exception_tagged:
+                break
+        if self.exception_regex is not None and self.exception_regex.search(text[:REGEX_MAX_TEXT]):
+            return False
+        if not keyword_found and self.keyword_regex is not None:
+            keyword_found = self.keyword_regex.search(text[:REGEX_MAX_TEXT]) is not None
+        return keyword_found
+
+
+class SharedFilterIndex:
+    """Общий автомат по фильтрам всех пользователей
+
+    Каждый шаблон помечен владельцами, поэтому сообщение из общего чата
+    сканируется один раз, а результат раздается всем сессиям, которые его получили.
+    Пользователи с регулярными выражениями в индекс не входят и проверяются своим фильтром.
+    """
+
+    def __init__(self, filters, cache_size=4096):
+        owners = {}
+        user_ids = set()
+        for user_id, (keywords, exceptions) in filters.items():
+            keywords = normalize_patterns(keywords)
+            exceptions = normalize_patterns(exceptions)
+            parsed = [(0, parse_pattern(p)) for p in keywords] + [(1, parse_pattern(p)) for p in exceptions]
+            if not keywords or any(mode == MODE_REGEX for _, (mode, _) in parsed):
+                continue
+            user_ids.add(user_id)
+            for slot, (mode, pattern) in parsed:
+                key = (literal_for(mode, pattern), mode)
+                owners.setdefault(key, (set(), set()))[slot].add(user_id)
+
+        self.user_ids = frozenset(user_ids)
+        self.automaton = Automaton(
+            (text, (mode, len(text), frozenset(kw_owners), frozenset(ex_owners)))
+            for (text, mode), (kw_owners, ex_owners) in owners.items()
+        )
+        self.cache_size = cache_size
+        self._results = OrderedDict()
+        self.scans = 0
+        self.cache_hits = 0
+
+    @classmethod
+    def from_matchers(cls, matchers, **kwargs):
+        return cls({
+            user_id: (matcher.keywords, matcher.exceptions)
+            for user_id, matcher in matchers.items()
+        }, **kwargs)
+
+    def covers(self, user_id):
+        """Учтен ли пользователь в индексе"""
+        return user_id in self.user_ids
+
+    def scan(self, text):
+        """Пользователи, у которых есть ключевое слово и нет исключений"""
+        self.scans += 1
+        text = text.lower()
+        keyword_users = set()
+        exception_users = set()
+        for end, tags in self.automaton.iter_hits(text):
+            for mode, length, kw_owners, ex_owners in tags:
+                if mode and not boundary_ok(text, end, length, mode):
+                    continue
+                if kw_owners:
+                    keyword_users |= kw_owners
+                if ex_owners:
+                    exception_users |= ex_owners
+        return frozenset(keyword_users - exception_users)
+
+    def match(self, chat_id, message_id, text):
+        """Результат для сообщения (chat_id, message_id) с кешем на повторные получения
+
+        Кешировать можно только сообщения каналов и супергрупп: у личных чатов
+        и обычных групп message_id свой у каждого аккаунта.
+        """
+        if message_id is None:
+            return self.scan(text)
+        key = (chat_id, message_id)
+        cached = self._results.get(key)
+        if cached is not None and cached[0] == text:
+            self.cache_hits += 1
+            self._results.move_to_end(key)
+            return cached[1]
+        users = self.scan(text)
+        self._results[key] = (text, users)
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return users
+
+
+class FilterRegistry:
+    """Изменяемый реестр фильтров, который читают запущенные обработчики
+
+    Новый фильтр компилируется заранее и подменяется одним присваиванием,
+    поэтому сохранение ключевых слов не требует переподключения клиента.
+    Общий индекс пересобирается в фоне; пока он устарел для пользователя,
+    используется его собственный фильтр.
+    """
+
+    def __init__(self, loader=None, index_rebuild_delay=1.0):
+        self.loader = loader
+        self.index_rebuild_delay = index_rebuild_delay
+        self._matchers = {}
+        self._index = None
+        self._stale = set()
+        self._lock = threading.Lock()
+        self._rebuild_timer = None
+
+    def get(self, user_id):
+        """Текущий фильтр пользователя (загружается через loader при первом обращении)"""
+        matcher = self._matchers.get(user_id)
+        if matcher is None:
+            keywords, exceptions = self.loader(user_id) if self.loader else ([], [])
+            matcher = self._swap(user_id, KeywordMatcher(keywords, exceptions))
+        return matcher
+
+    def set(self, user_id, keywords, exceptions):
+        """Атомарная замена фильтра пользователя"""
+        return self._swap(user_id, KeywordMatcher(keywords, exceptions))
+
+    def remove(self, user_id):
+        with self._lock:
+            self._matchers.pop(user_id, None)
+            self._stale.add(user_id)
+        self._schedule_rebuild()
+
+    def load(self, filters):
+        """Массовая загрузка {user_id: (keywords, exceptions)} с синхронной сборкой индекса"""
+        matchers = {
+            user_id: KeywordMatcher(keywords, exceptions)
+            for user_id, (keywords, exceptions) in filters.items()
+        }
+        with self._lock:
+            self._matchers.update(matchers)
+            self._stale.update(matchers)
+        self.rebuild_index()
+
+    def _swap(self, user_id, matcher):
+        with self._lock:
+            self._matchers[user_id] = matcher
+            self._stale.add(user_id)
+        self._schedule_rebuild()
+        return matcher
+
+    def _schedule_rebuild(self):
+        with self._lock:
+            if self._rebuild_timer is not None:
+                return
+            self._rebuild_timer = threading.Timer(self.index_rebuild_delay, self.rebuild_index)
+            self._rebuild_timer.daemon = True
+            self._rebuild_timer.start()
+
+    def rebuild_index(self):
+        """Сборка общего индекса по снимку фильтров и его подмена"""
+        with self._lock:
+            self._rebuild_timer = None
+            snapshot = dict(self._matchers)
+        index = SharedFilterIndex.from_matchers(snapshot)
+        with self._lock:
+            self._index = index
+            # Актуальны только те, чей фильтр не менялся во время сборки
+            self._stale = {
+                user_id for user_id in self._stale
+                if self._matchers.get(user_id) is not snapshot.get(user_id)
+            }
+        return index
+
+    def match(self, user_id, text, chat_id=None, message_id=None):
+        """Подходит ли сообщение пользователю"""
+        index = self._index
+        if index is not None and user_id not in self._stale and index.covers(user_id):
+            return user_id in index.match(chat_id, message_id, text)
+        return self.get(user_id).matches(text)
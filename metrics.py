@@ -0,0 +1,311 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин по умолчанию (секунды): от долей миллисекунды до десятков секунд
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # collect() возвращает значение или {значения меток: значение} на момент чтения
+        self.collect = collect
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames and collect is None:
+            self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in values), None)
+
+    def _default(self):
+        return self.labels()
+
+    def samples(self):
+        """[(суффикс, значения меток, доп. метки, значение)]"""
+        raise NotImplementedError
+
+    def _collected(self, suffix):
+        try:
+            collected = self.collect()
+        except Exception as e:
+            logger.warning(f"⚠️ Метрика {self.name} не собрана: {e}")
+            return []
+        if not isinstance(collected, dict):
+            return [(suffix, (), (), collected)]
+        return [
+            (suffix, key if isinstance(key, tuple) else (key,), (), value)
+            for key, value in collected.items()
+        ]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            labels = _format_labels(self.labelnames, values, extra)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def samples(self):
+        if self.collect is not None:
+            return self._collected('_total')
+        return [('_total', key, (), child.value) for key, child in list(self._children.items())]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def samples(self):
+        if self.collect is not None:
+            return self._collected('')
+        return [('', key, (), child.value) for key, child in list(self._children.items())]
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def samples(self):
+        samples = []
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                samples.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+            samples.append(('_sum', key, (), child.sum))
+            samples.append(('_count', key, (), cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def _register_collected(self, metric):
+        registered = self._register(metric)
+        # Повторная регистрация (новый SessionManager) подменяет источник значений
+        if metric.collect is not None:
+            registered.collect = metric.collect
+        return registered
+
+    def counter(self, name, documentation, labelnames=(), collect=None):
+        return self._register_collected(Counter(name, documentation, labelnames, collect))
+
+    def gauge(self, name, documentation, labelnames=(), collect=None):
+        return self._register_collected(Gauge(name, documentation, labelnames, collect))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+# Конвейер сообщений
+MESSAGES_RECEIVED = REGISTRY.counter('monitor_messages_received', 'Входящие сообщения после предфильтра')
+MESSAGES_MATCHED = REGISTRY.counter('monitor_messages_matched', 'Сообщения с совпадением фильтра')
+CATCH_UP_MESSAGES = REGISTRY.counter(
+    'monitor_catch_up_messages', 'Сообщения, догруженные после переподключения и переданные в обработку'
+)
+MATCH_SECONDS = REGISTRY.histogram('monitor_match_seconds', 'Время сопоставления с фильтрами')
+HANDLE_SECONDS = REGISTRY.histogram('monitor_handle_seconds', 'Полное время обработки совпавшего сообщения')
+
+# Уведомления
+NOTIFY_SEND_SECONDS = REGISTRY.histogram('monitor_notify_send_seconds', 'Длительность запроса sendMessage')
+NOTIFY_LATENCY_SECONDS = REGISTRY.histogram(
+    'monitor_notify_latency_seconds', 'Время от постановки уведомления до доставки'
+)
+NOTIFY_ERRORS = REGISTRY.counter('monitor_notify_errors', 'Ошибки Bot API по типу', ('error',))
+
+# SQLite
+DB_QUERY_SECONDS = REGISTRY.histogram('monitor_db_query_seconds', 'Длительность операций с базой', ('mode',))
+
+# Сессии
+SESSION_RECONNECTS = REGISTRY.counter(
+    'monitor_session_reconnects', 'Попытки переподключения сессий по исходу', ('result',)
+)
+
+# Общий loop сессий
+LOOP_LAG_SECONDS = REGISTRY.gauge('monitor_event_loop_lag_seconds', 'Последняя задержка пробуждения loop')
+LOOP_LAG_HISTOGRAM = REGISTRY.histogram('monitor_event_loop_lag_hist_seconds', 'Задержка пробуждения loop')
+
+
+async def watch_loop_lag(interval=1.0):
+    """Задержка между запланированным и фактическим пробуждением - мера загрузки loop"""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.monotonic() - started - interval)
+        LOOP_LAG_SECONDS.set(lag)
+        LOOP_LAG_HISTOGRAM.observe(lag)
+
+
+class MetricsServer:
+    """HTTP эндпоинт /metrics в текстовом формате Prometheus"""
+
+    def __init__(self, registry=REGISTRY, host='127.0.0.1', port=9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._httpd = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"📈 Метрики: http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
@@ -0,0 +1,258 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+from metrics import NOTIFY_ERRORS, NOTIFY_LATENCY_SECONDS, NOTIFY_SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины сообщения Bot API
+MAX_MESSAGE_LENGTH = 4096
+
+
+class RateLimiter:
+    """Потокобезопасный token bucket"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Ожидание свободного токена"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class Notification:
+    __slots__ = ('chat_id', 'text', 'parse_mode', 'created_at', 'attempts', 'single')
+
+    def __init__(self, chat_id, text, parse_mode=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.created_at = time.monotonic()
+        self.attempts = 0
+        # Не склеивать в сводку (сводка с ним не прошла разбор разметки)
+        self.single = False
+
+
+def is_parse_error(error):
+    """Telegram не разобрал разметку сообщения (BadRequest: Can't parse entities)"""
+    return type(error).__name__ == 'BadRequest' and "can't parse" in str(error).lower()
+
+
+class NotificationDispatcher:
+    """Очередь исходящих уведомлений с учетом лимитов Bot API
+
+    Глобально не больше global_rate сообщений в секунду, в один чат не чаще
+    раза в chat_interval секунд. Если в чат накопилось digest_threshold и больше
+    уведомлений, они склеиваются в одну сводку. Если Telegram не разобрал разметку,
+    сводка повторяется по одному уведомлению, а одиночное уведомление - без разметки.
+    """
+
+    def __init__(self, bot, max_queue=10000, workers=2, global_rate=30, chat_interval=1.0,
+                 digest_threshold=3, max_retries=3):
+        self.bot = bot
+        self.max_queue = max_queue
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.digest_threshold = digest_threshold
+        self.max_retries = max_retries
+        self.limiter = RateLimiter(global_rate)
+
+        self._pending = {}
+        self._next_allowed = {}
+        self._scheduled = set()
+        self._heap = []
+        self._seq = itertools.count()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+
+        # Метрики
+        self.sent = 0
+        self.digests = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.send_time_sum = 0.0
+
+    def start(self):
+        """Запуск рабочих потоков"""
+        if self._running:
+            return
+        self._running = True
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"notifier-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"📬 Очередь уведомлений запущена ({self.workers} потоков)")
+
+    def stop(self, timeout=10):
+        """Остановка с попыткой дослать очередь за timeout секунд"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._size and time.monotonic() < deadline:
+                self._cond.wait(0.1)
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, chat_id, text, parse_mode=None):
+        """Неблокирующая постановка уведомления в очередь (False если очередь переполнена)"""
+        with self._cond:
+            if self._size >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._pending.setdefault(chat_id, deque()).append(Notification(chat_id, text, parse_mode))
+            self._size += 1
+            self._schedule(chat_id)
+            self._cond.notify()
+        return True
+
+    def queue_depth(self):
+        return self._size
+
+    def stats(self):
+        delivered = self.sent or 1
+        return {
+            'queue_depth': self._size,
+            'sent': self.sent,
+            'digests': self.digests,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'retries': self.retries,
+            'latency_avg': self.latency_sum / delivered,
+            'latency_max': self.latency_max,
+            'send_time_avg': self.send_time_sum / delivered,
+        }
+
+    def _schedule(self, chat_id, not_before=0.0):
+        # Чат в куче или в работе у потока не планируется повторно
+        if chat_id in self._scheduled:
+            return
+        ready_at = max(time.monotonic(), self._next_allowed.get(chat_id, 0.0), not_before)
+        heapq.heappush(self._heap, (ready_at, next(self._seq), chat_id))
+        self._scheduled.add(chat_id)
+
+    def _take(self):
+        with self._cond:
+            while self._running:
+                if self._heap:
+                    ready_at, _, chat_id = self._heap[0]
+                    delay = ready_at - time.monotonic()
+                    if delay <= 0:
+                        heapq.heappop(self._heap)
+                        return chat_id, self._take_batch(chat_id)
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            return None, None
+
+    def _take_batch(self, chat_id):
+        pending = self._pending[chat_id]
+        if not self.digest_threshold or len(pending) < self.digest_threshold or pending[0].single:
+            batch = [pending.popleft()]
+        else:
+            batch = [pending.popleft()]
+            length = len(batch[0].text)
+            while pending and not pending[0].single and pending[0].parse_mode == batch[0].parse_mode:
+                length += len(pending[0].text) + 16
+                if length > MAX_MESSAGE_LENGTH - 100:
+                    break
+                batch.append(pending.popleft())
+        self._size -= len(batch)
+        return batch
+
+    def _finish(self, chat_id, requeue=None, not_before=0.0):
+        with self._cond:
+            pending = self._pending[chat_id]
+            if requeue:
+                pending.extendleft(reversed(requeue))
+                self._size += len(requeue)
+            self._scheduled.discard(chat_id)
+            if pending:
+                self._schedule(chat_id, not_before)
+            else:
+                del self._pending[chat_id]
+            self._cond.notify_all()
+
+    def _format(self, batch):
+        if len(batch) == 1:
+            return batch[0].text
+        text = f"📬 **Сводка: {len(batch)} совпадений**\n\n" + "\n\n➖➖➖\n\n".join(n.text for n in batch)
+        return text[:MAX_MESSAGE_LENGTH]
+
+    def _worker(self):
+        while True:
+            chat_id, batch = self._take()
+            if chat_id is None:
+                return
+            requeue = None
+            not_before = 0.0
+            try:
+                self.limiter.acquire()
+                started = time.monotonic()
+                self.bot.send_message(chat_id, self._format(batch), parse_mode=batch[0].parse_mode)
+                finished = time.monotonic()
+                self.send_time_sum += finished - started
+                NOTIFY_SEND_SECONDS.observe(finished - started)
+                self.sent += 1
+                if len(batch) > 1:
+                    self.digests += 1
+                for notification in batch:
+                    latency = finished - notification.created_at
+                    self.latency_sum += latency
+                    self.latency_max = max(self.latency_max, latency)
+                    NOTIFY_LATENCY_SECONDS.observe(latency)
+            except Exception as e:
+                NOTIFY_ERRORS.labels(type(e).__name__).inc()
+                retry_after = getattr(e, 'retry_after', None)
+                for notification in batch:
+                    notification.attempts += 1
+                if retry_after is not None:
+                    # Flood limit: повторяем после паузы, попытки не считаем
+                    logger.warning(f"⏸️ RetryAfter {retry_after} c для чата {chat_id}")
+                    requeue = batch
+                    not_before = time.monotonic() + float(retry_after)
+                    self.retries += 1
+                elif is_parse_error(e) and batch[0].parse_mode:
+                    if len(batch) > 1:
+                        # Одно уведомление с битой разметкой не должно терять всю сводку
+                        logger.warning(f"⚠️ Сводка для чата {chat_id} не разобрана, отправляем по одному")
+                        for notification in batch:
+                            notification.single = True
+                    else:
+                        logger.warning(f"⚠️ Разметка уведомления для чата {chat_id} не разобрана, отправляем без нее")
+                        batch[0].parse_mode = None
+                    requeue = batch
+                    self.retries += 1
+                elif type(e).__name__ in ('NetworkError', 'TimedOut') and batch[0].attempts < self.max_retries:
+                    requeue = batch
+                    not_before = time.monotonic() + 2 ** batch[0].attempts
+                    self.retries += 1
+                else:
+                    self.failed += len(batch)
+                    logger.error(f"❌ Ошибка отправки сообщения: {e}")
+            finally:
+                self._next_allowed[chat_id] = time.monotonic() + self.chat_interval
+                self._finish(chat_id, requeue, not_before)
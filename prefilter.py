@@ -0,0 +1,62 @@
+KIND_INCLUDE_CHAT = 'include_chat'
+KIND_EXCLUDE_CHAT = 'exclude_chat'
+KIND_MUTE_CHAT = 'mute_chat'
+
+CHAT_RULE_KINDS = (KIND_INCLUDE_CHAT, KIND_EXCLUDE_CHAT, KIND_MUTE_CHAT)
+
+
+class PreFilter:
+    """Дешевые условия, которые проверяются до сопоставления с ключевыми словами
+
+    Списки чатов и направление сообщений передаются в events.NewMessage(chats=..., incoming=...),
+    поэтому лишние обновления отсекаются самим Telethon. Остальное проверяется в func=.
+    """
+
+    def __init__(self, include_chats=(), exclude_chats=(), muted_chats=(),
+                 incoming_only=True, min_text_length=1):
+        self.include_chats = frozenset(include_chats)
+        self.exclude_chats = frozenset(exclude_chats)
+        self.muted_chats = frozenset(muted_chats)
+        self.incoming_only = incoming_only
+        self.min_text_length = min_text_length
+
+    @classmethod
+    def from_rules(cls, rules, **kwargs):
+        """Сборка из правил {kind: set(chat_id)} таблицы filters"""
+        return cls(
+            include_chats=rules.get(KIND_INCLUDE_CHAT, ()),
+            exclude_chats=rules.get(KIND_EXCLUDE_CHAT, ()),
+            muted_chats=rules.get(KIND_MUTE_CHAT, ()),
+            **kwargs
+        )
+
+    def event_kwargs(self):
+        """Аргументы для events.NewMessage"""
+        kwargs = {}
+        if self.include_chats:
+            kwargs['chats'] = list(self.include_chats)
+        elif self.exclude_chats:
+            kwargs['chats'] = list(self.exclude_chats)
+            kwargs['blacklist_chats'] = True
+        if self.incoming_only:
+            kwargs['incoming'] = True
+        return kwargs
+
+    def _registration_key(self):
+        exclude = None if self.include_chats else self.exclude_chats
+        return self.include_chats, exclude, self.incoming_only
+
+    def same_registration(self, other):
+        """Можно ли заменить фильтр без перерегистрации обработчика"""
+        return other is not None and self._registration_key() == other._registration_key()
+
+    def __call__(self, event):
+        message = event.message
+        text = message.message
+        if not text or len(text) < self.min_text_length:
+            return False
+        if self.muted_chats or (self.include_chats and self.exclude_chats):
+            chat_id = event.chat_id
+            if chat_id in self.muted_chats or chat_id in self.exclude_chats:
+                return False
+        return True
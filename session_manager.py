@@ -5,24 +5,37 @@ from telethon.sessions import StringSession
 from telethon import events
 import json
 
+from session_startup import StartupProgress, start_sessions_bulk
+from matcher import FilterRegistry
+
 logger = logging.getLogger(__name__)
 
 class SessionManager:
-    def __init__(self, api_id, api_hash, database, bot):
+    def __init__(self, api_id, api_hash, database, bot, start_concurrency=10, start_dc_interval=0.5):
         self.api_id = api_id
         self.api_hash = api_hash
         self.db = database
         self.bot = bot
         self.active_clients = {}
+        self.start_concurrency = start_concurrency
+        self.start_dc_interval = start_dc_interval
+        self.startup_progress = None
+        self.filters = FilterRegistry(loader=self.db.get_user_settings)
         
     async def start_all_sessions(self):
-        """Запуск всех сессий"""
+        """Параллельный запуск всех сессий"""
         try:
             users = self.db.get_all_active_users()
             logger.info(f"Найдено {len(users)} пользователей для запуска")
             
-            for user_id, session_string, keywords_json, exceptions_json in users:
-                await self.start_session(user_id, session_string)
+            self.startup_progress = StartupProgress(len(users))
+            return await start_sessions_bulk(
+                [(user_id, session_string) for user_id, session_string, _, _ in users],
+                self.start_session,
+                concurrency=self.start_concurrency,
+                dc_interval=self.start_dc_interval,
+                progress=self.startup_progress
+            )
                 
         except Exception as e:
             logger.error(f"Ошибка запуска сессий: {e}")
@@ -47,18 +60,22 @@ class SessionManager:
             # Запускаем клиента
             await client.start()
             
-            # Получаем настройки пользователя
-            keywords, exceptions = self.db.get_user_settings(user_id)
+            # Компилируем фильтр заранее, обработчик берет актуальный из реестра
+            self.filters.get(user_id)
             
             # Настраиваем обработчик сообщений
             @client.on(events.NewMessage)
             async def handler(event):
-                await self.handle_message(user_id, event, keywords, exceptions)
+                await self.handle_message(user_id, event)
             
             self.active_clients[user_id] = client
             logger.info(f"Сессия для пользователя {user_id} запущена")
+            return True
             
         except Exception as e:
+            # FloodWait отдаем наверх, чтобы массовый запуск притормозил этот DC
+            if type(e).__name__ == 'FloodWaitError':
+                raise
             logger.error(f"Ошибка запуска сессии для {user_id}: {e}")
             try:
                 await self.bot.send_message(
@@ -67,26 +84,22 @@ class SessionManager:
                 )
             except:
                 pass
+            return False
+    
+    def update_filters(self, user_id, keywords, exceptions):
+        """Горячая замена фильтра пользователя без перезапуска сессии"""
+        self.filters.set(user_id, keywords, exceptions)
     
-    async def handle_message(self, user_id, event, keywords, exceptions):
+    async def handle_message(self, user_id, event):
         """Обработка сообщений"""
         try:
             message = event.message
             if not message.text:
                 return
             
-            text_lower = message.text.lower()
-            keywords_lower = [k.lower() for k in keywords]
-            exceptions_lower = [e.lower() for e in exceptions]
-            
-            # Проверка ключевых слов
-            keyword_found = any(keyword in text_lower for keyword in keywords_lower)
-            if not keyword_found:
-                return
-            
-            # Проверка исключений
-            exception_found = any(exception in text_lower for exception in exceptions_lower)
-            if exception_found:
+            # Ключевые слова и исключения проверяются за один проход
+            message_id = message.id if event.is_channel else None
+            if not self.filters.match(user_id, message.text, event.chat_id, message_id):
                 return
             
             # Формируем информацию о сообщении
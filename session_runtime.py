@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SessionRuntime:
+    """Один долгоживущий asyncio loop в отдельном потоке для всех Telethon клиентов"""
+
+    def __init__(self, name="telethon-runtime"):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        """Запуск loop в фоновом потоке"""
+        if self.is_running():
+            return
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        logger.info(f"🧵 Общий loop сессий запущен ({self.name})")
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+            logger.info(f"🛑 Общий loop сессий остановлен ({self.name})")
+
+    def is_running(self):
+        """Работает ли loop"""
+        return self._thread is not None and self._thread.is_alive() and self.loop is not None and self.loop.is_running()
+
+    def in_runtime_thread(self):
+        """Выполняется ли код внутри потока loop"""
+        return threading.current_thread() is self._thread
+
+    def submit(self, coro):
+        """Потокобезопасная отправка корутины в loop, возвращает concurrent.futures.Future"""
+        if not self.is_running():
+            coro.close()
+            raise RuntimeError("Loop сессий не запущен")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, coro, timeout=None):
+        """Выполнение корутины с ожиданием результата (нельзя вызывать из потока loop)"""
+        if self.in_runtime_thread():
+            coro.close()
+            raise RuntimeError("Блокирующий вызов из потока loop приведет к взаимоблокировке")
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, callback, *args):
+        """Потокобезопасный вызов обычной функции внутри loop"""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self, timeout=10):
+        """Остановка loop и ожидание завершения потока"""
+        if not self.is_running():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if not self.in_runtime_thread():
+            self._thread.join(timeout)
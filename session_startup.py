@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProgress:
+    """Прогресс массового запуска сессий: живые, упавшие и ожидающие"""
+
+    def __init__(self, total):
+        self.total = total
+        self.live = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self.total - self.live - self.failed
+
+    @property
+    def ready(self):
+        return self.pending == 0
+
+    def mark(self, ok):
+        """Учет результата запуска одной сессии"""
+        with self._lock:
+            if ok:
+                self.live += 1
+            else:
+                self.failed += 1
+            if self.pending == 0:
+                self.finished_at = time.monotonic()
+
+    def elapsed(self):
+        end = self.finished_at or time.monotonic()
+        return end - self.started_at
+
+    def as_dict(self):
+        return {
+            'total': self.total,
+            'live': self.live,
+            'failed': self.failed,
+            'pending': self.pending,
+            'elapsed': round(self.elapsed(), 2),
+        }
+
+    def summary(self):
+        return (
+            f"🟢 {self.live} | 🔴 {self.failed} | ⏳ {self.pending} "
+            f"из {self.total} ({self.elapsed():.1f} c)"
+        )
+
+
+class DcPacer:
+    """Минимальный интервал между подключениями к одному DC, чтобы не ловить FloodWait"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._locks = {}
+        self._next_at = {}
+
+    async def wait(self, dc_id):
+        lock = self._locks.setdefault(dc_id, asyncio.Lock())
+        async with lock:
+            delay = self._next_at.get(dc_id, 0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_at[dc_id] = time.monotonic() + self.interval
+
+    def pause(self, dc_id, seconds):
+        """Пауза для DC после FloodWait"""
+        self._next_at[dc_id] = max(self._next_at.get(dc_id, 0), time.monotonic() + seconds)
+
+
+def session_dc(session_string):
+    """DC сессии без сетевых запросов (0 если строку не удалось разобрать)"""
+    try:
+        from telethon.sessions import StringSession
+        return StringSession(session_string).dc_id or 0
+    except Exception:
+        return 0
+
+
+def _flood_wait_seconds(error):
+    if type(error).__name__.startswith('FloodWait'):
+        return getattr(error, 'seconds', None)
+    return None
+
+
+async def start_sessions_bulk(users, start_one, concurrency=10, dc_interval=1.0,
+                              progress=None, max_flood_wait=300):
+    """Параллельный запуск сессий с ограничением конкурентности и темпом по DC
+
+    users - список (user_id, session_string), start_one - корутина, возвращающая True/False.
+    """
+    users = list(users)
+    progress = progress or StartupProgress(len(users))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    pacer = DcPacer(dc_interval)
+
+    async def run(user_id, session_string):
+        dc_id = session_dc(session_string)
+        async with semaphore:
+            ok = False
+            for attempt in range(2):
+                await pacer.wait(dc_id)
+                try:
+                    ok = await start_one(user_id, session_string)
+                    break
+                except Exception as e:
+                    seconds = _flood_wait_seconds(e)
+                    if seconds is None or seconds > max_flood_wait or attempt:
+                        logger.error(f"❌ Ошибка запуска сессии для {user_id}: {e}")
+                        break
+                    logger.warning(f"⏸️ FloodWait {seconds} c для DC{dc_id}, повтор для {user_id}")
+                    pacer.pause(dc_id, seconds)
+            progress.mark(bool(ok))
+
+    logger.info(f"🚀 Массовый запуск {len(users)} сессий (параллельно: {concurrency})")
+    await asyncio.gather(*(run(user_id, session_string) for user_id, session_string in users))
+    logger.info(f"🏁 Запуск сессий завершен: {progress.summary()}")
+    return progress
@@ -0,0 +1,449 @@
+import concurrent.futures
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from session_startup import StartupProgress
+
+logger = logging.getLogger(__name__)
+
+# Как часто шард отправляет статистику супервизору (секунды)
+STATS_INTERVAL = 5
+
+# Команды супервизора и соответствующие методы SessionManager в шарде
+COMMANDS = {
+    'start': 'start_session',
+    'start_many': 'start_sessions',
+    'restart': 'restart_session',
+    'filters': 'update_filters',
+    'prefilter': 'update_prefilter',
+    'forget': 'forget_user',
+}
+
+# Команды с ответом: первым аргументом идет request_id (None - ответ не нужен),
+# результат future из SessionManager возвращается супервизору событием 'done'
+REQUESTS = {
+    'add': 'add_session',
+    'stop': 'stop_session',
+}
+
+EMPTY_STATS = {
+    'active_sessions': 0,
+    'notifier': {
+        'queue_depth': 0, 'sent': 0, 'digests': 0, 'dropped': 0, 'failed': 0, 'retries': 0,
+        'latency_avg': 0.0, 'latency_max': 0.0, 'send_time_avg': 0.0,
+    },
+    'dedup_suppressed': 0,
+    'inbound': {'depth': 0, 'received': 0, 'dropped': 0, 'degraded': 0, 'lag_last': 0.0, 'lag_max': 0.0},
+    'inbound_users': {},
+    'reconnecting': {},
+}
+
+# Разделы статистики с user_id в ключах
+PER_USER_STATS = frozenset(('inbound_users', 'reconnecting'))
+
+
+def _weight(shard_id, user_id):
+    digest = hashlib.blake2b(f"{shard_id}:{user_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def shard_for(user_id, shard_ids):
+    """Владелец сессии (rendezvous hashing): при падении шарда переезжают только его сессии
+
+    None, если живых шардов нет.
+    """
+    return max(shard_ids, key=lambda shard_id: _weight(shard_id, user_id), default=None)
+
+
+def merge_stats(stats_list):
+    """Сложение статистики шардов (задержки и доли берутся по максимуму)
+
+    Словари по пользователям (ключи - user_id) объединяются: сессия живет только в одном шарде.
+    """
+    merged = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            if key in PER_USER_STATS:
+                merged[key] = {**merged.get(key, {}), **value}
+            elif isinstance(value, dict):
+                merged[key] = merge_stats([merged.get(key, {}), value])
+            elif key.startswith(('latency', 'send_time', 'hit_rate', 'lag')):
+                merged[key] = max(merged.get(key, 0), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _outcome(future):
+    """(успех, результат или текст ошибки) - исключения Telethon не всегда сериализуются"""
+    error = future.exception()
+    if error is not None:
+        return False, str(error)
+    return True, future.result()
+
+
+def run_shard(shard_id, shards, commands, events):
+    """Точка входа процесса-шарда: свой SessionManager со своим loop и частью сессий"""
+    import main
+    from notifier import NotificationDispatcher
+    from telegram import Bot
+
+    # Импорт main ничего не настраивает: логи и метрики шард включает сам
+    main.setup_logging()
+    main.start_metrics(offset=1 + shard_id)
+    db = main.Database()
+    bot = Bot(main.BOT_TOKEN)
+    # Глобальный лимит Bot API делится между шардами
+    notifier = NotificationDispatcher(
+        bot,
+        max_queue=main.NOTIFY_QUEUE_SIZE,
+        workers=main.NOTIFY_WORKERS,
+        global_rate=main.NOTIFY_GLOBAL_RATE / shards,
+        chat_interval=main.NOTIFY_CHAT_INTERVAL,
+        digest_threshold=main.NOTIFY_DIGEST_THRESHOLD
+    )
+    manager = main.SessionManager(main.API_ID, main.API_HASH, db, bot, notifier=notifier)
+    manager.on_state = lambda user_id, running: events.put(('state', shard_id, user_id, running))
+
+    events.put(('ready', shard_id))
+    logger.info(f"🧩 Шард {shard_id} запущен")
+    last_stats = 0.0
+    while True:
+        try:
+            command = commands.get(timeout=STATS_INTERVAL)
+        except queue.Empty:
+            command = None
+
+        if time.monotonic() - last_stats >= STATS_INTERVAL:
+            events.put(('stats', shard_id, manager.stats()))
+            last_stats = time.monotonic()
+
+        if command is None:
+            continue
+        action, args = command[0], command[1:]
+        if action == 'shutdown':
+            break
+        try:
+            if action in REQUESTS:
+                request_id, args = args[0], args[1:]
+                future = getattr(manager, REQUESTS[action])(*args)
+                if request_id is not None:
+                    future.add_done_callback(
+                        lambda future, request_id=request_id: events.put(
+                            ('done', shard_id, request_id, *_outcome(future))
+                        )
+                    )
+                continue
+            getattr(manager, COMMANDS[action])(*args)
+        except Exception as e:
+            logger.error(f"❌ Шард {shard_id}: ошибка команды {action}: {e}")
+
+    manager.shutdown()
+    logger.info(f"🛑 Шард {shard_id} остановлен")
+
+
+class ShardedSessionManager:
+    """Супервизор: распределяет сессии по процессам-шардам и управляет ими через очереди
+
+    Интерфейс совпадает с SessionManager, поэтому MonitorBot не знает, в каком режиме работает.
+    """
+
+    def __init__(self, database, shards, respawn_delay=5.0):
+        self.db = database
+        self.shards = shards
+        self.respawn_delay = respawn_delay
+        self.startup_progress = None
+
+        # user_id -> шард, где сессия должна работать / реально работает
+        self.assignments = {}
+        self.active_clients = {}
+
+        self._ctx = multiprocessing.get_context('spawn')
+        self._events = self._ctx.Queue()
+        self._workers = {}
+        self._live = set()
+        self._respawn_at = {}
+        self._moving = {}
+        self._starting = set()
+        self._shard_stats = {}
+        # request_id -> (шард, команда, future) для команд с ответом (проверка и остановка сессий)
+        self._requests = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.RLock()
+        self._running = True
+
+        for shard_id in range(shards):
+            self._spawn(shard_id)
+
+        threading.Thread(target=self._listen, name="shard-events", daemon=True).start()
+        threading.Thread(target=self._monitor, name="shard-monitor", daemon=True).start()
+
+    def _spawn(self, shard_id):
+        commands = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=run_shard,
+            args=(shard_id, self.shards, commands, self._events),
+            name=f"shard-{shard_id}",
+            daemon=True
+        )
+        process.start()
+        self._workers[shard_id] = (process, commands)
+        self._live.add(shard_id)
+        self._respawn_at.pop(shard_id, None)
+        logger.info(f"🧩 Запущен процесс шарда {shard_id} (pid {process.pid})")
+
+    def _send(self, shard_id, *command):
+        self._workers[shard_id][1].put(command)
+
+    def owner(self, user_id):
+        return shard_for(user_id, sorted(self._live))
+
+    def _place(self, user_id, session_string):
+        """Назначение сессии владельцу; переезд только после подтвержденной остановки
+
+        Без живых шардов возвращает False: сессия остается без назначения до _rebalance.
+        """
+        target = self.owner(user_id)
+        if target is None:
+            self.assignments.pop(user_id, None)
+            logger.warning(f"⏳ Сессия {user_id} ждет перезапуска шардов")
+            return False
+        current = self.assignments.get(user_id)
+        if current is not None and current != target and current in self._live:
+            # Одну сессию нельзя держать в двух процессах: сначала останавливаем старую
+            self._moving[user_id] = (target, session_string)
+            self._send(current, 'stop', None, user_id)
+            return True
+        self.assignments[user_id] = target
+        self._send(target, 'start', user_id, session_string)
+        return True
+
+    def start_all_sessions(self):
+        """Запуск всех сессий, каждый шард поднимает свою часть параллельно"""
+        try:
+            users = self.db.get_all_active_users()
+            logger.info(f"🔄 Найдено {len(users)} пользователей для запуска на {len(self._live)} шардах")
+            self.start_sessions(users)
+        except Exception as e:
+            logger.error(f"❌ Ошибка запуска сессий: {e}")
+
+    def start_sessions(self, users):
+        """Раздача списка сессий [(user_id, session_string)] по шардам"""
+        with self._lock:
+            self.startup_progress = StartupProgress(len(users))
+            self._starting = {user_id for user_id, _ in users}
+            batches = {}
+            for user_id, session_string in users:
+                shard_id = self.owner(user_id)
+                if shard_id is None:
+                    # Живых шардов нет: запуск считается неудачным, сессию поднимет _rebalance
+                    self._starting.discard(user_id)
+                    self.startup_progress.mark(False)
+                    continue
+                self.assignments[user_id] = shard_id
+                batches.setdefault(shard_id, []).append((user_id, session_string))
+            if users and not batches:
+                logger.error("❌ Нет живых шардов, сессии запустятся после их перезапуска")
+            for shard_id, batch in batches.items():
+                self._send(shard_id, 'start_many', batch)
+
+    def start_session(self, user_id, session_string):
+        with self._lock:
+            self._place(user_id, session_string)
+
+    def add_session(self, user_id, username, session_string, promote=True):
+        """Проверка новой сессии в шарде-владельце, там же она и остается работать"""
+        future = concurrent.futures.Future()
+        with self._lock:
+            if not self._live:
+                future.set_exception(RuntimeError("Нет живых шардов"))
+                return future
+            target = self.owner(user_id)
+            if promote:
+                self._moving.pop(user_id, None)
+                current = self.assignments.get(user_id)
+                if current is not None and current != target and current in self._live:
+                    self._send(current, 'stop', None, user_id)
+                self.assignments[user_id] = target
+            return self._request(target, 'add', user_id, username, session_string, promote)
+
+    def stop_session(self, user_id):
+        """Остановка; future завершается, когда шард подтвердил отключение клиента"""
+        with self._lock:
+            self._moving.pop(user_id, None)
+            shard_id = self.assignments.pop(user_id, None)
+            if shard_id is not None and shard_id in self._live:
+                return self._request(shard_id, 'stop', user_id)
+        future = concurrent.futures.Future()
+        future.set_result(None)
+        return future
+
+    def _request(self, shard_id, action, *args):
+        """Команда с ответом (под self._lock): future завершит событие 'done' от шарда"""
+        future = concurrent.futures.Future()
+        request_id = next(self._request_ids)
+        self._requests[request_id] = (shard_id, action, future)
+        self._send(shard_id, action, request_id, *args)
+        return future
+
+    def restart_session(self, user_id):
+        session_string = self.db.get_user_session(user_id)
+        if session_string:
+            self.start_session(user_id, session_string)
+
+    def _to_owner(self, user_id, *command):
+        with self._lock:
+            shard_id = self.assignments.get(user_id)
+            if shard_id is not None and shard_id in self._live:
+                self._send(shard_id, *command)
+
+    def update_filters(self, user_id, keywords, exceptions):
+        self._to_owner(user_id, 'filters', user_id, keywords, exceptions)
+
+    def update_prefilter(self, user_id):
+        self._to_owner(user_id, 'prefilter', user_id)
+
+    def forget_user(self, user_id):
+        self._to_owner(user_id, 'forget', user_id)
+
+    def stats(self):
+        with self._lock:
+            shard_stats = list(self._shard_stats.values())
+        stats = merge_stats([EMPTY_STATS, *shard_stats])
+        stats['active_sessions'] = len(self.active_clients)
+        stats['shards'] = f"{len(self._live)}/{self.shards}"
+        return stats
+
+    def shutdown(self, timeout=30):
+        """Остановка всех шардов"""
+        self._running = False
+        with self._lock:
+            for shard_id in list(self._live):
+                self._send(shard_id, 'shutdown')
+        deadline = time.monotonic() + timeout
+        for process, _ in self._workers.values():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+
+    def _listen(self):
+        while self._running:
+            try:
+                event = self._events.get(timeout=1)
+            except queue.Empty:
+                continue
+            kind, shard_id = event[0], event[1]
+            if kind == 'state':
+                self._on_state(shard_id, event[2], event[3])
+            elif kind == 'stats':
+                with self._lock:
+                    self._shard_stats[shard_id] = event[2]
+            elif kind == 'done':
+                self._on_done(*event[2:])
+            elif kind == 'ready':
+                logger.info(f"🧩 Шард {shard_id} готов")
+
+    def _on_state(self, shard_id, user_id, running):
+        with self._lock:
+            if running:
+                self.active_clients[user_id] = shard_id
+            elif self.active_clients.get(user_id) == shard_id:
+                del self.active_clients[user_id]
+
+            if user_id in self._starting:
+                self._starting.discard(user_id)
+                self.startup_progress.mark(running)
+
+            # Старая копия остановлена - можно запускать у нового владельца
+            if not running and user_id in self._moving:
+                target, session_string = self._moving.pop(user_id)
+                if target not in self._live:
+                    self.assignments.pop(user_id, None)
+                    self._place(user_id, session_string)
+                    return
+                self.assignments[user_id] = target
+                self._send(target, 'start', user_id, session_string)
+
+    def _on_done(self, request_id, ok, payload):
+        with self._lock:
+            _, _, future = self._requests.pop(request_id, (None, None, None))
+        if future is None:
+            return
+        if ok:
+            future.set_result(payload)
+        else:
+            future.set_exception(RuntimeError(payload))
+
+    def _monitor(self):
+        while self._running:
+            time.sleep(1)
+            with self._lock:
+                if not self._running:
+                    return
+                for shard_id, (process, _) in list(self._workers.items()):
+                    if shard_id in self._live and not process.is_alive():
+                        self._on_shard_died(shard_id, process.exitcode)
+                for shard_id, respawn_at in list(self._respawn_at.items()):
+                    if time.monotonic() >= respawn_at:
+                        self._spawn(shard_id)
+                        self._rebalance()
+
+    def _on_shard_died(self, shard_id, exitcode):
+        """Сессии упавшего шарда сразу переезжают на живые шарды"""
+        logger.error(f"💥 Шард {shard_id} завершился (код {exitcode}), перераспределяем сессии")
+        self._live.discard(shard_id)
+        self._shard_stats.pop(shard_id, None)
+        self._respawn_at[shard_id] = time.monotonic() + self.respawn_delay
+
+        for request_id, (owner, action, future) in list(self._requests.items()):
+            if owner == shard_id:
+                del self._requests[request_id]
+                if action == 'stop':
+                    # Клиенты завершились вместе с процессом шарда
+                    future.set_result(None)
+                else:
+                    future.set_exception(RuntimeError("Шард перезапускается, попробуйте еще раз"))
+
+        orphans = [user_id for user_id, owner in self.assignments.items() if owner == shard_id]
+        orphans += [user_id for user_id, (target, _) in self._moving.items() if target == shard_id]
+        for user_id in orphans:
+            self.active_clients.pop(user_id, None)
+            self.assignments.pop(user_id, None)
+            self._moving.pop(user_id, None)
+        if not self._live:
+            logger.error("❌ Нет живых шардов, ждем перезапуска")
+        placed = set()
+        for user_id in orphans:
+            session_string = self.db.get_user_session(user_id) if self._live else None
+            if session_string and self._place(user_id, session_string):
+                placed.add(user_id)
+
+        # Запуск остальных уже не подтвердится: считаем его неудачным, сессии поднимет _rebalance
+        for user_id in set(orphans) - placed:
+            if user_id in self._starting:
+                self._starting.discard(user_id)
+                self.startup_progress.mark(False)
+
+    def _rebalance(self):
+        """Возврат сессий вернувшемуся шарду"""
+        moved = 0
+        for user_id, current in list(self.assignments.items()):
+            if user_id in self._moving or self.owner(user_id) == current:
+                continue
+            session_string = self.db.get_user_session(user_id)
+            if session_string:
+                self._place(user_id, session_string)
+                moved += 1
+        # Сессии, оставшиеся без шарда, пока все шарды лежали
+        for user_id, session_string in self.db.get_all_active_users():
+            if user_id not in self.assignments and user_id not in self._moving:
+                self._place(user_id, session_string)
+                moved += 1
+        if moved:
+            logger.info(f"🔀 Перебалансировка: перемещается {moved} сессий")
+
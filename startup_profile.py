@@ -0,0 +1,48 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfile:
+    """Время фаз запуска (импорты, база, бот, сессии) от начала импорта main
+
+    Выключенный профиль ничего не логирует, но фазы все равно считаются: это пара вызовов
+    perf_counter на фазу.
+    """
+
+    def __init__(self, enabled=False, started_at=None):
+        self.enabled = enabled
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def record(self, name, duration):
+        since = time.perf_counter() - self.started_at
+        with self._lock:
+            self.phases.append((name, duration, since))
+        if self.enabled:
+            logger.info(f"⏱ {name}: {duration * 1000:.0f} мс (от старта {since * 1000:.0f} мс)")
+
+    def mark(self, name):
+        """Веха без длительности: момент от старта"""
+        self.record(name, 0.0)
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def report(self):
+        """Сводка всех фаз в лог"""
+        if not self.enabled:
+            return
+        with self._lock:
+            phases = list(self.phases)
+        lines = [f"   {name:<28} {duration * 1000:>8.0f} мс {since * 1000:>9.0f} мс" for name, duration, since in phases]
+        logger.info("⏱ Профиль запуска (фаза, длительность, от старта):\n" + '\n'.join(lines))
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# Ошибки Telethon, после которых ключ сессии больше не действует и переподключаться бесполезно
+REVOKED_ERRORS = frozenset((
+    'AuthKeyUnregisteredError',
+    'AuthKeyInvalidError',
+    'AuthKeyPermEmptyError',
+    'AuthKeyDuplicatedError',
+    'SessionRevokedError',
+    'SessionExpiredError',
+    'UserDeactivatedError',
+    'UserDeactivatedBanError',
+))
+
+
+class SessionRevokedError(RuntimeError):
+    """Сессия не авторизована: ключ отозван или аккаунт удален"""
+
+
+def is_revoked(error):
+    return isinstance(error, SessionRevokedError) or type(error).__name__ in REVOKED_ERRORS
+
+
+def backoff_delay(attempt, base=1.0, cap=300.0, rng=random):
+    """Экспоненциальная задержка с полным джиттером: случайно в [0, min(cap, base * 2^attempt)]
+
+    Сессии, упавшие одновременно, расходятся по времени вместо одновременного повтора.
+    """
+    return rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class ReconnectLimiter:
+    """Общий для всех сессий token bucket переподключений (живет в общем loop)
+
+    Сетевой сбой роняет сотни сессий разом; без общего лимита они одновременно
+    пошли бы подключаться и получили бы FloodWait.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Очередь на замке сохраняет порядок ожидающих
+        async with self._lock:
+            while True:
+                now = self.clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
@@ -0,0 +1,55 @@
+import pytest
+
+import dedup
+from dedup import DedupStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dedup.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_repeat_is_suppressed_until_ttl_expires(clock):
+    store = DedupStore(ttl=10)
+    assert store.first_seen(1, -100, 5, "продам дом")
+    clock[0] += 9
+    assert not store.first_seen(1, -100, 5, "продам дом")
+    # Повтор продлевает окно
+    clock[0] += 9
+    assert not store.first_seen(1, -100, 5, "продам дом")
+    clock[0] += 11
+    assert store.first_seen(1, -100, 5, "продам дом")
+    assert store.suppressed == 2
+
+
+def test_same_text_in_other_chat_is_suppressed(clock):
+    store = DedupStore(ttl=10)
+    assert store.first_seen(1, -100, 5, "Продам  ДОМ")
+    # Пересылка: другой чат и ID, текст тот же с точностью до регистра и пробелов
+    assert not store.first_seen(1, -200, 77, "продам дом")
+    # Другому пользователю тот же текст приходит
+    assert store.first_seen(2, -200, 77, "продам дом")
+
+
+def test_same_message_id_in_other_chat_is_not_a_collision(clock):
+    store = DedupStore(ttl=10)
+    assert store.first_seen(1, -100, 5, "продам дом")
+    assert store.first_seen(1, -200, 5, "куплю машину")
+
+
+def test_edited_message_is_suppressed_within_ttl(clock):
+    store = DedupStore(ttl=10)
+    assert store.first_seen(1, -100, 5, "продам дом")
+    # Правка: тот же (чат, сообщение), новый текст
+    assert not store.first_seen(1, -100, 5, "продам дом недорого")
+    clock[0] += 11
+    assert store.first_seen(1, -100, 5, "продам дом совсем недорого")
+
+
+def test_memory_is_bounded(clock):
+    store = DedupStore(ttl=10, max_entries=4)
+    for message_id in range(10):
+        store.first_seen(1, -100, message_id, f"текст {message_id}")
+    assert len(store) <= 4
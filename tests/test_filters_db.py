@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+from main import CachedDatabase, Database
+
+# Один и тот же корень во всех режимах ввода
+ALL_MODES = ['дом', '"дом"', 'дом*', '~дом', '/д[оа]м/']
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'users.db')
+
+
+def test_every_mode_survives_reload(db_path):
+    db = CachedDatabase(db_path)
+    db.save_keywords(1, ALL_MODES, ['"дома"', 'дома'])
+    cached = db.get_user_settings(1)
+    db.close()
+
+    reloaded = Database(db_path)
+    assert reloaded.get_user_settings(1) == cached == (ALL_MODES, ['"дома"', 'дома'])
+    assert reloaded.load_all_filters()[1] == cached
+    reloaded.close()
+
+
+def test_users_by_pattern_respects_mode(db_path):
+    db = Database(db_path)
+    db.save_keywords(1, ['дом'], [])
+    db.save_keywords(2, ['"дом"'], [])
+    assert db.get_users_by_pattern('дом') == [1]
+    assert db.get_users_by_pattern('"дом"') == [2]
+    db.close()
+
+
+def test_migration_rebuilds_unique_key(db_path):
+    # Таблица в формате user_version 1: режим не входил в ключ
+    conn = sqlite3.connect(db_path)
+    conn.executescript('''
+        CREATE TABLE filters (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            pattern TEXT NOT NULL,
+            flags INTEGER DEFAULT 0,
+            UNIQUE (user_id, kind, pattern)
+        );
+        INSERT INTO filters (user_id, kind, pattern, flags) VALUES (1, 'keyword', 'дом', 0);
+        PRAGMA user_version = 1;
+    ''')
+    conn.close()
+
+    db = Database(db_path)
+    assert db.get_user_settings(1) == (['дом'], [])
+    db.save_keywords(1, ALL_MODES, [])
+    assert db.get_user_settings(1) == (ALL_MODES, [])
+    db.close()
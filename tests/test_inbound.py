@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from inbound import POLICY_DEGRADE, POLICY_DROP_OLDEST, POLICY_SAMPLE, InboundQueue
+
+
+def queued(inbound):
+    return [event for _, event in inbound._queue._queue]
+
+
+async def ignore(event, degraded):
+    pass
+
+
+def test_drop_oldest_keeps_newest_events():
+    async def run():
+        inbound = InboundQueue(ignore, maxsize=3, policy=POLICY_DROP_OLDEST)
+        for n in range(5):
+            inbound.put(n)
+        return inbound
+
+    inbound = asyncio.run(run())
+    assert queued(inbound) == [2, 3, 4]
+    stats = inbound.stats()
+    assert (stats['received'], stats['dropped'], stats['depth']) == (5, 2, 3)
+
+
+def test_sample_admits_every_nth_event_at_capacity():
+    async def run():
+        inbound = InboundQueue(ignore, maxsize=3, policy=POLICY_SAMPLE, sample_every=2)
+        for n in range(9):
+            inbound.put(n)
+        return inbound
+
+    inbound = asyncio.run(run())
+    # 3, 5, 7 отброшены сразу; 4, 6, 8 вытеснили самые старые
+    assert queued(inbound) == [4, 6, 8]
+    assert inbound.stats()['dropped'] == 6
+
+
+def test_sample_counter_resets_when_queue_has_room():
+    async def run():
+        inbound = InboundQueue(ignore, maxsize=1, policy=POLICY_SAMPLE, sample_every=3)
+        inbound.put(0)
+        inbound.put(1)
+        inbound._queue.get_nowait()
+        inbound._queue.task_done()
+        inbound.put(2)
+        inbound.put(3)
+        return inbound
+
+    inbound = asyncio.run(run())
+    # После свободного места отсчет начинается заново: 3 - первое переполнение, отброшено
+    assert queued(inbound) == [2]
+    assert inbound.stats()['dropped'] == 2
+
+
+def test_degrade_skips_entity_lookups_while_queue_is_half_full():
+    processed = []
+
+    async def process(event, degraded):
+        processed.append((event, degraded))
+
+    async def run():
+        inbound = InboundQueue(process, maxsize=4, consumers=1, policy=POLICY_DEGRADE)
+        for n in range(6):
+            inbound.put(n)
+        inbound.start()
+        await inbound._queue.join()
+        await inbound.stop()
+        return inbound
+
+    inbound = asyncio.run(run())
+    # При переполнении как drop_oldest; пока в очереди осталось >= половины - упрощенная обработка
+    assert processed == [(2, True), (3, True), (4, False), (5, False)]
+    stats = inbound.stats()
+    assert (stats['dropped'], stats['degraded'], stats['depth']) == (2, 2, 0)
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        InboundQueue(ignore, policy='drop_newest')
@@ -0,0 +1,134 @@
+import concurrent.futures
+import threading
+
+import pytest
+
+from leases import LeasedSessionManager
+from main import Database
+
+
+class FakeManager:
+    def __init__(self):
+        self.active_clients = {}
+        self.stopped = []
+        self.forgotten = []
+        self.started = []
+        self.restarted = []
+
+    def stop_session(self, user_id):
+        self.stopped.append(user_id)
+
+    def forget_user(self, user_id):
+        self.forgotten.append(user_id)
+
+    def start_sessions(self, users):
+        self.started.extend(user_id for user_id, _ in users)
+
+    def restart_session(self, user_id):
+        self.restarted.append(user_id)
+
+    def shutdown(self, timeout=None):
+        pass
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'users.db'))
+    for user_id in range(1, 5):
+        db.save_session(user_id, f"user{user_id}", f"session-{user_id}")
+    yield db
+    db.close()
+
+
+def node(db, node_id, renew_interval=1):
+    return LeasedSessionManager(FakeManager(), db, node_id, ttl=30, renew_interval=renew_interval)
+
+
+def test_first_node_gains_all_leases(db):
+    a = node(db, 'a')
+    gained, lost, changed, previous = a._renew()
+    assert sorted(gained) == [1, 2, 3, 4]
+    assert lost == changed == []
+    assert previous == {}
+    assert sorted(a.leases) == [1, 2, 3, 4]
+
+    gained, lost, changed, _ = a._renew()
+    assert gained == lost == changed == []
+
+
+def test_excess_leases_are_released_gradually(db):
+    a, b = node(db, 'a'), node(db, 'b')
+    a._renew()
+    # Второй узел: доля 2, но свободных аренд нет
+    assert b._renew()[0] == []
+
+    a._renew()
+    # Лишних две, за одно продление отдается половина (не меньше одной)
+    assert len(a.leases) == 3
+    assert len(a.manager.stopped) == 1
+    released = a.manager.stopped[0]
+    assert released not in a.leases
+    assert db.get_lease_holder(released) is None
+
+    assert b._renew()[0] == [released]
+    a._renew()
+    assert len(a.leases) == 2
+    assert sorted(b._renew()[0] + [released]) == sorted(set(range(1, 5)) - set(a.leases))
+
+
+def test_lost_and_changed_leases(db):
+    a = node(db, 'a')
+    a._renew()
+    with db.writer() as conn:
+        conn.execute("UPDATE session_leases SET node_id = 'b' WHERE user_id = 1")
+    db.bump_lease_revision(2, session=True)
+    db.bump_lease_revision(3)
+
+    gained, lost, changed, previous = a._renew()
+    assert gained == []
+    assert lost == [1]
+    assert sorted(changed) == [2, 3]
+    assert a.leases[2][1] == previous[2][1] + 1
+    assert a.leases[3][0] == previous[3][0] + 1
+
+
+def test_repeated_start_all_restarts_owned_sessions(db):
+    a = node(db, 'a', renew_interval=10)
+    a.start_all_sessions()
+    assert sorted(a.manager.started) == [1, 2, 3, 4]
+    assert a.manager.restarted == []
+
+    # Перезапуск из админки
+    a.start_all_sessions()
+    assert sorted(a.manager.restarted) == [1, 2, 3, 4]
+    a.shutdown(timeout=1)
+
+
+class AsyncStopManager(FakeManager):
+    """Остановка подтверждается позже из другого потока, как у шардов"""
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+        self.holder_at_stop = {}
+
+    def stop_session(self, user_id):
+        future = concurrent.futures.Future()
+
+        def acknowledge():
+            self.holder_at_stop[user_id] = self.db.get_lease_holder(user_id)
+            self.stopped.append(user_id)
+            future.set_result(None)
+
+        threading.Timer(0.1, acknowledge).start()
+        return future
+
+
+def test_lease_is_released_after_asynchronous_stop(db):
+    a = LeasedSessionManager(AsyncStopManager(db), db, 'a', ttl=30, renew_interval=1)
+    a._renew()
+    a.stop_session(1)
+    assert a.manager.stopped == [1]
+    # Пока клиент не отключен, аренда остается у узла
+    assert a.manager.holder_at_stop[1] == 'a'
+    assert db.get_lease_holder(1) is None
@@ -0,0 +1,74 @@
+import pytest
+
+import matcher
+from matcher import KeywordMatcher, SharedFilterIndex, compile_regex_set, validate_patterns
+
+
+def test_regex_set_allows_same_group_name_in_different_patterns():
+    regex, patterns = compile_regex_set([r'(?P<x>a)b', r'(?P<x>c)d'])
+    assert patterns == (r'(?P<x>a)b', r'(?P<x>c)d')
+    assert patterns[int(regex.search('zcd').lastgroup[2:])] == r'(?P<x>c)d'
+
+
+def test_regex_set_keeps_escaped_group_syntax():
+    regex, _ = compile_regex_set([r'\(?P<x>'])
+    assert regex.search('(?p<x>')
+
+
+def test_regex_set_returns_only_included_patterns():
+    # Первый не компилируется сам, третий ломает объединение (флаги не в начале)
+    regex, patterns = compile_regex_set(['(', 'дом', '(?i)кот', 'сад'])
+    assert patterns == ('дом', 'сад')
+    assert patterns[int(regex.search('сад').lastgroup[2:])] == 'сад'
+
+
+def test_regex_set_empty():
+    assert compile_regex_set(['(']) == (None, ())
+
+
+def test_validate_rejects_patterns_that_do_not_combine():
+    validate_patterns(['/(?P<x>a)b/', '/(?P<x>c)d/', 'дом'])
+    with pytest.raises(ValueError):
+        validate_patterns(['/дом/', '/(?i)кот/'])
+    with pytest.raises(ValueError):
+        validate_patterns(['/(a+)+/'])
+
+
+def test_scan_reports_the_pattern_that_matched():
+    matcher = KeywordMatcher(['/(?P<x>a)b/', '/(?P<x>c)d/', 'дом'], [])
+    assert matcher.scan('cd дом').keywords == {'/(?P<x>c)d/', 'дом'}
+
+
+@pytest.mark.parametrize('find_max', [0, 1000])
+def test_short_and_long_pattern_lists_match_the_same(monkeypatch, find_max):
+    monkeypatch.setattr(matcher, 'AUTOMATON_FIND_MAX', find_max)
+    keywords = ['дом', '"кот"', 'сад*', '~работа', 'аа']
+    m = KeywordMatcher(keywords, ['"дома"'])
+    assert m.scan('домик котик садовник работы ааа').keywords == {'дом', 'сад*', '~работа', 'аа'}
+    assert m.matches('домой кот')
+    assert not m.matches('иду дома')
+    assert not m.matches('котик')
+    index = SharedFilterIndex({1: (keywords, ['"дома"']), 2: (['кот'], [])})
+    assert index.scan('котик') == {2}
+    assert index.scan('кот дома') == {2}
+    assert index.scan('кот дом') == {1, 2}
+
+
+@pytest.mark.parametrize('find_max', [0, 1000])
+@pytest.mark.parametrize('keywords, exceptions, text', [
+    (['дом'], ['"дом"'], 'домик дом'),
+    (['дом'], ['"дом"'], 'домик'),
+    (['дом', 'кот'], ['"дом"'], 'домик кот дом'),
+    (['кот', 'дом*'], ['~дома'], 'кот домашний'),
+    (['кот'], ['"кот"'], 'котик котяра'),
+])
+def test_matches_agrees_with_scan(monkeypatch, find_max, keywords, exceptions, text):
+    monkeypatch.setattr(matcher, 'AUTOMATON_FIND_MAX', find_max)
+    m = KeywordMatcher(keywords, exceptions)
+    assert m.matches(text) == m.scan(text).matched
+
+
+def test_shared_literal_exception_is_not_skipped():
+    m = KeywordMatcher(['дом'], ['"дом"'])
+    assert not m.matches('домик дом')
+    assert m.matches('домик')
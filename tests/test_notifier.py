@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+from notifier import NotificationDispatcher
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class BadRequest(Exception):
+    pass
+
+
+class StubBot:
+    """Bot API без сети: запоминает отправленное, ошибки задаются функцией fail"""
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        if self.fail is not None:
+            error = self.fail(chat_id, text, parse_mode)
+            if error is not None:
+                raise error
+        with self.lock:
+            self.sent.append((time.monotonic(), chat_id, text, parse_mode))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "не дождались"
+        time.sleep(0.01)
+
+
+def dispatcher(bot, **kwargs):
+    kwargs.setdefault('global_rate', 1000)
+    kwargs.setdefault('chat_interval', 0)
+    return NotificationDispatcher(bot, **kwargs)
+
+
+@pytest.fixture
+def started():
+    dispatchers = []
+
+    def start(notifier):
+        dispatchers.append(notifier)
+        notifier.start()
+        return notifier
+
+    yield start
+    for notifier in dispatchers:
+        notifier.stop(timeout=1)
+
+
+def test_chat_interval_spaces_messages_to_one_chat(started):
+    bot = StubBot()
+    notifier = dispatcher(bot, chat_interval=0.2, digest_threshold=0)
+    for n in range(3):
+        notifier.submit(1, f"a{n}")
+    notifier.submit(2, "b")
+    started(notifier)
+    wait_for(lambda: len(bot.sent) == 4)
+
+    times = [sent_at for sent_at, chat_id, _, _ in bot.sent if chat_id == 1]
+    assert all(later - earlier >= 0.19 for earlier, later in zip(times, times[1:]))
+    # Другой чат не ждет интервала первого
+    other = next(sent_at for sent_at, chat_id, _, _ in bot.sent if chat_id == 2)
+    assert other < times[1]
+
+
+def test_backlog_is_merged_into_digest(started):
+    bot = StubBot()
+    notifier = dispatcher(bot, digest_threshold=3)
+    for n in range(5):
+        notifier.submit(1, f"совпадение {n}", parse_mode='Markdown')
+    started(notifier)
+    wait_for(lambda: notifier.queue_depth() == 0 and bot.sent)
+
+    assert len(bot.sent) == 1
+    _, _, text, parse_mode = bot.sent[0]
+    assert "Сводка: 5" in text and "совпадение 4" in text
+    assert parse_mode == 'Markdown'
+    assert notifier.stats()['digests'] == 1
+
+
+def test_retry_after_requeues_without_counting_attempts(started):
+    calls = []
+
+    def fail(chat_id, text, parse_mode):
+        calls.append(time.monotonic())
+        return RetryAfter(0.2) if len(calls) == 1 else None
+
+    bot = StubBot(fail)
+    notifier = started(dispatcher(bot, max_retries=0))
+    notifier.submit(1, "текст")
+    wait_for(lambda: bot.sent)
+
+    assert calls[1] - calls[0] >= 0.19
+    stats = notifier.stats()
+    assert (stats['sent'], stats['retries'], stats['failed']) == (1, 1, 0)
+
+
+def test_full_queue_drops_new_notifications():
+    notifier = dispatcher(StubBot(), max_queue=2)
+    assert notifier.submit(1, "a")
+    assert notifier.submit(2, "b")
+    assert not notifier.submit(3, "c")
+    assert notifier.stats()['dropped'] == 1
+    assert notifier.queue_depth() == 2
+
+
+def test_digest_with_broken_markdown_falls_back_to_single_alerts(started):
+    def fail(chat_id, text, parse_mode):
+        if parse_mode and 'битый_' in text:
+            return BadRequest("Can't parse entities: can't find end of the entity starting at byte offset 10")
+
+    bot = StubBot(fail)
+    notifier = dispatcher(bot, digest_threshold=3)
+    for text in ("первый", "битый_", "третий"):
+        notifier.submit(1, text, parse_mode='Markdown')
+    started(notifier)
+    wait_for(lambda: len(bot.sent) == 3)
+
+    delivered = {text: parse_mode for _, _, text, parse_mode in bot.sent}
+    assert delivered == {"первый": 'Markdown', "битый_": None, "третий": 'Markdown'}
+    assert notifier.stats()['failed'] == 0
@@ -0,0 +1,158 @@
+import datetime
+
+import pytest
+
+from main import Database, SessionManager
+from notifier import NotificationDispatcher
+
+
+class StubBot:
+    def send_message(self, chat_id, text, parse_mode=None):
+        pass
+
+
+class FakeSession:
+    def get_update_states(self):
+        return []
+
+
+class FakeClient:
+    disconnected = False
+    session = FakeSession()
+
+    async def disconnect(self):
+        self.disconnected = True
+
+
+@pytest.fixture
+def manager(tmp_path):
+    bot = StubBot()
+    notifier = NotificationDispatcher(bot, max_queue=100, global_rate=1000, chat_interval=0)
+    manager = SessionManager(0, '', Database(str(tmp_path / 'users.db')), bot, notifier=notifier)
+    yield manager
+    manager.shutdown(timeout=5)
+
+
+def test_stop_and_forget_release_inbound_consumers(manager):
+    client = FakeClient()
+
+    async def activate():
+        # Как _activate, но без регистрации обработчика Telethon
+        manager.active_clients[1] = client
+        inbound = manager._get_inbound(1)
+        inbound.start()
+        return list(inbound._tasks)
+
+    tasks = manager.runtime.call(activate(), timeout=5)
+    # Как при удалении пользователя: forget_user сразу после stop_session
+    stopped = manager.stop_session(1)
+    manager.forget_user(1)
+    stopped.result(timeout=5)
+
+    assert client.disconnected
+    assert 1 not in manager.inbound
+    assert tasks and all(task.done() for task in tasks)
+
+
+def test_filters_are_loaded_before_activation(manager):
+    manager.db.set_chat_rule(1, 'include_chat', -100)
+
+    manager.runtime.call(manager._load_filters(1), timeout=5)
+
+    assert manager.prefilters[1].include_chats == {-100}
+    assert manager.filters._matchers[1] is not None
+
+
+class StubMessage:
+    def __init__(self, message_id, text):
+        self.id = message_id
+        self.text = text
+        self.message = text
+        self.date = datetime.datetime(2026, 1, 1, 12, 0, 0)
+
+
+class StubEvent:
+    """Событие NewMessage или MessageEdited: для handle_message они одинаковы"""
+
+    def __init__(self, chat_id, message_id, text):
+        self.message = StubMessage(message_id, text)
+        self.chat_id = chat_id
+        self.sender_id = 7
+        self.is_channel = True
+
+
+def test_edits_go_through_match_and_dedup(manager, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(manager.notifier, 'submit', lambda user_id, text, parse_mode=None: submitted.append(text))
+    manager.filters.set(1, ['дом'], [])
+
+    def handle(text):
+        manager.runtime.call(manager.handle_message(1, StubEvent(-100, 5, text), degraded=True), timeout=5)
+
+    handle("продам машину")
+    assert submitted == []
+    # Правка добавила ключевое слово - уведомление уходит
+    handle("продам машину и дом")
+    assert len(submitted) == 1
+    # Повторная правка того же сообщения гасится дедупликацией
+    handle("продам машину и дом, торг")
+    assert len(submitted) == 1
+    assert manager.dedup.suppressed == 1
+
+
+class RecordingHistory:
+    def __init__(self):
+        self.rows = []
+
+    def record(self, user_id, chat_id, sender_id, message_id, text, keywords=()):
+        self.rows.append((user_id, message_id, set(keywords)))
+
+    def stop(self):
+        pass
+
+
+def test_history_keeps_keywords_of_the_alert(manager, monkeypatch):
+    monkeypatch.setattr(manager.notifier, 'submit', lambda user_id, text, parse_mode=None: None)
+    manager.history = RecordingHistory()
+    manager.filters.set(1, ['дом'], [])
+    first_seen = manager.dedup.first_seen
+
+    def change_filter(*args):
+        # Фильтр сменился уже после проверки сообщения
+        manager.filters.set(1, ['машина'], [])
+        return first_seen(*args)
+
+    monkeypatch.setattr(manager.dedup, 'first_seen', change_filter)
+    manager.runtime.call(manager.handle_message(1, StubEvent(-100, 5, "продам дом"), degraded=True), timeout=5)
+
+    assert manager.history.rows == [(1, 5, {'дом'})]
+
+
+class StubMe:
+    id = 7
+    first_name = 'Test'
+    username = 'test'
+
+
+class VerifiedClient(FakeClient):
+    async def get_me(self):
+        return StubMe()
+
+
+def test_failed_promotion_disconnects_client(manager, monkeypatch):
+    client = VerifiedClient()
+
+    async def connect(session_string):
+        return client
+
+    async def broken_filters(user_id):
+        raise RuntimeError("база недоступна")
+
+    monkeypatch.setattr(manager, '_connect', connect)
+    monkeypatch.setattr(manager, '_load_filters', broken_filters)
+
+    with pytest.raises(RuntimeError):
+        manager.runtime.call(manager._add_session(1, 'test', 'session', promote=True), timeout=5)
+
+    assert client.disconnected
+    assert 1 not in manager.active_clients
@@ -0,0 +1,119 @@
+import queue
+
+import pytest
+
+from sharding import EMPTY_STATS, ShardedSessionManager, merge_stats, shard_for
+
+
+def test_merge_stats_sums_counters_and_takes_max_latency():
+    first = {'active_sessions': 2, 'notifier': {'sent': 3, 'latency_max': 0.5}}
+    second = {'active_sessions': 1, 'notifier': {'sent': 4, 'latency_max': 0.2}}
+    merged = merge_stats([EMPTY_STATS, first, second])
+    assert merged['active_sessions'] == 3
+    assert merged['notifier']['sent'] == 7
+    assert merged['notifier']['latency_max'] == 0.5
+
+
+def test_merge_stats_unions_per_user_sections():
+    user_stats = {'depth': 1, 'received': 5, 'dropped': 0, 'degraded': 0, 'lag_last': 0.1, 'lag_max': 0.3}
+    first = {'reconnecting': {101: 2}, 'inbound_users': {101: user_stats}}
+    second = {'reconnecting': {202: 1}, 'inbound_users': {}}
+    merged = merge_stats([EMPTY_STATS, first, second])
+    assert merged['reconnecting'] == {101: 2, 202: 1}
+    assert merged['inbound_users'] == {101: user_stats}
+
+
+class FakeProcess:
+    pid = 0
+    exitcode = None
+    alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self, timeout=None):
+        self.alive = False
+
+
+class FakeDatabase:
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def get_user_session(self, user_id):
+        return self.sessions.get(user_id)
+
+    def get_all_active_users(self):
+        return list(self.sessions.items())
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    def spawn(self, shard_id):
+        self._workers[shard_id] = (FakeProcess(), queue.Queue())
+        self._live.add(shard_id)
+
+    monkeypatch.setattr(ShardedSessionManager, '_spawn', spawn)
+    sessions = {user_id: f"session-{user_id}" for user_id in range(20)}
+    manager = ShardedSessionManager(FakeDatabase(sessions), shards=2)
+    yield manager
+    manager.shutdown(timeout=0)
+
+
+def test_shard_for_without_live_shards():
+    assert shard_for(1, []) is None
+
+
+def test_startup_progress_completes_when_all_shards_die(manager):
+    manager.start_all_sessions()
+    assert manager.startup_progress.pending == 20
+    manager._on_state(manager.assignments[0], 0, True)
+
+    with manager._lock:
+        manager._on_shard_died(0, 1)
+    # Сессии упавшего шарда переехали и ждут подтверждения от живого
+    assert set(manager.assignments.values()) == {1}
+    assert manager.startup_progress.pending == 19
+
+    with manager._lock:
+        manager._on_shard_died(1, 1)
+    assert manager.assignments == {}
+    assert manager.startup_progress.ready
+    assert manager.startup_progress.live == 1
+    assert manager.owner(5) is None
+    manager.start_session(5, 'session-5')
+    assert manager.assignments == {}
+
+
+def test_start_sessions_without_live_shards_fails_them(manager):
+    with manager._lock:
+        manager._on_shard_died(0, 1)
+        manager._on_shard_died(1, 1)
+    manager.start_all_sessions()
+    assert manager.startup_progress.ready
+    assert manager.startup_progress.failed == 20
+    assert manager.stats()['shards'] == '0/2'
+
+
+def test_stop_session_waits_for_shard_acknowledgement(manager):
+    manager.start_session(3, 'session-3')
+    shard_id = manager.assignments[3]
+    commands = manager._workers[shard_id][1]
+    assert commands.get_nowait() == ('start', 3, 'session-3')
+
+    stopped = manager.stop_session(3)
+    action, request_id, user_id = commands.get_nowait()
+    assert (action, user_id) == ('stop', 3)
+    assert not stopped.done()
+
+    manager._on_done(request_id, True, None)
+    assert stopped.result(timeout=1) is None
+
+
+def test_pending_stop_resolves_when_shard_dies(manager):
+    manager.start_session(3, 'session-3')
+    shard_id = manager.assignments[3]
+    stopped = manager.stop_session(3)
+    with manager._lock:
+        manager._on_shard_died(shard_id, 1)
+    assert stopped.result(timeout=1) is None
+    assert manager.stop_session(3).result(timeout=1) is None
@@ -0,0 +1,89 @@
+import asyncio
+import random
+
+import pytest
+
+import supervisor
+from supervisor import ReconnectLimiter, SessionRevokedError, backoff_delay, is_revoked
+
+
+class FixedRandom:
+    """uniform(a, b) всегда возвращает долю fraction отрезка"""
+
+    def __init__(self, fraction):
+        self.fraction = fraction
+
+    def uniform(self, a, b):
+        return a + (b - a) * self.fraction
+
+
+@pytest.mark.parametrize('attempt, ceiling', [(0, 2.0), (1, 4.0), (3, 16.0), (10, 300.0), (50, 300.0)])
+def test_backoff_bounds_and_cap(attempt, ceiling):
+    assert backoff_delay(attempt, base=2.0, cap=300.0, rng=FixedRandom(1.0)) == ceiling
+    assert backoff_delay(attempt, base=2.0, cap=300.0, rng=FixedRandom(0.0)) == 0.0
+
+
+def test_backoff_jitter_stays_in_range():
+    rng = random.Random(1)
+    delays = [backoff_delay(4, base=1.0, cap=10.0, rng=rng) for _ in range(1000)]
+    assert all(0.0 <= delay <= 10.0 for delay in delays)
+    # Полный джиттер: задержки разбросаны по всему отрезку
+    assert min(delays) < 1.0 and max(delays) > 9.0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(supervisor.asyncio, 'sleep', clock.sleep)
+    return clock
+
+
+def test_limiter_allows_burst_then_paces(clock):
+    limiter = ReconnectLimiter(rate=2, burst=3, clock=clock)
+
+    async def run():
+        for _ in range(5):
+            await limiter.acquire()
+
+    asyncio.run(run())
+    # Три сразу из запаса, дальше по одному каждые 1/rate секунды
+    assert clock.sleeps == [0.5, 0.5]
+    assert clock.now == 1.0
+
+
+def test_limiter_refills_up_to_burst(clock):
+    limiter = ReconnectLimiter(rate=2, burst=3, clock=clock)
+
+    async def take(count):
+        for _ in range(count):
+            await limiter.acquire()
+
+    asyncio.run(take(3))
+    clock.now += 100
+    asyncio.run(take(3))
+    assert clock.sleeps == []
+    # Запас не больше burst: четвертая попытка уже ждет
+    asyncio.run(take(1))
+    assert clock.sleeps == [0.5]
+
+
+def test_revoked_errors_are_recognized():
+    class AuthKeyUnregisteredError(Exception):
+        pass
+
+    assert is_revoked(SessionRevokedError())
+    assert is_revoked(AuthKeyUnregisteredError())
+    assert not is_revoked(ConnectionError())
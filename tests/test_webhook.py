@@ -0,0 +1,68 @@
+import http.client
+import os
+import queue
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from webhook import LocalWebhookServer
+
+RECORDED_UPDATE = os.path.join(os.path.dirname(__file__), 'data', 'update_message.json')
+
+
+class FakeDispatcher:
+    """Очередь обновлений вместо Dispatcher PTB"""
+
+    bot = None
+
+    def __init__(self):
+        self.update_queue = queue.Queue()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = LocalWebhookServer(FakeDispatcher(), port=0, path='hook')
+    server.start()
+    yield server
+    server.stop(timeout=5)
+
+
+def post(server, path, body):
+    conn = http.client.HTTPConnection(server.host, server.port, timeout=5)
+    try:
+        conn.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def test_recorded_update_reaches_queue(server):
+    with open(RECORDED_UPDATE, 'rb') as f:
+        assert post(server, '/hook', f.read()) == 200
+
+    update = server.dispatcher.update_queue.get(timeout=5)
+    assert update.update_id == 875301234
+    assert update.message.text == '/history'
+    assert update.effective_user.id == 123456789
+    assert server.received == 1
+
+
+def test_wrong_path_is_rejected(server):
+    with open(RECORDED_UPDATE, 'rb') as f:
+        assert post(server, '/other', f.read()) == 404
+    assert server.dispatcher.update_queue.empty()
+    assert server.rejected == 1
+
+
+def test_bad_json_is_rejected(server):
+    assert post(server, '/hook', b'{"update_id": ') == 400
+    assert post(server, '/hook', b'') == 400
+    assert server.dispatcher.update_queue.empty()
+    assert server.rejected == 2
@@ -0,0 +1,89 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Telegram не присылает обновления больше нескольких сотен КБ
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class LocalWebhookServer:
+    """Свой HTTP приемник вебхука без tornado
+
+    Слушает локальный адрес за обратным прокси (или для тестов) и кладет обновления
+    в очередь Dispatcher, дальше их разбирает пул потоков бота. Проверить можно так:
+    curl -d @update.json http://127.0.0.1:PORT/<path>
+    """
+
+    def __init__(self, dispatcher, host='127.0.0.1', port=8443, path='/'):
+        self.dispatcher = dispatcher
+        self.host = host
+        self.port = port
+        self.path = path if path.startswith('/') else f'/{path}'
+        self.received = 0
+        self.rejected = 0
+        self._httpd = None
+        self._threads = []
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                status = server.handle(self.path, self.headers, self.rfile)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+    def handle(self, path, headers, body):
+        """Разбор одного POST; возвращает HTTP статус"""
+        from telegram import Update
+
+        if path != self.path:
+            self.rejected += 1
+            return 404
+        try:
+            length = int(headers.get('Content-Length', 0))
+        except ValueError:
+            length = 0
+        if not 0 < length <= MAX_BODY_SIZE:
+            self.rejected += 1
+            return 400
+        try:
+            data = json.loads(body.read(length).decode('utf-8'))
+            update = Update.de_json(data, self.dispatcher.bot)
+        except Exception as e:
+            logger.warning(f"⚠️ Некорректное обновление вебхука: {e}")
+            self.rejected += 1
+            return 400
+        # Ответ Telegram сразу, обработка в потоках Dispatcher
+        self.dispatcher.update_queue.put(update)
+        self.received += 1
+        return 200
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        self._httpd.daemon_threads = True
+        # port=0 - свободный порт от ОС
+        self.port = self._httpd.server_address[1]
+        for target, name in ((self.dispatcher.start, "dispatcher"), (self._httpd.serve_forever, "webhook")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"🌐 Локальный вебхук слушает http://{self.host}:{self.port}{self.path}")
+
+    def stop(self, timeout=10):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+        self.dispatcher.stop()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []